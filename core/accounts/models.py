@@ -32,6 +32,9 @@ class User(AbstractBaseUser, PermissionsMixin, BaseModel):
         ordering = ['-date_joined']
         indexes = [
             models.Index(fields=['email']),
+            # Keyset pagination, over all users and per role
+            models.Index(fields=['created_at', 'id'], name='user_created_id_idx'),
+            models.Index(fields=['role', 'created_at', 'id'], name='user_role_created_id_idx'),
         ]
 
     def __str__(self):
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from chat.models import Thread, Message
+from chat.models import Thread, Message, KnowledgeCollection
 
 # Register your models here.
 # register Thread and message model
@@ -37,3 +37,8 @@ class MessageAdmin(admin.ModelAdmin):
     ai_response_short.short_description = 'AI Response'
 
 
+
+@admin.register(KnowledgeCollection)
+class KnowledgeCollectionAdmin(admin.ModelAdmin):
+    list_display = ('restaurant_uid', 'collection_name', 'version', 'updated_at')
+    search_fields = ('restaurant_uid', 'collection_name')
@@ -1,9 +1,85 @@
-from typing import List, Optional
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import AsyncIterator, Callable, List, Optional, Tuple
 from decouple import config
 from agno.agent import Agent
 from agno.models.openai import OpenAIChat
 from agno.knowledge import Knowledge
 from agno.models.message import Message
+from agno.run.agent import RunEvent, RunOutput
+from asgiref.sync import sync_to_async
+
+from chat.context import context_assembler
+from chat.invalidation import register_handler
+from chat.metrics import record_run
+from chat.timing import stage
+from chat.tools import make_exclusion_tool
+
+# Retrieval modes:
+# - inject: retrieve once before the model call and add the references to the prompt (one model call)
+# - tool: the model decides when to call `search_knowledge_base`
+# - hybrid: inject references, with the search tool available as a fallback
+RETRIEVAL_INJECT = 'inject'
+RETRIEVAL_TOOL = 'tool'
+RETRIEVAL_HYBRID = 'hybrid'
+RETRIEVAL_MODES = (RETRIEVAL_INJECT, RETRIEVAL_TOOL, RETRIEVAL_HYBRID)
+
+CHAT_RETRIEVAL_MODE = config("CHAT_RETRIEVAL_MODE", default=RETRIEVAL_INJECT)
+
+RETRIEVAL_INSTRUCTIONS = {
+    RETRIEVAL_INJECT: [
+        "Your PRIMARY RESOURCE is the knowledge base references provided with each message.",
+        "Answer restaurant and menu questions (food items, ingredients, prices, website, social media) from those references.",
+        "If the references do not contain the answer, say so politely instead of guessing.",
+    ],
+    RETRIEVAL_TOOL: [
+        "Your PRIMARY RESOURCE is the knowledge base. ALWAYS search it first for ANY restaurant or menu information.",
+        "When asked about the MENU, food items, ingredients, prices, website, or social media, ALWAYS use the `search_knowledge_base` tool.",
+        "DO NOT say you don't have information until you have actively used the tool to search for keywords like 'menu', 'food', or specific dish names.",
+    ],
+    RETRIEVAL_HYBRID: [
+        "Your PRIMARY RESOURCE is the knowledge base references provided with each message.",
+        "Answer from those references when they cover the question.",
+        "Only if they do not, use the `search_knowledge_base` tool with more specific keywords before saying you don't have the information.",
+    ],
+}
+
+
+SUMMARIZER_INSTRUCTIONS = [
+    "You are a conversation summarizer.",
+    "Your task is to update a rolling summary based on a previous summary and the latest turn.",
+    "Maintain key facts, USER NAMES, user preferences, and important context.",
+    "NEVER omit the user's name if it was mentioned in the history or latest turn.",
+    "Keep the summary concise but highly informative.",
+    "Output ONLY the new summary text.",
+]
+
+
+@lru_cache(maxsize=1)
+def get_chat_model() -> OpenAIChat:
+    """
+    Get the process-wide OpenAI model.
+    Sharing one instance keeps the underlying HTTP client (and its TLS
+    keep-alive connections) alive across requests and restaurants.
+    """
+    return OpenAIChat(
+        id="gpt-4o-mini",
+        api_key=config("OPENAI_API_KEY"),
+    )
+
+
+@lru_cache(maxsize=1)
+def get_summarizer_agent() -> Agent:
+    """
+    Get the process-wide summarizer agent.
+    The summarizer has no restaurant specific state, so one instance serves every thread.
+    """
+    return Agent(
+        model=get_chat_model(),
+        instructions=SUMMARIZER_INSTRUCTIONS,
+    )
 
 
 class RestaurantAgent:
@@ -11,7 +87,13 @@ class RestaurantAgent:
     AI agent for handling restaurant-related queries with RAG.
     """
 
-    def __init__(self, restaurant_uid: str, restaurant_name: str, knowledge: Knowledge):
+    def __init__(
+        self,
+        restaurant_uid: str,
+        restaurant_name: str,
+        knowledge: Knowledge,
+        retrieval_mode: str = CHAT_RETRIEVAL_MODE,
+    ):
         """
         Initialize the restaurant agent.
 
@@ -19,40 +101,64 @@ class RestaurantAgent:
             restaurant_uid: Unique identifier for the restaurant
             restaurant_name: Display name of the restaurant
             knowledge: Knowledge base instance for this restaurant
+            retrieval_mode: One of `RETRIEVAL_MODES`
         """
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{retrieval_mode}', expected one of {RETRIEVAL_MODES}")
+
         self.restaurant_uid = restaurant_uid
         self.restaurant_name = restaurant_name
         self.knowledge = knowledge
+        self.retrieval_mode = retrieval_mode
 
-        # Initialize OpenAI model
-        openai_api_key = config("OPENAI_API_KEY")
-        self.model = OpenAIChat(
-            id="gpt-4o-mini",
-            api_key=openai_api_key,
-        )
+        # Shared OpenAI model (one HTTP client per process)
+        self.model = get_chat_model()
 
         # Create Agno agent with knowledge base and memory
         self.agent = Agent(
             name=f"{restaurant_name} Assistant",
             model=self.model,
             knowledge=knowledge,
-            # Enable RAG features
-            search_knowledge=True,
-            add_knowledge_to_context=True,
+            # RAG features, per retrieval mode
+            search_knowledge=retrieval_mode in (RETRIEVAL_TOOL, RETRIEVAL_HYBRID),
+            add_knowledge_to_context=retrieval_mode in (RETRIEVAL_INJECT, RETRIEVAL_HYBRID),
+            # Deduplicated, ranked and packed into the per-request token budget
+            knowledge_retriever=context_assembler,
+            # Exact "items without X" answers from the precomputed exclusion index
+            tools=[make_exclusion_tool(restaurant_uid)],
             description=f"Official AI assistant for {self.restaurant_name}.",
             instructions=[
                 f"You are the professional and official AI assistant for {self.restaurant_name}.",
-                "Your PRIMARY RESOURCE is the knowledge base. ALWAYS search it first for ANY restaurant or menu information.",
+                *RETRIEVAL_INSTRUCTIONS[retrieval_mode],
                 "USE the 'CONVERSATION HISTORY SUMMARY' (provided in context) to remember user names and preferences.",
-                "When asked about the MENU, food items, ingredients, prices, website, or social media, ALWAYS use the `search_knowledge_base` tool.",
-                "DO NOT say you don't have information until you have actively used the tool to search for keywords like 'menu', 'food', or specific dish names.",
                 "Provide detailed menu descriptions and prices exactly as they appear in the knowledge base.",
                 "Handle allergy queries by suggesting safe items based on the provided ingredient lists.",
+                "For questions about items WITHOUT an allergen or ingredient (or safe for an allergy), use the `menu_items_without` tool.",
                 "Maintain a helpful, friendly, and professional tone.",
             ],
             markdown=True,
         )
 
+    @property
+    def embedder(self):
+        """
+        Embedder of this restaurant's knowledge base.
+        """
+        return self.knowledge.vector_db.embedder
+
+    def _run_kwargs(self, rolling_summary: Optional[str]) -> dict:
+        """
+        Build per-run keyword arguments for the agent.
+        The rolling summary is passed per run instead of mutating the shared agent,
+        so concurrent requests for the same restaurant never see each other's context.
+        """
+        if not rolling_summary:
+            return {}
+        return {
+            "dependencies": {"CONVERSATION HISTORY SUMMARY": rolling_summary},
+            "add_dependencies_to_context": True,
+        }
+
     def chat(self, message: str, rolling_summary: Optional[str] = None) -> str:
         """
         Process a user message and return the AI response.
@@ -61,49 +167,145 @@ class RestaurantAgent:
             message: User's message
             rolling_summary: Concise summary of the previous conversation
         """
-        # Inject rolling summary as additional context for the model
-        if rolling_summary:
-            self.agent.additional_context = f"CONVERSATION HISTORY SUMMARY: {rolling_summary}"
+        started = time.perf_counter()
+        with stage('llm'):
+            response = self.agent.run(message, **self._run_kwargs(rolling_summary))
+        self._record(time.perf_counter() - started, response)
+        return _response_content(response)
 
-        # Get response from agent
-        response = self.agent.run(message)
+    async def achat(self, message: str, rolling_summary: Optional[str] = None) -> str:
+        """
+        Async version of `chat` using agno's async run path.
 
-        # Extract content from response
-        if hasattr(response, 'content'):
-            return response.content
-        return str(response)
+        Args:
+            message: User's message
+            rolling_summary: Concise summary of the previous conversation
+        """
+        started = time.perf_counter()
+        with stage('llm'):
+            response = await self.agent.arun(message, **self._run_kwargs(rolling_summary))
+        await sync_to_async(self._record)(time.perf_counter() - started, response)
+        return _response_content(response)
+
+    async def astream_chat(self, message: str, rolling_summary: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Stream the AI response as content chunks while the model generates them.
+
+        Args:
+            message: User's message
+            rolling_summary: Concise summary of the previous conversation
+
+        Yields:
+            Text chunks of the response, in order
+        """
+        started = time.perf_counter()
+        stream = self.agent.arun(
+            message, stream=True, yield_run_output=True, **self._run_kwargs(rolling_summary)
+        )
+        with stage('llm'):
+            async for event in stream:
+                if isinstance(event, RunOutput):
+                    # Final run output, carrying metrics and tool calls
+                    await sync_to_async(self._record)(time.perf_counter() - started, event)
+                    continue
+                if getattr(event, 'event', None) != RunEvent.run_content.value:
+                    continue
+                if isinstance(event.content, str) and event.content:
+                    yield event.content
+
+    def _record(self, seconds: float, response):
+        """
+        Record latency, token usage and knowledge tool calls for this retrieval mode.
+        """
+        record_run(
+            self.retrieval_mode,
+            self.restaurant_uid,
+            seconds,
+            metrics=getattr(response, 'metrics', None),
+            tools=getattr(response, 'tools', None),
+        )
 
     def summarize(self, current_summary: Optional[str], user_message: str, ai_response: str) -> str:
         """
         Generate an updated rolling summary of the conversation.
         This is an O(1) operation regarding history length.
         """
-        summary_agent = Agent(
-            model=self.model,
-            instructions=[
-                "You are a conversation summarizer.",
-                "Your task is to update a rolling summary based on a previous summary and the latest turn.",
-                "Maintain key facts, USER NAMES, user preferences, and important context.",
-                "NEVER omit the user's name if it was mentioned in the history or latest turn.",
-                "Keep the summary concise but highly informative.",
-                "Output ONLY the new summary text.",
-            ]
-        )
+        return summarize_conversation(current_summary, [(user_message, ai_response)])
+
+    async def asummarize(self, current_summary: Optional[str], user_message: str, ai_response: str) -> str:
+        """
+        Async version of `summarize`.
+        """
+        return await asummarize_conversation(current_summary, [(user_message, ai_response)])
+
+
+def format_turns(turns: List[Tuple[str, str]]) -> str:
+    """
+    Render (user message, AI response) pairs as a plain transcript.
+    """
+    return "\n".join(f"User: {user_message}\nAI: {ai_response}" for user_message, ai_response in turns)
+
+
+def build_conversation_context(summary: Optional[str], pending_turns: List[Tuple[str, str]]) -> Optional[str]:
+    """
+    Combine the latest completed rolling summary with turns it does not cover yet.
+
+    Args:
+        summary: Latest completed rolling summary, if any
+        pending_turns: (user message, AI response) pairs not yet folded into the summary
 
-        prompt = f"""
+    Returns:
+        Context text for the agent, or None if there is no history
+    """
+    parts = []
+    if summary:
+        parts.append(summary)
+    if pending_turns:
+        parts.append(f"Most recent turns (not yet in the summary):\n{format_turns(pending_turns)}")
+    return "\n\n".join(parts) or None
+
+
+def _summary_prompt(current_summary: Optional[str], turns: List[Tuple[str, str]]) -> str:
+    return f"""
 Existing Summary: {current_summary or 'No previous context.'}
 
-Latest Turn:
-User: {user_message}
-AI: {ai_response}
+Latest Turns:
+{format_turns(turns)}
 
-Please provide an updated, concise version of the summary that includes the latest turn.
+Please provide an updated, concise version of the summary that includes the latest turns.
 """
-        response = summary_agent.run(prompt)
 
-        if hasattr(response, 'content'):
-            return response.content.strip()
-        return str(response).strip()
+
+def summarize_conversation(current_summary: Optional[str], turns: List[Tuple[str, str]]) -> str:
+    """
+    Fold one or more new turns into a rolling summary using the shared summarizer.
+
+    Args:
+        current_summary: Previous rolling summary, if any
+        turns: (user message, AI response) pairs in chronological order
+
+    Returns:
+        Updated summary text
+    """
+    response = get_summarizer_agent().run(_summary_prompt(current_summary, turns))
+    return _response_content(response).strip()
+
+
+async def asummarize_conversation(current_summary: Optional[str], turns: List[Tuple[str, str]]) -> str:
+    """
+    Async version of `summarize_conversation`.
+    """
+    response = await get_summarizer_agent().arun(_summary_prompt(current_summary, turns))
+    return _response_content(response).strip()
+
+
+def _response_content(response) -> str:
+    """
+    Extract the text content from an agent run response.
+    """
+    if hasattr(response, 'content'):
+        return response.content
+    return str(response)
 
 
 def create_restaurant_agent(restaurant_uid: str, restaurant_name: str, knowledge: Knowledge) -> RestaurantAgent:
@@ -119,3 +321,92 @@ def create_restaurant_agent(restaurant_uid: str, restaurant_name: str, knowledge
         Configured RestaurantAgent instance
     """
     return RestaurantAgent(restaurant_uid, restaurant_name, knowledge)
+
+
+class AgentPool:
+    """
+    Process-level pool of RestaurantAgent instances keyed by restaurant UID.
+    Bounded in size with least-recently-used eviction. An entry is rebuilt when the
+    restaurant is renamed or its knowledge base instance changes.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        factory: Callable[[str, str, Knowledge], RestaurantAgent] = create_restaurant_agent,
+    ):
+        """
+        Args:
+            max_size: Maximum number of agents kept alive in this process
+            factory: Callable used to build a new agent on a miss
+        """
+        self.max_size = max_size
+        self.factory = factory
+        self._agents: "OrderedDict[str, RestaurantAgent]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, restaurant_uid: str, restaurant_name: str, knowledge: Knowledge) -> RestaurantAgent:
+        """
+        Get a warm agent for the restaurant, building one if needed.
+
+        Args:
+            restaurant_uid: Unique identifier for the restaurant
+            restaurant_name: Current name of the restaurant
+            knowledge: Current knowledge base instance for the restaurant
+
+        Returns:
+            RestaurantAgent instance
+        """
+        with self._lock:
+            agent = self._agents.get(restaurant_uid)
+            if agent is not None:
+                if agent.restaurant_name == restaurant_name and agent.knowledge is knowledge:
+                    self._agents.move_to_end(restaurant_uid)
+                    return agent
+                # Stale entry (renamed restaurant or reloaded knowledge)
+                del self._agents[restaurant_uid]
+
+        # Build outside the lock so a slow construction does not block other restaurants
+        agent = self.factory(restaurant_uid, restaurant_name, knowledge)
+
+        with self._lock:
+            self._agents[restaurant_uid] = agent
+            self._agents.move_to_end(restaurant_uid)
+            while len(self._agents) > self.max_size:
+                self._agents.popitem(last=False)
+        return agent
+
+    def invalidate(self, restaurant_uid: Optional[str] = None):
+        """
+        Drop the pooled agent for a restaurant, or every agent if no UID is given.
+
+        Args:
+            restaurant_uid: Optional restaurant UID
+        """
+        with self._lock:
+            if restaurant_uid:
+                self._agents.pop(restaurant_uid, None)
+            else:
+                self._agents.clear()
+
+    def __len__(self):
+        return len(self._agents)
+
+
+agent_pool = AgentPool(max_size=config("CHAT_AGENT_POOL_SIZE", default=256, cast=int))
+register_handler(agent_pool.invalidate)
+
+
+def get_restaurant_agent(restaurant_uid: str, restaurant_name: str, knowledge: Knowledge) -> RestaurantAgent:
+    """
+    Get a pooled restaurant agent, reusing a warm instance when possible.
+
+    Args:
+        restaurant_uid: Unique identifier for the restaurant
+        restaurant_name: Name of the restaurant
+        knowledge: Knowledge base instance
+
+    Returns:
+        RestaurantAgent instance
+    """
+    return agent_pool.get(restaurant_uid, restaurant_name, knowledge)
@@ -0,0 +1,159 @@
+"""
+Semantic answer cache for restaurant chat.
+Answers near-duplicate questions for the same restaurant without calling the LLM.
+Entries are keyed on the restaurant's knowledge version, so every knowledge sync
+invalidates them automatically.
+"""
+import logging
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from decouple import config
+from django.core.cache import cache
+
+from chat.knowledge import aget_knowledge_version
+from chat.metrics import increment_counters
+
+logger = logging.getLogger(__name__)
+
+ENTRIES_KEY = "chat:answers:{restaurant_uid}:v{version}"
+STATS_KEY = "chat:answers:stats:{restaurant_uid}:{outcome}"
+
+
+@dataclass
+class CacheLookup:
+    """
+    Result of an answer cache lookup.
+    Carries the question embedding and version so a miss can be stored without re-embedding.
+    """
+    restaurant_uid: str
+    version: int
+    embedding: Optional[List[float]] = None
+    answer: Optional[str] = None
+    similarity: float = 0.0
+
+    @property
+    def hit(self) -> bool:
+        return self.answer is not None
+
+
+class SemanticAnswerCache:
+    """
+    Per-restaurant cache of (question embedding, answer) pairs stored in the Django cache.
+    """
+
+    def __init__(self, enabled: bool, threshold: float, max_entries: int, timeout: int):
+        """
+        Args:
+            enabled: Whether lookups and stores are performed at all
+            threshold: Minimum cosine similarity for a cached question to count as a match
+            max_entries: Maximum entries kept per restaurant (oldest dropped first)
+            timeout: Cache timeout in seconds for a restaurant's entries
+        """
+        self.enabled = enabled
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.timeout = timeout
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    async def alookup(self, restaurant_uid: str, question: str, embedder) -> Optional[CacheLookup]:
+        """
+        Look up a cached answer for a near-duplicate question.
+
+        Args:
+            restaurant_uid: Restaurant UID
+            question: Incoming user question
+            embedder: Embedder used for the restaurant's knowledge base
+
+        Returns:
+            CacheLookup (hit or miss), or None when the cache is disabled or unavailable
+        """
+        if not self.enabled:
+            return None
+
+        try:
+            version = await aget_knowledge_version(restaurant_uid)
+            lookup = CacheLookup(restaurant_uid=restaurant_uid, version=version)
+            lookup.embedding = await embedder.async_get_embedding(question)
+
+            entries = await cache.aget(ENTRIES_KEY.format(restaurant_uid=restaurant_uid, version=version)) or []
+            if entries and lookup.embedding:
+                matrix = np.asarray([entry['embedding'] for entry in entries], dtype=np.float32)
+                similarities = matrix @ self._normalize(lookup.embedding)
+                best = int(np.argmax(similarities))
+                lookup.similarity = float(similarities[best])
+                if lookup.similarity >= self.threshold:
+                    lookup.answer = entries[best]['answer']
+
+            outcome = 'hit' if lookup.hit else 'miss'
+            logger.info(f"Answer cache {outcome} for {restaurant_uid} (similarity {lookup.similarity:.3f})")
+            await self._record(restaurant_uid, outcome)
+            return lookup
+        except Exception as e:
+            logger.error(f"Error looking up answer cache for {restaurant_uid}: {str(e)}", exc_info=True)
+            return None
+
+    async def astore(self, lookup: Optional[CacheLookup], question: str, answer: str):
+        """
+        Store an answer for the question of a previous miss.
+
+        Args:
+            lookup: The miss returned by `alookup`
+            question: The user question
+            answer: The generated answer
+        """
+        if not self.enabled or lookup is None or lookup.hit or not lookup.embedding or not answer:
+            return
+
+        key = ENTRIES_KEY.format(restaurant_uid=lookup.restaurant_uid, version=lookup.version)
+        try:
+            entries = await cache.aget(key) or []
+            entries.append({
+                'question': question,
+                'embedding': self._normalize(lookup.embedding).tolist(),
+                'answer': answer,
+            })
+            await cache.aset(key, entries[-self.max_entries:], timeout=self.timeout)
+        except Exception as e:
+            logger.error(f"Error storing answer cache for {lookup.restaurant_uid}: {str(e)}", exc_info=True)
+
+    @staticmethod
+    async def _record(restaurant_uid: str, outcome: str):
+        await sync_to_async(increment_counters)({
+            STATS_KEY.format(restaurant_uid=scope, outcome=outcome): 1 for scope in (restaurant_uid, 'all')
+        })
+
+    @staticmethod
+    def stats(restaurant_uid: str = 'all') -> dict:
+        """
+        Hit/miss counters for a restaurant, or for all restaurants.
+
+        Args:
+            restaurant_uid: Restaurant UID, or 'all'
+
+        Returns:
+            Dict with hits, misses and hit_rate
+        """
+        hits = cache.get(STATS_KEY.format(restaurant_uid=restaurant_uid, outcome='hit'), 0)
+        misses = cache.get(STATS_KEY.format(restaurant_uid=restaurant_uid, outcome='miss'), 0)
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / total, 4) if total else 0.0,
+        }
+
+
+answer_cache = SemanticAnswerCache(
+    enabled=config("CHAT_ANSWER_CACHE_ENABLED", default=True, cast=bool),
+    threshold=config("CHAT_ANSWER_CACHE_THRESHOLD", default=0.95, cast=float),
+    max_entries=config("CHAT_ANSWER_CACHE_MAX_ENTRIES", default=200, cast=int),
+    timeout=config("CHAT_ANSWER_CACHE_TIMEOUT", default=60 * 60 * 24, cast=int),
+)
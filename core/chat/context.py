@@ -0,0 +1,266 @@
+"""
+Token-budgeted context assembly for restaurant chat.
+Retrieved knowledge documents are deduplicated, ranked and packed into a fixed
+token budget before they reach the model, so prompt size no longer grows with
+menu size. Used as the agno `knowledge_retriever` of every restaurant agent.
+"""
+import asyncio
+import logging
+import math
+import re
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from decouple import config
+
+from chat.metrics import record_context
+from chat.router import CONTAINS_RE, MENU_LIST_RE, PRICE_RE, normalize
+from chat.timing import stage
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken is optional; fall back to a character estimate
+    _ENCODING = None
+
+QUERY_LOOKUP = 'lookup'
+QUERY_OVERVIEW = 'overview'
+QUERY_GENERAL = 'general'
+
+# Documents fetched from the vector store per query type
+MAX_RESULTS_BY_QUERY_TYPE = {
+    QUERY_LOOKUP: config("CHAT_CONTEXT_MAX_RESULTS_LOOKUP", default=4, cast=int),
+    QUERY_GENERAL: config("CHAT_CONTEXT_MAX_RESULTS_GENERAL", default=8, cast=int),
+    QUERY_OVERVIEW: config("CHAT_CONTEXT_MAX_RESULTS_OVERVIEW", default=12, cast=int),
+}
+
+# Document types preferred first for each query type (lower ranks first)
+TYPE_PRIORITY = {
+    QUERY_LOOKUP: {'menu': 0, 'ingredient': 1, 'restaurant': 2},
+    QUERY_GENERAL: {'menu': 0, 'restaurant': 0, 'ingredient': 1},
+    QUERY_OVERVIEW: {'restaurant': 0, 'menu': 1, 'ingredient': 2},
+}
+
+OVERVIEW_RE = re.compile(r"\b(recommend|suggest|popular|best|options|dishes|everything|all)\b")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count (or, without tiktoken, estimate) the tokens of a text.
+    """
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+def classify_query(query: str) -> str:
+    """
+    Classify a query to decide how much context it needs.
+
+    Returns:
+        QUERY_LOOKUP for a specific item question, QUERY_OVERVIEW for menu-wide questions,
+        otherwise QUERY_GENERAL
+    """
+    text = normalize(query)
+    if MENU_LIST_RE.search(text) or OVERVIEW_RE.search(text):
+        return QUERY_OVERVIEW
+    if PRICE_RE.search(text) or CONTAINS_RE.search(text):
+        return QUERY_LOOKUP
+    return QUERY_GENERAL
+
+
+@dataclass
+class AssemblyStats:
+    """
+    Documents and tokens at each stage of one context assembly.
+    """
+    query_type: str
+    budget: int
+    retrieved: int = 0
+    retrieved_tokens: int = 0
+    deduped: int = 0
+    deduped_tokens: int = 0
+    packed: int = 0
+    packed_tokens: int = 0
+    truncated: int = 0
+
+
+@dataclass
+class AssembledContext:
+    """
+    Documents selected for the prompt, with the stats of how they were chosen.
+    """
+    documents: List[Dict] = field(default_factory=list)
+    stats: Optional[AssemblyStats] = None
+
+
+def _document_key(document: Dict) -> Optional[Tuple[str, str, int]]:
+    """
+    Identity of the record chunk a document was rendered from, if known.
+    """
+    meta = document.get('meta_data') or {}
+    doc_type = meta.get('type')
+    uid = meta.get(f"{doc_type}_uid") or (meta.get('restaurant_uid') if doc_type == 'restaurant' else None)
+    return (doc_type, uid, meta.get('chunk', 0)) if doc_type and uid else None
+
+
+def _shingles(text: str) -> set:
+    words = normalize(text).split()
+    return {" ".join(words[i:i + 3]) for i in range(max(len(words) - 2, 1))}
+
+
+def _truncate(content: str, budget: int) -> str:
+    """
+    Keep whole leading lines of a document while they fit the budget.
+    """
+    kept, used = [], 0
+    for line in content.splitlines():
+        tokens = count_tokens(line + "\n")
+        if used + tokens > budget:
+            break
+        kept.append(line)
+        used += tokens
+    return "\n".join(kept)
+
+
+class ContextAssembler:
+    """
+    Dedupe, rank and pack retrieved documents into a token budget.
+    """
+
+    def __init__(self, budget_tokens: int, similarity_threshold: float = 0.9, min_truncated_tokens: int = 64):
+        """
+        Args:
+            budget_tokens: Maximum knowledge tokens added to a prompt
+            similarity_threshold: Shingle overlap above which two documents count as duplicates
+            min_truncated_tokens: Smallest remainder worth filling with a truncated document
+        """
+        self.budget_tokens = budget_tokens
+        self.similarity_threshold = similarity_threshold
+        self.min_truncated_tokens = min_truncated_tokens
+
+    def dedupe(self, documents: List[Dict]) -> List[Dict]:
+        """
+        Drop repeated records and near-identical chunks, keeping the best-ranked copy.
+        """
+        seen_keys, kept, kept_shingles = set(), [], []
+        for document in documents:
+            key = _document_key(document)
+            if key is not None and key in seen_keys:
+                continue
+            shingles = _shingles(document.get('content') or '')
+            if any(
+                len(shingles & other) / (len(shingles | other) or 1) >= self.similarity_threshold
+                for other in kept_shingles
+            ):
+                continue
+            if key is not None:
+                seen_keys.add(key)
+            kept.append(document)
+            kept_shingles.append(shingles)
+        return kept
+
+    @staticmethod
+    def rank(documents: List[Dict], query_type: str) -> List[Dict]:
+        """
+        Order documents by type preference for the query, then by retrieval order.
+        """
+        priority = TYPE_PRIORITY[query_type]
+        positions = {id(document): position for position, document in enumerate(documents)}
+        return sorted(
+            documents,
+            key=lambda d: (priority.get((d.get('meta_data') or {}).get('type'), 3), positions[id(d)]),
+        )
+
+    def pack(self, documents: List[Dict], stats: AssemblyStats) -> List[Dict]:
+        """
+        Greedily fill the budget in rank order; a document that does not fit is
+        truncated to the remaining budget if enough of it is left, else skipped.
+        """
+        packed, used = [], 0
+        for document in documents:
+            content = document.get('content') or ''
+            tokens = count_tokens(content)
+            remaining = self.budget_tokens - used
+            if tokens > remaining:
+                if remaining < self.min_truncated_tokens:
+                    continue
+                content = _truncate(content, remaining)
+                tokens = count_tokens(content)
+                if not content:
+                    continue
+                document = {**document, 'content': content}
+                stats.truncated += 1
+            packed.append(document)
+            used += tokens
+        stats.packed = len(packed)
+        stats.packed_tokens = used
+        return packed
+
+    def assemble(self, documents: List[Dict], query_type: str) -> AssembledContext:
+        """
+        Run the dedupe, rank and pack stages over retrieved documents.
+
+        Args:
+            documents: Retrieved documents (agno document dicts) in similarity order
+            query_type: Result of `classify_query`
+
+        Returns:
+            AssembledContext with the packed documents and per-stage stats
+        """
+        stats = AssemblyStats(query_type=query_type, budget=self.budget_tokens)
+        stats.retrieved = len(documents)
+        stats.retrieved_tokens = sum(count_tokens(d.get('content') or '') for d in documents)
+
+        unique = self.dedupe(documents)
+        stats.deduped = len(unique)
+        stats.deduped_tokens = sum(count_tokens(d.get('content') or '') for d in unique)
+
+        packed = self.pack(self.rank(unique, query_type), stats)
+        logger.info(
+            "Context assembled " + " ".join(f"{key}={value}" for key, value in asdict(stats).items())
+        )
+        record_context(stats)
+        return AssembledContext(documents=packed, stats=stats)
+
+    def retrieve(self, agent, query: str, num_documents: Optional[int] = None, **kwargs) -> Optional[List[Dict]]:
+        """
+        Search the agent's knowledge and assemble the result (sync).
+        """
+        with stage('retrieval'):
+            query_type = classify_query(query)
+            documents = agent.knowledge.search(query=query, max_results=MAX_RESULTS_BY_QUERY_TYPE[query_type])
+            return self.assemble([d.to_dict() for d in documents], query_type).documents or None
+
+    async def aretrieve(self, agent, query: str, num_documents: Optional[int] = None, **kwargs) -> Optional[List[Dict]]:
+        """
+        Search the agent's knowledge and assemble the result (async).
+        """
+        with stage('retrieval'):
+            query_type = classify_query(query)
+            documents = await agent.knowledge.asearch(query=query, max_results=MAX_RESULTS_BY_QUERY_TYPE[query_type])
+            assembled = await sync_to_async(self.assemble)([d.to_dict() for d in documents], query_type)
+        return assembled.documents or None
+
+    def __call__(self, agent, query: str, num_documents: Optional[int] = None, **kwargs):
+        """
+        agno `knowledge_retriever` entry point.
+        Inside an event loop (`Agent.arun`) a coroutine is returned, which agno awaits,
+        so retrieval never blocks the loop; `Agent.run` gets the documents directly.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return self.retrieve(agent, query, num_documents, **kwargs)
+        return self.aretrieve(agent, query, num_documents, **kwargs)
+
+
+context_assembler = ContextAssembler(
+    budget_tokens=config("CHAT_CONTEXT_TOKEN_BUDGET", default=1500, cast=int),
+    similarity_threshold=config("CHAT_CONTEXT_DEDUPE_THRESHOLD", default=0.9, cast=float),
+)
@@ -0,0 +1,165 @@
+"""
+Embedders for restaurant knowledge bases, selected with KNOWLEDGE_EMBEDDER:
+
+- `openai` (default): the OpenAI embeddings API.
+- `local`: a sentence-transformers model loaded from KNOWLEDGE_EMBEDDER_PATH,
+  run on CPU (or KNOWLEDGE_EMBEDDER_DEVICE) in vectorized batches; no network.
+- `hashing`: deterministic feature hashing, for tests and offline benchmarks.
+
+Every knowledge base of a process shares one embedder instance. Vectors of
+different embedders are not comparable (nor, usually, of the same size), so
+switching embedders needs a rebuild: `sync_knowledge_base --rebuild`.
+"""
+import hashlib
+import logging
+import re
+import threading
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from decouple import config
+from agno.knowledge.embedder.base import Embedder
+
+logger = logging.getLogger(__name__)
+
+KNOWLEDGE_EMBEDDER = config("KNOWLEDGE_EMBEDDER", default="openai")
+KNOWLEDGE_EMBEDDER_PATH = config("KNOWLEDGE_EMBEDDER_PATH", default="")
+KNOWLEDGE_EMBEDDER_DEVICE = config("KNOWLEDGE_EMBEDDER_DEVICE", default="cpu")
+KNOWLEDGE_EMBEDDER_DIMENSIONS = config("KNOWLEDGE_EMBEDDER_DIMENSIONS", default=384, cast=int)
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+class BatchEmbedderMixin:
+    """
+    agno embedder methods derived from a vectorized `get_embeddings_batch`.
+    """
+
+    def get_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+    def get_embedding(self, text: str) -> List[float]:
+        return self.get_embeddings_batch([text])[0]
+
+    def get_embedding_and_usage(self, text: str) -> Tuple[List[float], Optional[Dict]]:
+        return self.get_embedding(text), None
+
+    async def async_get_embedding(self, text: str) -> List[float]:
+        # CPU-bound: run off the event loop
+        return await sync_to_async(self.get_embedding, thread_sensitive=False)(text)
+
+    async def async_get_embedding_and_usage(self, text: str) -> Tuple[List[float], Optional[Dict]]:
+        return await self.async_get_embedding(text), None
+
+    async def async_get_embeddings_batch_and_usage(
+        self, texts: List[str]
+    ) -> Tuple[List[List[float]], List[Optional[Dict]]]:
+        embeddings = await sync_to_async(self.get_embeddings_batch, thread_sensitive=False)(texts)
+        return embeddings, [None] * len(embeddings)
+
+
+@dataclass
+class HashingEmbedder(BatchEmbedderMixin, Embedder):
+    """
+    Deterministic embedder hashing words and word pairs into a fixed number of signed buckets.
+    Texts sharing words get similar vectors, so retrieval still behaves sensibly in tests.
+    """
+    dimensions: Optional[int] = 384
+    enable_batch: bool = True
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        words = TOKEN_RE.findall(text.lower())
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], 'little') % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return np.stack([self._embed(text) for text in texts]).tolist()
+
+
+@dataclass
+class LocalEmbedder(BatchEmbedderMixin, Embedder):
+    """
+    sentence-transformers model loaded from a local path, encoding whole batches at once.
+    The model is loaded on first use, once per process.
+    """
+    path: str = ""
+    device: str = "cpu"
+    dimensions: Optional[int] = None
+    enable_batch: bool = True
+    batch_size: int = 64
+    _model: Any = field(default=None, init=False, repr=False)
+    _lock: Any = field(default_factory=threading.Lock, init=False, repr=False)
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    try:
+                        from sentence_transformers import SentenceTransformer
+                    except ImportError:
+                        raise ImportError(
+                            "`sentence-transformers` not installed, please run `pip install sentence-transformers`"
+                        )
+                    if not self.path:
+                        raise ValueError("KNOWLEDGE_EMBEDDER_PATH must point to a local model directory")
+                    model = SentenceTransformer(self.path, device=self.device, local_files_only=True)
+                    self.dimensions = model.get_sentence_embedding_dimension()
+                    logger.info(f"Loaded local embedder {self.path} on {self.device} ({self.dimensions} dimensions)")
+                    self._model = model
+        return self._model
+
+    def get_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        embeddings = self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        )
+        return embeddings.tolist()
+
+
+def _openai_embedder() -> Embedder:
+    from agno.knowledge.embedder.openai import OpenAIEmbedder
+    return OpenAIEmbedder()
+
+
+EMBEDDER_BACKENDS = {
+    'openai': _openai_embedder,
+    'local': lambda: LocalEmbedder(path=KNOWLEDGE_EMBEDDER_PATH, device=KNOWLEDGE_EMBEDDER_DEVICE),
+    'hashing': lambda: HashingEmbedder(dimensions=KNOWLEDGE_EMBEDDER_DIMENSIONS),
+}
+
+
+@lru_cache(maxsize=None)
+def _build_embedder(backend: str) -> Embedder:
+    if backend not in EMBEDDER_BACKENDS:
+        raise ValueError(f"Unknown embedder {backend!r}; expected one of {', '.join(EMBEDDER_BACKENDS)}")
+    logger.info(f"Using {backend} embedder for knowledge bases")
+    return EMBEDDER_BACKENDS[backend]()
+
+
+def get_embedder(backend: Optional[str] = None) -> Embedder:
+    """
+    Get the process-wide embedder of a backend.
+
+    Args:
+        backend: Embedder backend (KNOWLEDGE_EMBEDDER if None)
+
+    Raises:
+        ValueError: For an unknown backend
+    """
+    return _build_embedder(backend or KNOWLEDGE_EMBEDDER)
@@ -0,0 +1,203 @@
+"""
+Cross-process invalidation of restaurant-level caches.
+Knowledge instances and pooled agents live in each Gunicorn and Celery process;
+clearing them in the process that rebuilt or removed a knowledge base leaves
+every other process serving stale objects. Invalidations are therefore
+broadcast on a Redis pub/sub channel, and each process clears its own copies.
+
+Every invalidation also increments a per-restaurant version in the shared
+cache. Processes remember the last version they applied and compare it on
+each knowledge lookup (read together with the collection pointer), so a
+process that missed a message (listener reconnecting, Redis blip) catches up
+on its next request. Answer caches are keyed on the knowledge version, which
+the publisher bumps once for everyone.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "chat:invalidate"
+INVALIDATION_VERSION_KEY = "chat:invalidation_version:{restaurant_uid}"
+
+# Seconds between reconnection attempts of the listener
+LISTENER_RETRY_SECONDS = 5
+
+# Callables clearing one restaurant's process-local state, registered by their owners
+_handlers: List[Callable[[str], None]] = []
+# Last version applied in this process, per restaurant
+_applied_versions: Dict[str, int] = {}
+_lock = threading.Lock()
+_listener_pid: Optional[int] = None
+# Shared Redis client of this process: (pid, url, client)
+_redis = (None, None, None)
+
+
+def register_handler(handler: Callable[[str], None]):
+    """
+    Register a callable that drops a restaurant's process-local state, given its UID.
+    """
+    if handler not in _handlers:
+        _handlers.append(handler)
+
+
+def _run_handlers(restaurant_uid: str):
+    for handler in _handlers:
+        try:
+            handler(restaurant_uid)
+        except Exception as e:
+            logger.error(f"Error invalidating {restaurant_uid} in {handler}: {str(e)}", exc_info=True)
+
+
+def _apply(restaurant_uid: str, version: int):
+    """
+    Run the handlers for a restaurant unless this process already applied the version.
+    """
+    with _lock:
+        if _applied_versions.get(restaurant_uid, -1) >= version:
+            return
+        _applied_versions[restaurant_uid] = version
+    _run_handlers(restaurant_uid)
+
+
+def check_version(restaurant_uid: str, version: Optional[int]):
+    """
+    Drop stale process-local state if the restaurant was invalidated since this process last looked.
+
+    Args:
+        restaurant_uid: Restaurant UID
+        version: Current invalidation version read from the cache (None if never invalidated)
+    """
+    ensure_listener()
+    version = version or 0
+    with _lock:
+        applied = _applied_versions.get(restaurant_uid)
+        if applied is None:
+            # First lookup in this process: nothing older can be cached yet
+            _applied_versions[restaurant_uid] = version
+            return
+    if version > applied:
+        logger.info(f"Restaurant {restaurant_uid} invalidated while this process was not listening")
+        _apply(restaurant_uid, version)
+
+
+def invalidate_restaurant(restaurant_uid: str) -> Optional[int]:
+    """
+    Invalidate a restaurant's knowledge instances, pooled agents and cached answers in every process.
+
+    Args:
+        restaurant_uid: Restaurant UID
+
+    Returns:
+        New invalidation version, or None if the cache backend is unavailable
+    """
+    from chat.knowledge import bump_knowledge_version
+
+    restaurant_uid = str(restaurant_uid)
+    key = INVALIDATION_VERSION_KEY.format(restaurant_uid=restaurant_uid)
+    try:
+        cache.add(key, 0, timeout=None)
+        version = cache.incr(key)
+    except Exception as e:
+        logger.error(f"Error bumping invalidation version for {restaurant_uid}: {str(e)}", exc_info=True)
+        version = None
+
+    # Cached answers are shared; one bump invalidates them for every process
+    bump_knowledge_version(restaurant_uid)
+
+    if version is not None:
+        _apply(restaurant_uid, version)
+        _publish({'restaurant_uid': restaurant_uid, 'version': version})
+    else:
+        _run_handlers(restaurant_uid)
+    return version
+
+
+def redis_url() -> Optional[str]:
+    """
+    Location of the Redis server behind the default cache, if it is Redis.
+    """
+    default = settings.CACHES.get('default', {})
+    if 'redis' not in default.get('BACKEND', '').lower():
+        return None
+    location = default.get('LOCATION')
+    return location[0] if isinstance(location, (list, tuple)) else location
+
+
+def redis_client():
+    """
+    Redis client of the default cache's server, if it is Redis.
+    One client (and connection pool) per process, rebuilt after a fork.
+    """
+    global _redis
+    url = redis_url()
+    if url is None:
+        return None
+    pid = os.getpid()
+    if _redis[:2] != (pid, url):
+        with _lock:
+            if _redis[:2] != (pid, url):
+                import redis
+                _redis = (pid, url, redis.Redis.from_url(url))
+    return _redis[2]
+
+
+def _publish(message: dict):
+    try:
+        client = redis_client()
+        if client is None:
+            return
+        client.publish(INVALIDATION_CHANNEL, json.dumps(message))
+    except Exception as e:
+        # Other processes catch up through the version check
+        logger.error(f"Error publishing invalidation {message}: {str(e)}", exc_info=True)
+
+
+def handle_message(data):
+    """
+    Apply an invalidation received on the channel.
+    """
+    try:
+        message = json.loads(data)
+        _apply(str(message['restaurant_uid']), int(message['version']))
+    except Exception as e:
+        logger.error(f"Invalid invalidation message {data!r}: {str(e)}", exc_info=True)
+
+
+def _listen(url: str):
+    import redis
+
+    while True:
+        try:
+            pubsub = redis.Redis.from_url(url).pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            for message in pubsub.listen():
+                handle_message(message['data'])
+        except Exception as e:
+            logger.error(f"Invalidation listener disconnected: {str(e)}", exc_info=True)
+        time.sleep(LISTENER_RETRY_SECONDS)
+
+
+def ensure_listener():
+    """
+    Start this process's listener thread, once per process (again after a fork).
+    """
+    global _listener_pid
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    with _lock:
+        if _listener_pid == pid:
+            return
+        _listener_pid = pid
+        url = redis_url()
+        if url is None:
+            return
+        threading.Thread(target=_listen, args=(url,), name='chat-invalidation', daemon=True).start()
@@ -3,19 +3,119 @@ Knowledge base management for restaurant chat using Agno v2 and ChromaDB.
 Provides per-restaurant knowledge base instances with dynamic configuration.
 """
 import os
-from typing import Dict, Optional
+import sys
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from asgiref.sync import async_to_sync
 from decouple import config
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
 from agno.knowledge import Knowledge
 from agno.vectordb.chroma import ChromaDb
 
+from chat.embedders import get_embedder
+from chat.invalidation import INVALIDATION_VERSION_KEY, check_version, invalidate_restaurant, register_handler
 
-# Cache for knowledge base instances per restaurant
-_knowledge_cache: Dict[str, Knowledge] = {}
+
+logger = logging.getLogger(__name__)
+
+KNOWLEDGE_VERSION_KEY = "chat:knowledge_version:{restaurant_uid}"
+ACTIVE_COLLECTION_KEY = "chat:knowledge_collection:{restaurant_uid}"
+
+
+@dataclass(frozen=True)
+class ChromaSettings:
+    """
+    Chroma connection settings, read from the environment once per process.
+    """
+    path: str
+    host: Optional[str]
+    port: Optional[int]
+    tenant: str
+    database: str
+    api_key: Optional[str]
+    ssl: bool
+
+    @classmethod
+    def from_env(cls) -> "ChromaSettings":
+        port = config("CHROMA_DB_PORT", default=None)
+        return cls(
+            path=config("CHROMA_DB_PATH", default="chroma_data"),
+            host=config("CHROMA_DB_HOST", default=None),
+            port=int(port) if port else None,
+            tenant=config("CHROMA_TENANT", default="default"),
+            database=config("CHROMA_DATABASE", default="default"),
+            api_key=config("CHROMA_API_KEY", default=None),
+            ssl=config("CHROMA_SSL", default=False, cast=bool),
+        )
+
+
+_chroma_settings: Optional[ChromaSettings] = None
+_chroma_client = None
+_chroma_client_pid: Optional[int] = None
+_chroma_client_lock = threading.Lock()
+
+
+def get_chroma_settings() -> ChromaSettings:
+    global _chroma_settings
+    if _chroma_settings is None:
+        _chroma_settings = ChromaSettings.from_env()
+    return _chroma_settings
+
+
+def _create_chroma_client(settings: ChromaSettings):
+    import chromadb
+
+    if settings.host:
+        # Chroma Cloud or a remote server; the HTTP client pools its connections
+        client_kwargs = {
+            "host": settings.host,
+            "ssl": settings.ssl,
+            "tenant": settings.tenant,
+            "database": settings.database,
+        }
+        if settings.port:
+            client_kwargs["port"] = settings.port
+        if settings.api_key:
+            from chromadb.config import Settings
+            client_kwargs["settings"] = Settings(
+                chroma_client_auth_provider="chromadb.auth.token_authn.TokenAuthClientProvider",
+                chroma_client_auth_credentials=settings.api_key
+            )
+        return chromadb.HttpClient(**client_kwargs)
+
+    # Local persistent ChromaDB (development)
+    # Ensure the directory exists
+    os.makedirs(settings.path, exist_ok=True)
+    return chromadb.PersistentClient(path=settings.path)
+
+
+def get_chroma_client():
+    """
+    Get the process-wide Chroma client shared by every restaurant collection.
+    Created on first use, and again in a forked child (worker processes must not
+    share the parent's connections or SQLite handles).
+    """
+    global _chroma_client, _chroma_client_pid
+    pid = os.getpid()
+    if _chroma_client is not None and _chroma_client_pid == pid:
+        return _chroma_client
+    with _chroma_client_lock:
+        if _chroma_client is None or _chroma_client_pid != pid:
+            _chroma_client = _create_chroma_client(get_chroma_settings())
+            _chroma_client_pid = pid
+        return _chroma_client
 
 
 def get_chroma_db(collection_name: str) -> ChromaDb:
     """
-    Get ChromaDB instance with dynamic configuration.
+    Get ChromaDB instance for a collection, backed by the shared process client.
     Supports local persistent storage and remote Chroma Cloud / Production servers.
 
     Args:
@@ -24,57 +124,301 @@ def get_chroma_db(collection_name: str) -> ChromaDb:
     Returns:
         Configured ChromaDb instance
     """
-    chroma_path = config("CHROMA_DB_PATH", default="chroma_data")
-    chroma_host = config("CHROMA_DB_HOST", default=None)
-    chroma_port_raw = config("CHROMA_DB_PORT", default=None)
-    chroma_port = int(chroma_port_raw) if chroma_port_raw else None
+    settings = get_chroma_settings()
+    embedder = get_embedder()
+    if settings.host:
+        vector_db = ChromaDb(collection=collection_name, embedder=embedder, persistent_client=False)
+    else:
+        vector_db = ChromaDb(collection=collection_name, embedder=embedder, path=settings.path, persistent_client=True)
 
-    chroma_tenant = config("CHROMA_TENANT", default="default")
-    chroma_database = config("CHROMA_DATABASE", default="default")
-    chroma_api_key = config("CHROMA_API_KEY", default=None)
-    chroma_ssl = config("CHROMA_SSL", default=False, cast=bool)
+    # agno would otherwise open a client per ChromaDb instance
+    vector_db._client = get_chroma_client()
+    return vector_db
 
-    # Note: For Chroma Cloud or remote servers, we use HttpClient settings
-    # Agno passes extra kwargs to the underlying Chroma client
-    client_kwargs = {}
 
-    if chroma_host:
-        client_kwargs["host"] = chroma_host
-        if chroma_port:
-            client_kwargs["port"] = chroma_port
+def default_collection_name(restaurant_uid: str) -> str:
+    """
+    Collection of a restaurant that was never rebuilt.
+    """
+    return f"restaurant_{restaurant_uid}"
 
-        client_kwargs["ssl"] = chroma_ssl
-        client_kwargs["tenant"] = chroma_tenant
-        client_kwargs["database"] = chroma_database
 
-        if chroma_api_key:
-            from chromadb.config import Settings
-            client_kwargs["settings"] = Settings(
-                chroma_client_auth_provider="chromadb.auth.token_authn.TokenAuthClientProvider",
-                chroma_client_auth_credentials=chroma_api_key
-            )
+def versioned_collection_name(restaurant_uid: str, version: int) -> str:
+    return f"restaurant_{restaurant_uid}_v{version}"
 
-        return ChromaDb(
-            collection=collection_name,
-            persistent_client=False,
-            **client_kwargs
-        )
 
-    # Use local persistent ChromaDB (development)
-    # Ensure the directory exists
-    os.makedirs(chroma_path, exist_ok=True)
+def get_active_collection(restaurant_uid: str) -> Tuple[str, int]:
+    """
+    Resolve the active collection pointer of a restaurant.
+    Read from the cache, falling back to the database on a miss. The database value
+    is cached with `add`, so a reader that loaded it before a swap can never
+    overwrite the newer pointer the swap wrote.
+
+    Returns:
+        (collection name, version); version 0 is the unversioned default collection
+    """
+    key = ACTIVE_COLLECTION_KEY.format(restaurant_uid=restaurant_uid)
+    pointer = cache.get(key)
+    if pointer is None:
+        from chat.models import KnowledgeCollection
+
+        row = KnowledgeCollection.objects.filter(restaurant_uid=restaurant_uid).first()
+        pointer = (row.collection_name, row.version) if row else (default_collection_name(restaurant_uid), 0)
+        cache.add(key, pointer, timeout=None)
+    return tuple(pointer)
+
+
+async def aget_active_collection(restaurant_uid: str) -> Tuple[str, int]:
+    """
+    Async version of `get_active_collection`.
+    """
+    key = ACTIVE_COLLECTION_KEY.format(restaurant_uid=restaurant_uid)
+    pointer = await cache.aget(key)
+    if pointer is None:
+        from chat.models import KnowledgeCollection
+
+        row = await KnowledgeCollection.objects.filter(restaurant_uid=restaurant_uid).afirst()
+        pointer = (row.collection_name, row.version) if row else (default_collection_name(restaurant_uid), 0)
+        await cache.aadd(key, pointer, timeout=None)
+    return tuple(pointer)
+
+
+def swap_active_collection(restaurant_uid: str, collection_name: str, version: int, expected_version: int) -> bool:
+    """
+    Atomically point a restaurant at a new collection, if the pointer is still at expected_version.
+    The compare-and-swap makes concurrent rebuilds safe: only one of them wins.
 
-    return ChromaDb(
-        collection=collection_name,
-        path=chroma_path,
-        persistent_client=True,
+    Args:
+        restaurant_uid: Restaurant UID
+        collection_name: Collection to activate
+        version: Version of that collection
+        expected_version: Version the rebuild started from
+
+    Returns:
+        True if the pointer was swapped
+    """
+    from chat.models import KnowledgeCollection
+
+    with transaction.atomic():
+        swapped = bool(KnowledgeCollection.objects.filter(
+            restaurant_uid=restaurant_uid, version=expected_version
+        ).update(collection_name=collection_name, version=version))
+        if not swapped and expected_version == 0:
+            # First rebuild: no pointer row yet
+            try:
+                with transaction.atomic():
+                    KnowledgeCollection.objects.create(
+                        restaurant_uid=restaurant_uid, collection_name=collection_name, version=version
+                    )
+                swapped = True
+            except IntegrityError:
+                pass
+
+    if swapped:
+        # Overwrite (not delete) the cached pointer, so a concurrent reader cannot cache the old one
+        cache.set(ACTIVE_COLLECTION_KEY.format(restaurant_uid=restaurant_uid), (collection_name, version), timeout=None)
+    # Drop the knowledge instances and agents of every process
+    invalidate_restaurant(restaurant_uid)
+    return swapped
+
+
+def drop_active_collection(restaurant_uid: str) -> str:
+    """
+    Remove the collection pointer of a deleted restaurant.
+
+    Returns:
+        Name of the collection that was active, for the caller to delete
+    """
+    from chat.models import KnowledgeCollection
+
+    collection_name, _ = get_active_collection(restaurant_uid)
+    KnowledgeCollection.objects.filter(restaurant_uid=restaurant_uid).delete()
+    cache.set(
+        ACTIVE_COLLECTION_KEY.format(restaurant_uid=restaurant_uid),
+        (default_collection_name(restaurant_uid), 0), timeout=None,
     )
+    return collection_name
+
+
+def build_knowledge(restaurant_uid: str, collection_name: str) -> Knowledge:
+    """
+    Create a Knowledge instance over a given collection of a restaurant.
+    """
+    return Knowledge(
+        name=f"Restaurant {restaurant_uid} Knowledge",
+        vector_db=get_chroma_db(collection_name),
+        max_results=10,  # Default only; the context assembler picks max_results per query type
+    )
+
+
+def _approximate_size(obj, seen: Optional[set] = None, depth: int = 0) -> int:
+    """
+    Rough deep size of an object graph in bytes, walking containers and instance
+    attributes a few levels deep. Chroma clients are skipped: their memory lives
+    in the shared system and native code, not in the cached entry.
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen or depth > 6 or type(obj).__module__.startswith('chromadb'):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj, 0)
+    if isinstance(obj, dict):
+        size += sum(_approximate_size(k, seen, depth + 1) + _approximate_size(v, seen, depth + 1)
+                    for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_approximate_size(item, seen, depth + 1) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += _approximate_size(vars(obj), seen, depth + 1)
+    return size
+
+
+def close_knowledge(knowledge: Knowledge):
+    """
+    Release the Chroma client of a knowledge instance, unless it is the shared process client.
+    """
+    client = getattr(knowledge.vector_db, '_client', None)
+    if client is None or client is _chroma_client or not hasattr(client, 'close'):
+        return
+    try:
+        client.close()
+    except Exception as e:
+        logger.error(f"Error closing Chroma client of {knowledge.name}: {str(e)}", exc_info=True)
+
+
+@dataclass
+class _CacheEntry:
+    knowledge: Knowledge
+    last_used: float
+    size: int
+
+
+class KnowledgeCache:
+    """
+    Process-level cache of Knowledge instances keyed by restaurant UID.
+    Bounded in size with least-recently-used eviction; entries idle for longer
+    than idle_seconds are dropped as well. Evicted instances release their own
+    Chroma client, if any (the shared process client stays open). An entry is
+    rebuilt when the restaurant's active collection changes.
+    """
+
+    def __init__(self, max_size: int, idle_seconds: float, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            max_size: Maximum number of knowledge instances kept in this process
+            idle_seconds: Time since last use after which an instance is evicted
+            clock: Monotonic time source
+        """
+        self.max_size = max_size
+        self.idle_seconds = idle_seconds
+        self.clock = clock
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _evict_locked(self, now: float) -> List[Knowledge]:
+        """
+        Drop idle entries (the least recently used come first) and any over max_size.
+        """
+        evicted = []
+        while self._entries:
+            restaurant_uid, entry = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_size and now - entry.last_used <= self.idle_seconds:
+                break
+            del self._entries[restaurant_uid]
+            evicted.append(entry.knowledge)
+        self.evictions += len(evicted)
+        return evicted
+
+    def get(self, restaurant_uid: str, collection_name: str,
+            factory: Callable[[str, str], Knowledge]) -> Knowledge:
+        """
+        Get the restaurant's knowledge instance over collection_name, building it on a miss.
+
+        Args:
+            restaurant_uid: Unique identifier for the restaurant
+            collection_name: Active collection of the restaurant
+            factory: Callable building a Knowledge from (restaurant_uid, collection_name)
+
+        Returns:
+            Knowledge instance
+        """
+        now = self.clock()
+        with self._lock:
+            evicted = self._evict_locked(now)
+            entry = self._entries.get(restaurant_uid)
+            if entry is not None and entry.knowledge.vector_db.collection_name == collection_name:
+                entry.last_used = now
+                self._entries.move_to_end(restaurant_uid)
+                self.hits += 1
+                knowledge = entry.knowledge
+            else:
+                knowledge = None
+                self.misses += 1
+        for stale in evicted:
+            close_knowledge(stale)
+        if knowledge is not None:
+            return knowledge
+
+        # Build outside the lock so a slow construction does not block other restaurants
+        knowledge = factory(restaurant_uid, collection_name)
+        entry = _CacheEntry(knowledge=knowledge, last_used=self.clock(), size=_approximate_size(knowledge))
+
+        with self._lock:
+            # Replaced entries (the pointer moved to a rebuilt collection) are closed too
+            previous = self._entries.pop(restaurant_uid, None)
+            self._entries[restaurant_uid] = entry
+            evicted = self._evict_locked(entry.last_used)
+        for stale in ([previous.knowledge] if previous and previous.knowledge is not knowledge else []) + evicted:
+            close_knowledge(stale)
+        return knowledge
+
+    def clear(self, restaurant_uid: Optional[str] = None):
+        """
+        Drop (and close) the instance of a restaurant, or every instance if no UID is given.
+        """
+        with self._lock:
+            if restaurant_uid:
+                entry = self._entries.pop(restaurant_uid, None)
+                dropped = [entry] if entry else []
+            else:
+                dropped = list(self._entries.values())
+                self._entries.clear()
+        for entry in dropped:
+            close_knowledge(entry.knowledge)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Size, hit/miss/eviction counters and approximate memory of this process's cache.
+        """
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'idle_seconds': self.idle_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'approx_bytes': sum(entry.size for entry in self._entries.values()),
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+knowledge_cache = KnowledgeCache(
+    max_size=config("CHAT_KNOWLEDGE_CACHE_SIZE", default=512, cast=int),
+    idle_seconds=config("CHAT_KNOWLEDGE_CACHE_IDLE_SECONDS", default=1800, cast=float),
+)
+register_handler(knowledge_cache.clear)
 
 
 def get_restaurant_knowledge(restaurant_uid: str) -> Knowledge:
     """
     Get or create a Knowledge instance for a specific restaurant.
-    Each restaurant has its own ChromaDB collection for data isolation.
+    Each restaurant has its own ChromaDB collection for data isolation; the
+    active one is resolved through the restaurant's collection pointer.
 
     Args:
         restaurant_uid: Unique identifier for the restaurant
@@ -82,40 +426,314 @@ def get_restaurant_knowledge(restaurant_uid: str) -> Knowledge:
     Returns:
         Knowledge instance configured for the restaurant
     """
-    # Check cache first
-    if restaurant_uid in _knowledge_cache:
-        return _knowledge_cache[restaurant_uid]
-
-    # Create collection name based on restaurant UID
-    collection_name = f"restaurant_{restaurant_uid}"
+    pointer_key = ACTIVE_COLLECTION_KEY.format(restaurant_uid=restaurant_uid)
+    version_key = INVALIDATION_VERSION_KEY.format(restaurant_uid=restaurant_uid)
+    # One round trip for the pointer and the staleness check
+    values = cache.get_many([pointer_key, version_key])
+    check_version(restaurant_uid, values.get(version_key))
+    collection_name, _ = values.get(pointer_key) or get_active_collection(restaurant_uid)
+    return knowledge_cache.get(restaurant_uid, collection_name, build_knowledge)
 
-    # Initialize ChromaDB for this restaurant
-    vector_db = get_chroma_db(collection_name)
 
-    # Create Knowledge instance
-    knowledge = Knowledge(
-        name=f"Restaurant {restaurant_uid} Knowledge",
-        vector_db=vector_db,
-        max_results=10,  # Number of documents to retrieve
-    )
+async def aget_restaurant_knowledge(restaurant_uid: str) -> Knowledge:
+    """
+    Async version of `get_restaurant_knowledge`.
+    """
+    pointer_key = ACTIVE_COLLECTION_KEY.format(restaurant_uid=restaurant_uid)
+    version_key = INVALIDATION_VERSION_KEY.format(restaurant_uid=restaurant_uid)
+    values = await cache.aget_many([pointer_key, version_key])
+    check_version(restaurant_uid, values.get(version_key))
+    collection_name, _ = values.get(pointer_key) or await aget_active_collection(restaurant_uid)
+    return knowledge_cache.get(restaurant_uid, collection_name, build_knowledge)
 
-    # Cache the instance
-    _knowledge_cache[restaurant_uid] = knowledge
 
-    return knowledge
+def delete_collection(collection_name: str):
+    """
+    Delete a Chroma collection if it exists.
+    """
+    client = get_chroma_db(collection_name).client
+    try:
+        client.delete_collection(name=collection_name)
+    except Exception as e:
+        # Missing collections raise on some Chroma versions
+        logger.info(f"Collection {collection_name} not deleted: {str(e)}")
 
 
 def clear_knowledge_cache(restaurant_uid: Optional[str] = None):
     """
-    Clear the knowledge cache for a specific restaurant or all restaurants.
-    Useful when knowledge base needs to be reloaded.
+    Clear the knowledge cache of this process for a specific restaurant or all restaurants.
+    Use `chat.invalidation.invalidate_restaurant` to reach every process.
 
     Args:
         restaurant_uid: Optional restaurant UID. If None, clears all cache.
     """
-    global _knowledge_cache
+    knowledge_cache.clear(restaurant_uid)
 
-    if restaurant_uid:
-        _knowledge_cache.pop(restaurant_uid, None)
-    else:
-        _knowledge_cache.clear()
+
+def get_knowledge_version(restaurant_uid: str) -> int:
+    """
+    Get the current knowledge version of a restaurant.
+    The version changes every time the restaurant's knowledge base is synced,
+    so anything derived from the knowledge base can be keyed on it.
+
+    Args:
+        restaurant_uid: Restaurant UID
+
+    Returns:
+        Current version number (0 if never synced)
+    """
+    return cache.get(KNOWLEDGE_VERSION_KEY.format(restaurant_uid=restaurant_uid), 0)
+
+
+async def aget_knowledge_version(restaurant_uid: str) -> int:
+    """
+    Async version of `get_knowledge_version`.
+    """
+    return await cache.aget(KNOWLEDGE_VERSION_KEY.format(restaurant_uid=restaurant_uid), 0)
+
+
+def bump_knowledge_version(restaurant_uid: str) -> Optional[int]:
+    """
+    Increment the knowledge version of a restaurant, invalidating derived caches.
+
+    Args:
+        restaurant_uid: Restaurant UID
+
+    Returns:
+        New version number, or None if the cache backend is unavailable
+    """
+    key = KNOWLEDGE_VERSION_KEY.format(restaurant_uid=restaurant_uid)
+    try:
+        cache.add(key, 0, timeout=None)
+        return cache.incr(key)
+    except Exception as e:
+        logger.error(f"Error bumping knowledge version for {restaurant_uid}: {str(e)}", exc_info=True)
+        return None
+
+
+# Characters per stored chunk; keeps large documents (the full-menu overview) under embedding input limits
+KNOWLEDGE_CHUNK_CHARS = config("KNOWLEDGE_CHUNK_CHARS", default=6000, cast=int)
+
+# Texts per embedding call, and documents per Chroma write in bulk syncs
+KNOWLEDGE_EMBED_BATCH_SIZE = config("KNOWLEDGE_EMBED_BATCH_SIZE", default=64, cast=int)
+# Delay before the collection replaced by a rebuild is deleted, letting in-flight queries finish
+KNOWLEDGE_COLLECTION_GC_SECONDS = config("KNOWLEDGE_COLLECTION_GC_SECONDS", default=300, cast=int)
+
+
+@dataclass
+class KnowledgeDocument:
+    """
+    A rendered document for one record, identified by its type and UID.
+    """
+    doc_type: str
+    uid: str
+    content: str
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def key(self) -> str:
+        return f"{self.doc_type}:{self.uid}"
+
+    @property
+    def content_hash(self) -> str:
+        """
+        Hash of everything stored for the document; equal hashes mean nothing to re-embed.
+        """
+        payload = json.dumps([self.content, self.metadata], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def chunks(self) -> List[str]:
+        """
+        Split the content on line boundaries into chunks of at most KNOWLEDGE_CHUNK_CHARS.
+        """
+        chunks, current = [], ''
+        for line in self.content.splitlines(keepends=True):
+            if current and len(current) + len(line) > KNOWLEDGE_CHUNK_CHARS:
+                chunks.append(current)
+                current = ''
+            current += line
+        if current.strip() or not chunks:
+            chunks.append(current)
+        return chunks
+
+
+@dataclass
+class SyncStats:
+    """
+    Outcome of a knowledge sync.
+    """
+    embedded: int = 0
+    skipped: int = 0
+
+    def __add__(self, other: "SyncStats") -> "SyncStats":
+        return SyncStats(embedded=self.embedded + other.embedded, skipped=self.skipped + other.skipped)
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def _flatten_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Chroma accepts only scalar metadata values: lists become JSON (as agno stores them) and None is dropped.
+    """
+    flattened = {}
+    for key, value in metadata.items():
+        if isinstance(value, (list, tuple, dict)):
+            flattened[key] = json.dumps(value)
+        elif value is not None:
+            flattened[key] = value
+    return flattened
+
+
+def get_collection(knowledge: Knowledge):
+    """
+    Get (creating if needed) the Chroma collection behind a knowledge base.
+    """
+    vector_db = knowledge.vector_db
+    return vector_db.client.get_or_create_collection(
+        name=vector_db.collection_name,
+        metadata={"hnsw:space": vector_db.distance.value},
+    )
+
+
+def _embed_batch(embedder, texts: List[str]) -> List[List[float]]:
+    """
+    Embed one batch of texts in as few calls as the embedder allows.
+    """
+    if hasattr(embedder, 'get_embeddings_batch'):
+        return embedder.get_embeddings_batch(texts)
+    if hasattr(embedder, 'async_get_embeddings_batch_and_usage'):
+        # agno embedders only batch on the async path; it falls back to single calls on errors
+        embeddings, _ = async_to_sync(embedder.async_get_embeddings_batch_and_usage)(texts)
+        return embeddings
+    return [embedder.get_embedding(text) for text in texts]
+
+
+def embed_texts(embedder, texts: List[str], batch_size: int = KNOWLEDGE_EMBED_BATCH_SIZE) -> List[List[float]]:
+    """
+    Embed texts with the knowledge base embedder, batch_size texts per call.
+    """
+    embeddings = []
+    for start in range(0, len(texts), batch_size):
+        embeddings.extend(_embed_batch(embedder, texts[start:start + batch_size]))
+    return embeddings
+
+
+def upsert_documents(knowledge: Knowledge, documents: List[KnowledgeDocument]) -> SyncStats:
+    """
+    Idempotently write documents to a knowledge base.
+
+    Each document is stored under stable IDs derived from its type and UID, with
+    its content hash in the metadata. Documents whose stored hash matches are
+    skipped without calling the embedder. Changed documents are embedded first,
+    written with a single upsert over their stable IDs (replacing the previous
+    vectors in place), and only then are leftover vectors of the same records
+    deleted, with one delete per document type: stale chunks and copies appended
+    by older syncs. A failure before the upsert leaves the previous version untouched.
+
+    Args:
+        knowledge: Knowledge base of the restaurant
+        documents: Rendered documents to sync
+
+    Returns:
+        SyncStats with embedded and skipped document counts
+    """
+    stats = SyncStats()
+    if not documents:
+        return stats
+
+    collection = get_collection(knowledge)
+    existing = collection.get(
+        where={"doc_key": {"$in": [document.key for document in documents]}},
+        include=["metadatas"],
+    )
+    stored_hashes: Dict[str, set] = {}
+    for metadata in existing.get("metadatas") or []:
+        stored_hashes.setdefault(metadata.get("doc_key"), set()).add(metadata.get("content_hash"))
+
+    changed = []
+    for document in documents:
+        if stored_hashes.get(document.key) == {document.content_hash}:
+            stats.skipped += 1
+        else:
+            changed.append(document)
+    if not changed:
+        return stats
+
+    ids, contents, metadatas = [], [], []
+    for document in changed:
+        chunks = document.chunks()
+        for position, chunk in enumerate(chunks):
+            ids.append(f"{document.key}#{position}")
+            contents.append(chunk)
+            metadatas.append(_flatten_metadata({
+                **document.metadata,
+                "type": document.doc_type,
+                f"{document.doc_type}_uid": document.uid,
+                "doc_key": document.key,
+                "content_hash": document.content_hash,
+                "chunk": position,
+                "chunks": len(chunks),
+            }))
+
+    embeddings = embed_texts(knowledge.vector_db.embedder, contents)
+    collection.upsert(ids=ids, embeddings=embeddings, documents=contents, metadatas=metadatas)
+
+    changed_by_type: Dict[str, List[KnowledgeDocument]] = {}
+    for document in changed:
+        changed_by_type.setdefault(document.doc_type, []).append(document)
+    for doc_type, typed in changed_by_type.items():
+        collection.delete(where={"$and": [
+            {"type": doc_type},
+            {f"{doc_type}_uid": {"$in": [document.uid for document in typed]}},
+            {"content_hash": {"$nin": [document.content_hash for document in typed]}},
+        ]})
+    stats.embedded = len(changed)
+    return stats
+
+
+def upsert_in_batches(knowledge: Knowledge, documents: List[KnowledgeDocument],
+                      batch_size: Optional[int] = None) -> SyncStats:
+    """
+    Write many documents with `upsert_documents`, batch_size documents per embedding batch and Chroma write.
+
+    Args:
+        knowledge: Knowledge base of the restaurant
+        documents: Rendered documents to sync
+        batch_size: Documents per batch (defaults to KNOWLEDGE_EMBED_BATCH_SIZE)
+
+    Returns:
+        SyncStats summed over the batches
+    """
+    batch_size = batch_size or KNOWLEDGE_EMBED_BATCH_SIZE
+    stats = SyncStats()
+    for start in range(0, len(documents), batch_size):
+        stats += upsert_documents(knowledge, documents[start:start + batch_size])
+    return stats
+
+
+def count_documents(knowledge: Knowledge) -> Dict[str, int]:
+    """
+    Count the documents (not chunks) stored in a knowledge base, per document type.
+    """
+    stored = get_collection(knowledge).get(include=["metadatas"])
+    keys: Dict[str, set] = {}
+    for metadata in stored.get("metadatas") or []:
+        if metadata.get("doc_key"):
+            keys.setdefault(metadata.get("type"), set()).add(metadata["doc_key"])
+    return {doc_type: len(doc_keys) for doc_type, doc_keys in keys.items()}
+
+
+def prune_documents(knowledge: Knowledge, keep_keys: set) -> int:
+    """
+    Delete documents whose key is not in keep_keys (records removed since they were written).
+
+    Returns:
+        Number of documents deleted
+    """
+    collection = get_collection(knowledge)
+    stored = collection.get(include=["metadatas"])
+    stale = {m.get("doc_key") for m in stored.get("metadatas") or [] if m.get("doc_key")} - set(keep_keys)
+    if stale:
+        collection.delete(where={"doc_key": {"$in": sorted(stale)}})
+    return len(stale)
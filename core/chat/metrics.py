@@ -0,0 +1,150 @@
+"""
+Per-retrieval-mode run metrics and context assembly metrics for restaurant chat.
+Latency, token usage and knowledge tool calls are accumulated in the Django
+cache so the modes can be compared across workers; on Redis, the counters of
+one record are incremented in a single pipelined round trip.
+"""
+import logging
+from typing import Optional
+
+from django.core.cache import cache
+
+from chat.invalidation import redis_client
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_STATS_KEY = "chat:retrieval:stats:{mode}:{field}"
+RETRIEVAL_STATS_FIELDS = ('runs', 'latency_ms', 'input_tokens', 'output_tokens', 'search_calls')
+CONTEXT_STATS_KEY = "chat:context:stats:{field}"
+CONTEXT_STATS_FIELDS = ('assemblies', 'retrieved_tokens', 'deduped_tokens', 'packed_tokens', 'truncated')
+
+
+def increment_counters(counters: dict):
+    """
+    Add to several cache counters at once (starting missing ones at 0, no expiry).
+
+    Args:
+        counters: Increment per cache key
+    """
+    client = redis_client()
+    if client is not None:
+        # All counters in one round trip. INCRBY starts missing keys at 0, and Django's
+        # Redis cache stores integers unserialized, so `cache.get` reads them back.
+        pipeline = client.pipeline(transaction=False)
+        for key, value in counters.items():
+            pipeline.incrby(cache.make_key(key), value)
+        pipeline.execute()
+        return
+    for key, value in counters.items():
+        cache.add(key, 0, timeout=None)
+        if value:
+            cache.incr(key, value)
+
+
+def _accumulate(values: dict, key_format: str, **key_kwargs):
+    increment_counters({key_format.format(field=field, **key_kwargs): value for field, value in values.items()})
+
+
+def search_call_count(tools) -> int:
+    """
+    Number of `search_knowledge_base` tool calls in a run.
+    """
+    return sum(1 for tool in tools or [] if getattr(tool, 'tool_name', None) == 'search_knowledge_base')
+
+
+def record_run(mode: str, restaurant_uid: str, seconds: float, metrics=None, tools=None):
+    """
+    Record one agent run for a retrieval mode.
+
+    Args:
+        mode: Retrieval mode the agent ran with
+        restaurant_uid: Restaurant UID (logged only)
+        seconds: Wall-clock duration of the run
+        metrics: agno run metrics, if any
+        tools: agno tool executions of the run, if any
+    """
+    values = {
+        'runs': 1,
+        'latency_ms': int(seconds * 1000),
+        'input_tokens': getattr(metrics, 'input_tokens', 0) or 0,
+        'output_tokens': getattr(metrics, 'output_tokens', 0) or 0,
+        'search_calls': search_call_count(tools),
+    }
+    logger.info(
+        f"Agent run for {restaurant_uid} mode={mode} latency_ms={values['latency_ms']} "
+        f"input_tokens={values['input_tokens']} output_tokens={values['output_tokens']} "
+        f"search_calls={values['search_calls']}"
+    )
+    try:
+        _accumulate(values, RETRIEVAL_STATS_KEY, mode=mode)
+    except Exception as e:
+        logger.error(f"Error recording retrieval metrics: {str(e)}", exc_info=True)
+
+
+def retrieval_stats(mode: str) -> dict:
+    """
+    Averages per run for a retrieval mode.
+
+    Args:
+        mode: Retrieval mode
+
+    Returns:
+        Dict with runs and per-run averages of latency, tokens and search calls
+    """
+    totals = {
+        field: cache.get(RETRIEVAL_STATS_KEY.format(mode=mode, field=field), 0)
+        for field in RETRIEVAL_STATS_FIELDS
+    }
+    runs = totals['runs']
+
+    def average(field: str) -> Optional[float]:
+        return round(totals[field] / runs, 2) if runs else None
+
+    return {
+        'runs': runs,
+        'avg_latency_ms': average('latency_ms'),
+        'avg_input_tokens': average('input_tokens'),
+        'avg_output_tokens': average('output_tokens'),
+        'avg_search_calls': average('search_calls'),
+    }
+
+
+def record_context(stats):
+    """
+    Record the per-stage token counts of one context assembly.
+
+    Args:
+        stats: `chat.context.AssemblyStats` of the assembly
+    """
+    values = {
+        'assemblies': 1,
+        'retrieved_tokens': stats.retrieved_tokens,
+        'deduped_tokens': stats.deduped_tokens,
+        'packed_tokens': stats.packed_tokens,
+        'truncated': stats.truncated,
+    }
+    try:
+        _accumulate(values, CONTEXT_STATS_KEY)
+    except Exception as e:
+        logger.error(f"Error recording context metrics: {str(e)}", exc_info=True)
+
+
+def context_stats() -> dict:
+    """
+    Average knowledge tokens per assembly at each stage (retrieved, deduped, packed).
+
+    Returns:
+        Dict with assemblies and per-assembly averages
+    """
+    totals = {
+        field: cache.get(CONTEXT_STATS_KEY.format(field=field), 0)
+        for field in CONTEXT_STATS_FIELDS
+    }
+    assemblies = totals.pop('assemblies')
+    return {
+        'assemblies': assemblies,
+        **{
+            f"avg_{field}": round(total / assemblies, 2) if assemblies else None
+            for field, total in totals.items()
+        },
+    }
@@ -0,0 +1,19 @@
+# Generated by Django 6.1.2 on 2026-10-16 20:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_alter_thread_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thread',
+            name='summarized_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.1.2 on 2026-10-16 20:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_thread_summarized_message'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KnowledgeCollection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('restaurant_uid', models.CharField(max_length=64, unique=True)),
+                ('collection_name', models.CharField(max_length=255)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
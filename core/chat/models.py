@@ -7,10 +7,26 @@ class Thread(BaseModel):
     restaurant = models.ForeignKey("restaurants.Restaurant", on_delete=models.CASCADE)
     user = models.ForeignKey("accounts.User", on_delete=models.CASCADE, blank=True, null=True)
     summary = models.TextField(blank=True, null=True)
+    # Latest message folded into `summary`; later messages are not summarized yet
+    summarized_message = models.ForeignKey(
+        'chat.Message',
+        on_delete=models.SET_NULL,
+        blank=True, null=True,
+        related_name='+'
+    )
 
     def __str__(self):
         return f"{self.restaurant} - {self.user}"
 
+    def unsummarized_messages(self):
+        """
+        Messages not yet folded into `summary`, oldest first.
+        """
+        messages = Message.objects.filter(thread=self)
+        if self.summarized_message_id:
+            messages = messages.filter(id__gt=self.summarized_message_id)
+        return messages.order_by('id')
+
 
 class Message(BaseModel):
     thread = models.ForeignKey('chat.Thread', on_delete=models.CASCADE)
@@ -19,3 +35,18 @@ class Message(BaseModel):
 
     def __str__(self):
         return f"{self.thread}"
+
+
+class KnowledgeCollection(models.Model):
+    """
+    Active Chroma collection of a restaurant's knowledge base.
+    Swapped atomically by a blue/green rebuild; removed together with the collection
+    when the restaurant is deleted.
+    """
+    restaurant_uid = models.CharField(max_length=64, unique=True)
+    collection_name = models.CharField(max_length=255)
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.restaurant_uid} -> {self.collection_name}"
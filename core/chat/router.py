@@ -0,0 +1,254 @@
+"""
+Deterministic intent router for restaurant chat.
+Recognizes price, menu-list and "what contains X" questions and answers them
+directly from the database with a templated response, so these queries skip
+vector search and the LLM entirely. Anything the router is not confident about
+falls through to the agent.
+"""
+import difflib
+import logging
+import re
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from decouple import config
+
+from restaurants.models import Allergen, Ingredients, Menu
+
+logger = logging.getLogger(__name__)
+
+PRICE_RE = re.compile(r"\b(how much|price|prices|priced|cost|costs)\b")
+PRICE_SUBJECT_RE = re.compile(
+    r"(?:how much (?:is|are|does|do|for)(?: the| a| an)?|price (?:of|for)(?: the| a| an)?|"
+    r"what does(?: the| a| an)?)\s+(?P<subject>.+?)(?:\s+cost)?\s*$"
+)
+MENU_LIST_RE = re.compile(
+    r"(\b(list|show|see|view|send|give me|what(?:'s| is)? on|full|whole|entire)\b.*\bmenu\b)"
+    r"|(\bmenu\b.*\b(please|list)\b)"
+    r"|^(the |your )?menu$"
+)
+# Bare "with" is left out: "anything with less salt?" is not an ingredient question
+CONTAINS_RE = re.compile(r"\b(contain|contains|containing|include|includes|including|made with)\b")
+CONTAINS_SUBJECT_RE = re.compile(
+    r"\b(?:contain|contains|containing|include|includes|including|made with)(?: any| the| a| an)?\s+(?P<subject>.+?)\s*$"
+)
+YES_NO_RE = re.compile(r"^(does|do|is|are|has|have|can)\b")
+# Exclusion and allergy-safety questions need reasoning over absence; leave them to the agent
+NEGATION_RE = re.compile(r"\b(without|free|no|not|safe|avoid|allergy|allergic|except)\b")
+
+
+@dataclass
+class RoutedAnswer:
+    """
+    An answer produced by the router instead of the agent.
+    """
+    intent: str
+    answer: str
+    confidence: float
+
+
+def normalize(text: str) -> str:
+    """
+    Lowercase, drop punctuation and collapse whitespace.
+    """
+    text = re.sub(r"[^\w\s']", " ", text.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def contains_phrase(text: str, phrase: str) -> bool:
+    """
+    Whole-word containment check, tolerant of a simple plural ("peanuts" for "peanut").
+    """
+    if not phrase:
+        return False
+    return re.search(rf"\b{re.escape(phrase)}(s|es)?\b", text) is not None
+
+
+class IntentRouter:
+    """
+    Answers structured questions from `Menu`, `Ingredients`, `MenuIngredientsConnector` and `Allergen`.
+    """
+
+    def __init__(self, enabled: bool, min_confidence: float, max_items: int):
+        """
+        Args:
+            enabled: Whether routing is attempted at all
+            min_confidence: Minimum confidence to answer without the agent
+            max_items: Maximum number of items listed in a templated answer
+        """
+        self.enabled = enabled
+        self.min_confidence = min_confidence
+        self.max_items = max_items
+
+    def route(self, restaurant, message: str) -> Optional[RoutedAnswer]:
+        """
+        Try to answer a message from the database.
+
+        Args:
+            restaurant: Restaurant instance
+            message: User's message
+
+        Returns:
+            RoutedAnswer if the router is confident enough, otherwise None
+        """
+        if not self.enabled:
+            return None
+
+        text = normalize(message)
+        if not text or not (PRICE_RE.search(text) or CONTAINS_RE.search(text) or MENU_LIST_RE.search(text)):
+            return None
+
+        menus = list(Menu.objects.filter(restaurant=restaurant).values_list('id', 'name', 'price'))
+
+        for handler in (self._price, self._contains, self._menu_list):
+            routed = handler(restaurant, text, menus)
+            if routed is None:
+                continue
+            if routed.confidence < self.min_confidence:
+                logger.info(f"Router intent '{routed.intent}' below confidence ({routed.confidence:.2f}), using agent")
+                return None
+            logger.info(f"Router answered intent '{routed.intent}' for restaurant {restaurant.uid}")
+            return routed
+        return None
+
+    @staticmethod
+    def _match_menus(text: str, menus: List[Tuple]) -> Tuple[List[Tuple], float]:
+        """
+        Find the menu item(s) named in the text.
+
+        Returns:
+            Matched menu rows and a confidence score
+        """
+        named = [menu for menu in menus if contains_phrase(text, normalize(menu[1]))]
+        if named:
+            names = [normalize(menu[1]) for menu in named]
+            # A name inside a longer matched name ("curry" in "green curry") is part of it;
+            # separate names ("pad thai and green curry") are all asked about
+            best = [
+                menu for menu, name in zip(named, names)
+                if not any(other != name and contains_phrase(other, name) for other in names)
+            ]
+            # Menus sharing a name cannot be told apart
+            distinct = {normalize(menu[1]) for menu in best}
+            return best, 1.0 if len(distinct) == len(best) else 0.5
+
+        # Fall back to a fuzzy match on the phrase after "how much is ..." and similar
+        subject = PRICE_SUBJECT_RE.search(text)
+        if subject:
+            names = {normalize(menu[1]): menu for menu in menus}
+            close = difflib.get_close_matches(subject.group('subject'), list(names), n=2, cutoff=0.6)
+            if close:
+                ratio = difflib.SequenceMatcher(None, subject.group('subject'), close[0]).ratio()
+                confidence = ratio if len(close) == 1 else ratio / 2
+                return [names[close[0]]], confidence
+        return [], 0.0
+
+    def _price(self, restaurant, text: str, menus: List[Tuple]) -> Optional[RoutedAnswer]:
+        if not PRICE_RE.search(text):
+            return None
+        matched, confidence = self._match_menus(text, menus)
+        if not matched:
+            return None
+        answer = " ".join(f"{name} costs ${price}." for _, name, price in matched[:self.max_items])
+        return RoutedAnswer(intent='price', answer=answer, confidence=confidence)
+
+    def _menu_list(self, restaurant, text: str, menus: List[Tuple]) -> Optional[RoutedAnswer]:
+        if not MENU_LIST_RE.search(text):
+            return None
+        # Long questions that merely mention the menu usually ask for something more specific
+        confidence = 1.0 if len(text.split()) <= 8 else 0.5
+        if not menus:
+            return RoutedAnswer(
+                intent='menu_list',
+                answer=f"{restaurant.name} has no menu items available at the moment.",
+                confidence=confidence,
+            )
+        lines = [f"- {name}: ${price}" for _, name, price in menus[:self.max_items]]
+        if len(menus) > self.max_items:
+            lines.append(f"...and {len(menus) - self.max_items} more items.")
+        answer = f"Here is the menu at {restaurant.name}:\n" + "\n".join(lines)
+        return RoutedAnswer(intent='menu_list', answer=answer, confidence=confidence)
+
+    def _contains(self, restaurant, text: str, menus: List[Tuple]) -> Optional[RoutedAnswer]:
+        if not CONTAINS_RE.search(text) or NEGATION_RE.search(text):
+            return None
+
+        all_allergens = list(Allergen.objects.all())
+        all_ingredients = list(Ingredients.objects.filter(restaurant=restaurant))
+        allergens = [
+            allergen for allergen in all_allergens
+            if contains_phrase(text, normalize(allergen.name)) or allergen.name_ja in text
+        ]
+        ingredients = [
+            ingredient for ingredient in all_ingredients
+            if contains_phrase(text, normalize(ingredient.name))
+        ]
+        confidence = 1.0
+        if not allergens and not ingredients:
+            # Fall back to a fuzzy match on the phrase after "contains ..." and similar
+            subject = CONTAINS_SUBJECT_RE.search(text)
+            if not subject:
+                return None
+            names = {normalize(term.name): term for term in all_allergens + all_ingredients}
+            close = difflib.get_close_matches(subject.group('subject'), list(names), n=2, cutoff=0.6)
+            if not close:
+                return None
+            ratio = difflib.SequenceMatcher(None, subject.group('subject'), close[0]).ratio()
+            confidence = ratio if len(close) == 1 else ratio / 2
+            term = names[close[0]]
+            if isinstance(term, Allergen):
+                allergens = [term]
+            else:
+                ingredients = [term]
+
+        terms = []
+        for term in [a.name for a in allergens] + [i.name for i in ingredients]:
+            if normalize(term) not in map(normalize, terms):
+                terms.append(term)
+
+        # "Does the Pad Thai contain peanuts?" asks about one item rather than for a list
+        matched_menus = []
+        if YES_NO_RE.search(text):
+            matched_menus, menu_confidence = self._match_menus(text, menus)
+            if matched_menus:
+                confidence = min(confidence, menu_confidence)
+
+        containing = Menu.objects.filter(restaurant=restaurant)
+        if allergens and ingredients:
+            containing = (
+                containing.filter(allergens__in=allergens)
+                | containing.filter(menuingredientsconnector__ingredient__in=ingredients)
+            )
+        elif allergens:
+            containing = containing.filter(allergens__in=allergens)
+        else:
+            containing = containing.filter(menuingredientsconnector__ingredient__in=ingredients)
+        containing = list(containing.distinct().order_by('name').values_list('id', 'name'))
+
+        label = ", ".join(terms)
+        notice = "Please confirm with our staff if you have a severe allergy."
+
+        if matched_menus:
+            containing_ids = {row[0] for row in containing}
+            answers = [
+                f"Yes, {name} contains {label}." if menu_id in containing_ids
+                else f"{name} is not listed as containing {label}."
+                for menu_id, name, _ in matched_menus[:self.max_items]
+            ]
+            return RoutedAnswer(intent='contains', answer=f"{' '.join(answers)} {notice}", confidence=confidence)
+
+        if not containing:
+            answer = f"None of our menu items are listed as containing {label}. {notice}"
+        else:
+            names = [name for _, name in containing[:self.max_items]]
+            if len(containing) > self.max_items:
+                names.append(f"and {len(containing) - self.max_items} more")
+            answer = f"These menu items contain {label}: {', '.join(names)}. {notice}"
+        return RoutedAnswer(intent='contains', answer=answer, confidence=confidence)
+
+
+intent_router = IntentRouter(
+    enabled=config("CHAT_ROUTER_ENABLED", default=True, cast=bool),
+    min_confidence=config("CHAT_ROUTER_MIN_CONFIDENCE", default=0.8, cast=float),
+    max_items=config("CHAT_ROUTER_MAX_ITEMS", default=50, cast=int),
+)
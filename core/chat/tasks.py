@@ -0,0 +1,72 @@
+"""
+Celery tasks for chat conversations.
+Keeps rolling summary generation off the request path.
+"""
+from celery import shared_task
+from django.utils import timezone
+import logging
+
+logger = logging.getLogger(__name__)
+
+# How many times a summary update is recomputed after losing a race
+SUMMARY_MAX_ATTEMPTS = 3
+
+
+@shared_task
+def update_thread_summary(thread_uid: str):
+    """
+    Fold every not yet summarized message of a thread into its rolling summary.
+
+    Ordering is guaranteed per thread without locks: the task always summarizes
+    from the stored pointer (`summarized_message`) up to the latest message, and
+    saves with a compare-and-swap on that pointer. A task that lost the race
+    recomputes from the new pointer, so an older turn's summary can never
+    overwrite a newer one.
+
+    Args:
+        thread_uid: Thread UID to summarize
+    """
+    try:
+        from chat.models import Thread
+        from chat.agent import summarize_conversation
+        from chat.timing import start_timer, stage
+
+        timer = start_timer()
+        for _ in range(SUMMARY_MAX_ATTEMPTS):
+            with stage('orm'):
+                thread = Thread.objects.select_related('restaurant').get(uid=thread_uid)
+                pending = list(thread.unsummarized_messages())
+            if not pending:
+                return
+            if timer is not None:
+                timer.restaurant_uid = str(thread.restaurant.uid)
+
+            with stage('summary'):
+                updated_summary = summarize_conversation(
+                    thread.summary,
+                    [(m.user_message, m.ai_response) for m in pending],
+                )
+
+            with stage('persist'):
+                updated = Thread.objects.filter(
+                    pk=thread.pk,
+                    summarized_message_id=thread.summarized_message_id,
+                ).update(
+                    summary=updated_summary,
+                    summarized_message=pending[-1],
+                    updated_at=timezone.now(),
+                )
+
+            if updated:
+                logger.info(f"Summarized {len(pending)} turn(s) for thread {thread_uid}")
+                if timer is not None:
+                    timer.finish("Summary timings")
+                return
+
+            # Another task advanced the summary meanwhile; redo from the new pointer
+            logger.info(f"Summary of thread {thread_uid} changed concurrently, recomputing")
+
+        logger.warning(f"Gave up summarizing thread {thread_uid} after concurrent updates")
+
+    except Exception as e:
+        logger.error(f"Error summarizing thread {thread_uid}: {str(e)}", exc_info=True)
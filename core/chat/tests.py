@@ -1,3 +1,730 @@
-from django.test import TestCase
+import json
+from unittest.mock import Mock, patch
 
-# Create your tests here.
+import numpy as np
+
+from django.core.cache import cache
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from accounts.models import User
+from accounts.choices import UserRole
+from types import SimpleNamespace
+
+from agno.models.openai import OpenAIChat
+
+from chat.agent import AgentPool, RestaurantAgent
+from chat.metrics import record_run, retrieval_stats, context_stats
+from chat.context import ContextAssembler, classify_query, count_tokens
+from chat.timing import StageTimer
+from chat.models import Thread, Message
+from chat.tasks import update_thread_summary
+from chat.answer_cache import answer_cache
+from chat import invalidation, knowledge as knowledge_module
+from chat.embedders import HashingEmbedder, LocalEmbedder, get_embedder
+from chat.knowledge import KnowledgeCache, bump_knowledge_version, get_knowledge_version
+from restaurants.models import Restaurant, Menu, Ingredients, MenuIngredientsConnector, Allergen
+from chat.router import IntentRouter
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+class FakeAgent:
+    def __init__(self, restaurant_uid, restaurant_name, knowledge):
+        self.restaurant_uid = restaurant_uid
+        self.restaurant_name = restaurant_name
+        self.knowledge = knowledge
+
+
+class AgentPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.built = []
+
+        def factory(restaurant_uid, restaurant_name, knowledge):
+            agent = FakeAgent(restaurant_uid, restaurant_name, knowledge)
+            self.built.append(agent)
+            return agent
+
+        self.knowledge = object()
+        self.pool = AgentPool(max_size=2, factory=factory)
+
+    def test_reuses_warm_agent(self):
+        """
+        A second request for the same restaurant must not rebuild the agent.
+        """
+        first = self.pool.get('r1', 'Sushi Bar', self.knowledge)
+        second = self.pool.get('r1', 'Sushi Bar', self.knowledge)
+        self.assertIs(first, second)
+        self.assertEqual(len(self.built), 1)
+
+    def test_rebuilds_on_rename_and_knowledge_change(self):
+        first = self.pool.get('r1', 'Sushi Bar', self.knowledge)
+        renamed = self.pool.get('r1', 'Sushi House', self.knowledge)
+        self.assertIsNot(first, renamed)
+        self.assertEqual(renamed.restaurant_name, 'Sushi House')
+
+        reloaded = self.pool.get('r1', 'Sushi House', object())
+        self.assertIsNot(renamed, reloaded)
+        self.assertEqual(len(self.pool), 1)
+
+    def test_evicts_least_recently_used(self):
+        self.pool.get('r1', 'A', self.knowledge)
+        self.pool.get('r2', 'B', self.knowledge)
+        # Touch r1 so r2 becomes the eviction candidate
+        self.pool.get('r1', 'A', self.knowledge)
+        self.pool.get('r3', 'C', self.knowledge)
+
+        self.assertEqual(len(self.pool), 2)
+        self.pool.get('r1', 'A', self.knowledge)
+        self.assertEqual(len(self.built), 3)
+        self.pool.get('r2', 'B', self.knowledge)
+        self.assertEqual(len(self.built), 4)
+
+    def test_invalidate(self):
+        self.pool.get('r1', 'A', self.knowledge)
+        self.pool.invalidate('r1')
+        self.pool.get('r1', 'A', self.knowledge)
+        self.assertEqual(len(self.built), 2)
+
+
+class FakeClient:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class KnowledgeCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.cache = KnowledgeCache(max_size=2, idle_seconds=60, clock=lambda: self.now)
+
+    @staticmethod
+    def factory(restaurant_uid, collection_name):
+        return SimpleNamespace(
+            name=restaurant_uid, vector_db=SimpleNamespace(collection_name=collection_name, _client=FakeClient()),
+        )
+
+    def get(self, restaurant_uid, collection_name=None):
+        return self.cache.get(restaurant_uid, collection_name or f"restaurant_{restaurant_uid}", self.factory)
+
+    def test_hits_and_lru_eviction_close_clients(self):
+        first = self.get('r1')
+        self.assertIs(self.get('r1'), first)
+        second = self.get('r2')
+        self.get('r1')
+        # r2 is the least recently used
+        self.get('r3')
+
+        self.assertTrue(second.vector_db._client.closed)
+        self.assertFalse(first.vector_db._client.closed)
+        stats = self.cache.stats()
+        self.assertEqual((stats['size'], stats['hits'], stats['misses'], stats['evictions']), (2, 2, 3, 1))
+        self.assertGreater(stats['approx_bytes'], 0)
+
+    def test_idle_entries_are_evicted(self):
+        first = self.get('r1')
+        self.now = 61.0
+        self.assertIsNot(self.get('r1'), first)
+        self.assertTrue(first.vector_db._client.closed)
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_rebuilt_when_collection_changes(self):
+        first = self.get('r1')
+        swapped = self.get('r1', 'restaurant_r1_v1')
+        self.assertIsNot(swapped, first)
+        self.assertTrue(first.vector_db._client.closed)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_clear(self):
+        first = self.get('r1')
+        self.cache.clear()
+        self.assertTrue(first.vector_db._client.closed)
+        self.assertEqual(len(self.cache), 0)
+
+
+class SharedChromaClientTests(SimpleTestCase):
+    def setUp(self):
+        settings = knowledge_module.ChromaSettings(
+            path='chroma_test', host=None, port=None, tenant='default', database='default', api_key=None, ssl=False,
+        )
+        for name, value in (('_chroma_settings', None), ('_chroma_client', None), ('_chroma_client_pid', None)):
+            patcher = patch.object(knowledge_module, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch.object(knowledge_module.ChromaSettings, 'from_env', return_value=settings)
+        self.from_env = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(knowledge_module, '_create_chroma_client', side_effect=lambda settings: FakeClient())
+        self.create = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_one_client_for_all_collections(self):
+        first = knowledge_module.get_chroma_db('restaurant_r1')
+        second = knowledge_module.get_chroma_db('restaurant_r2')
+
+        self.assertEqual((first.collection_name, second.collection_name), ('restaurant_r1', 'restaurant_r2'))
+        self.assertIs(first.client, second.client)
+        self.assertEqual(self.create.call_count, 1)
+        self.assertEqual(self.from_env.call_count, 1)
+
+        # Evicting a knowledge instance leaves the shared client open
+        knowledge_module.close_knowledge(SimpleNamespace(name='r1', vector_db=first))
+        self.assertFalse(first.client.closed)
+
+    def test_forked_process_gets_its_own_client(self):
+        parent = knowledge_module.get_chroma_client()
+        with patch('chat.knowledge.os.getpid', return_value=-1):
+            self.assertIsNot(knowledge_module.get_chroma_client(), parent)
+
+
+class EmbedderTests(SimpleTestCase):
+    def test_hashing_embedder_is_deterministic_and_normalized(self):
+        embedder = HashingEmbedder(dimensions=64)
+        first, second = embedder.get_embeddings_batch(['Spicy chicken curry', 'Spicy chicken curry'])
+
+        self.assertEqual(len(first), 64)
+        self.assertEqual(first, second)
+        self.assertEqual(first, HashingEmbedder(dimensions=64).get_embedding('spicy  CHICKEN curry'))
+        self.assertAlmostEqual(sum(value * value for value in first), 1.0, places=5)
+
+    def test_hashing_embedder_ranks_shared_words_higher(self):
+        embedder = HashingEmbedder()
+        query, related, unrelated = embedder.get_embeddings_batch(
+            ['chicken curry', 'spicy chicken curry with rice', 'chocolate lava cake']
+        )
+
+        def similarity(a, b):
+            return sum(x * y for x, y in zip(a, b))
+
+        self.assertGreater(similarity(query, related), similarity(query, unrelated))
+
+    def test_embedder_is_chosen_by_setting_and_shared(self):
+        with patch('chat.embedders.KNOWLEDGE_EMBEDDER', 'hashing'):
+            embedder = get_embedder()
+            self.assertIsInstance(embedder, HashingEmbedder)
+            self.assertIs(get_embedder(), embedder)
+
+            with patch.object(knowledge_module, '_chroma_settings', knowledge_module.ChromaSettings(
+                path='chroma_test', host=None, port=None, tenant='default', database='default', api_key=None, ssl=False,
+            )), patch.object(knowledge_module, 'get_chroma_client', return_value=FakeClient()):
+                self.assertIs(knowledge_module.get_chroma_db('restaurant_r1').embedder, embedder)
+
+        with self.assertRaises(ValueError):
+            get_embedder('word2vec')
+
+    def test_local_embedder_encodes_in_one_vectorized_call(self):
+        model = SimpleNamespace(encode=Mock(return_value=np.array([[0.6, 0.8], [1.0, 0.0]])))
+        embedder = LocalEmbedder(path='/models/minilm', batch_size=32)
+        embedder._model = model
+
+        self.assertEqual(embedder.get_embeddings_batch(['a', 'b']), [[0.6, 0.8], [1.0, 0.0]])
+        model.encode.assert_called_once()
+        self.assertEqual(model.encode.call_args.args[0], ['a', 'b'])
+        self.assertEqual(model.encode.call_args.kwargs['batch_size'], 32)
+
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class InvalidationTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.cleared = []
+        for name, value in (('_handlers', [self.cleared.append]), ('_applied_versions', {})):
+            patcher = patch.object(invalidation, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch('chat.invalidation._publish')
+        self.publish = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_invalidation_is_applied_locally_and_broadcast(self):
+        invalidation.check_version('r1', None)
+        before = get_knowledge_version('r1')
+
+        self.assertEqual(invalidation.invalidate_restaurant('r1'), 1)
+
+        self.assertEqual(self.cleared, ['r1'])
+        self.publish.assert_called_once_with({'restaurant_uid': 'r1', 'version': 1})
+        # Answers cached against the old knowledge version are no longer reachable
+        self.assertEqual(get_knowledge_version('r1'), before + 1)
+
+    def test_received_message_applies_once(self):
+        invalidation.handle_message(json.dumps({'restaurant_uid': 'r1', 'version': 3}))
+        invalidation.handle_message(json.dumps({'restaurant_uid': 'r1', 'version': 3}))
+        invalidation.handle_message(json.dumps({'restaurant_uid': 'r1', 'version': 2}))
+        self.assertEqual(self.cleared, ['r1'])
+
+    def test_missed_message_is_caught_by_version_check(self):
+        invalidation.check_version('r1', 4)
+        self.assertEqual(self.cleared, [])
+        invalidation.check_version('r1', 4)
+        self.assertEqual(self.cleared, [])
+
+        # Another process invalidated r1 while this one was not listening
+        invalidation.check_version('r1', 5)
+        self.assertEqual(self.cleared, ['r1'])
+
+    def test_redis_client_is_shared_per_process(self):
+        with patch.object(invalidation, '_redis', (None, None, None)), \
+                patch('chat.invalidation.redis_url', return_value='redis://cache:6379/1'), \
+                patch('redis.Redis.from_url', side_effect=lambda url: Mock()) as from_url:
+            client = invalidation.redis_client()
+            self.assertIs(invalidation.redis_client(), client)
+            self.assertEqual(from_url.call_count, 1)
+
+            with patch('chat.invalidation.os.getpid', return_value=-1):
+                self.assertIsNot(invalidation.redis_client(), client)
+
+
+class StageTimerTests(SimpleTestCase):
+    def test_nested_stages_are_exclusive(self):
+        with patch('chat.timing.time.perf_counter', side_effect=[0.0, 0.0, 1.0, 1.5, 3.5]):
+            timer = StageTimer('r1')
+            with timer.stage('llm'):
+                with timer.stage('retrieval'):
+                    pass
+        self.assertEqual(timer.stages, {'llm': 3.0, 'retrieval': 0.5})
+
+        with patch('chat.timing.time.perf_counter', return_value=4.0):
+            self.assertEqual(timer.server_timing(), 'retrieval;dur=500.0, llm;dur=3000.0, total;dur=4000.0')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RetrievalModeTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = patch('chat.agent.get_chat_model', return_value=OpenAIChat(id='gpt-4o-mini', api_key='test'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def build(self, mode):
+        return RestaurantAgent('r1', 'Sushi Bar', knowledge=None, retrieval_mode=mode).agent
+
+    def test_modes_configure_retrieval(self):
+        inject = self.build('inject')
+        self.assertTrue(inject.add_knowledge_to_context)
+        self.assertFalse(inject.search_knowledge)
+
+        tool = self.build('tool')
+        self.assertFalse(tool.add_knowledge_to_context)
+        self.assertTrue(tool.search_knowledge)
+
+        hybrid = self.build('hybrid')
+        self.assertTrue(hybrid.add_knowledge_to_context)
+        self.assertTrue(hybrid.search_knowledge)
+
+        with self.assertRaises(ValueError):
+            self.build('always')
+
+    def test_metrics_per_mode(self):
+        search = SimpleNamespace(tool_name='search_knowledge_base')
+        record_run('tool', 'r1', 1.2, SimpleNamespace(input_tokens=900, output_tokens=100), [search, search])
+        record_run('tool', 'r1', 0.8, SimpleNamespace(input_tokens=700, output_tokens=100), [search])
+        record_run('inject', 'r1', 0.5, SimpleNamespace(input_tokens=600, output_tokens=100), [])
+
+        self.assertEqual(retrieval_stats('tool'), {
+            'runs': 2,
+            'avg_latency_ms': 1000.0,
+            'avg_input_tokens': 800.0,
+            'avg_output_tokens': 100.0,
+            'avg_search_calls': 1.5,
+        })
+        self.assertEqual(retrieval_stats('inject')['avg_search_calls'], 0.0)
+        self.assertIsNone(retrieval_stats('hybrid')['avg_latency_ms'])
+
+    def test_metrics_use_one_redis_round_trip(self):
+        client = Mock()
+        with patch('chat.metrics.redis_client', return_value=client):
+            record_run('tool', 'r1', 1.2, SimpleNamespace(input_tokens=900, output_tokens=100), [])
+
+        pipeline = client.pipeline.return_value
+        self.assertEqual(pipeline.incrby.call_count, 5)
+        pipeline.incrby.assert_any_call(cache.make_key('chat:retrieval:stats:tool:latency_ms'), 1200)
+        pipeline.execute.assert_called_once_with()
+
+
+class FakeEmbedder:
+    """
+    Bag-of-words embedder: questions with the same words get identical vectors.
+    """
+    vocabulary = ['menu', 'vegan', 'price', 'hi', 'ana', 'options', 'do', 'you', 'have']
+
+    async def async_get_embedding(self, text):
+        words = text.lower().replace('?', '').replace(',', '').split()
+        return [float(words.count(word)) for word in self.vocabulary]
+
+
+def knowledge_doc(doc_type, uid, content):
+    return {'content': content, 'meta_data': {'type': doc_type, f"{doc_type}_uid": uid, 'restaurant_uid': 'r1'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ContextAssemblerTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.overview = knowledge_doc(
+            'restaurant', 'r1',
+            "RESTAURANT: Thai Town\nFULL MENU OVERVIEW:\n" + "\n".join(f"- Dish {i}: ${i}.00" for i in range(400))
+        )
+        self.pad_thai = knowledge_doc('menu', 'm1', "MENU ITEM / FOOD: Pad Thai\nPRICE: $12.50\nINGREDIENTS: Peanut")
+        self.pad_thai_old = knowledge_doc('menu', 'm1', "MENU ITEM / FOOD: Pad Thai\nPRICE: $11.00\nINGREDIENTS: Peanut")
+        self.curry = knowledge_doc('menu', 'm2', "MENU ITEM / FOOD: Green Curry\nPRICE: $14.00\nINGREDIENTS: Basil")
+
+    def test_classify_query(self):
+        self.assertEqual(classify_query('How much is the pad thai?'), 'lookup')
+        self.assertEqual(classify_query('What do you recommend?'), 'overview')
+        self.assertEqual(classify_query('Are you open on Sunday?'), 'general')
+
+    def test_dedupes_ranks_and_packs_to_budget(self):
+        """
+        Older copies of a record are dropped, item documents outrank the overview for
+        lookups, and the oversized overview is truncated to the remaining budget.
+        """
+        assembler = ContextAssembler(budget_tokens=300)
+        assembled = assembler.assemble(
+            [self.overview, self.pad_thai, self.pad_thai_old, dict(self.curry)], 'lookup'
+        )
+        contents = [d['content'] for d in assembled.documents]
+
+        self.assertEqual(contents[:2], [self.pad_thai['content'], self.curry['content']])
+        self.assertTrue(contents[2].startswith('RESTAURANT: Thai Town'))
+        self.assertLessEqual(sum(count_tokens(c) for c in contents), 300)
+
+        stats = assembled.stats
+        self.assertEqual((stats.retrieved, stats.deduped, stats.packed, stats.truncated), (4, 3, 3, 1))
+        self.assertGreater(stats.retrieved_tokens, stats.packed_tokens)
+        self.assertEqual(context_stats()['avg_packed_tokens'], stats.packed_tokens)
+
+    def test_stats_use_one_redis_round_trip(self):
+        client = Mock()
+        with patch('chat.metrics.redis_client', return_value=client):
+            ContextAssembler(budget_tokens=300).assemble([self.pad_thai, self.curry], 'lookup')
+
+        pipeline = client.pipeline.return_value
+        self.assertEqual(pipeline.incrby.call_count, 5)
+        pipeline.incrby.assert_any_call(cache.make_key('chat:context:stats:assemblies'), 1)
+        pipeline.execute.assert_called_once_with()
+
+    def test_keeps_every_chunk_of_a_record(self):
+        chunks = [
+            knowledge_doc('restaurant', 'r1', "RESTAURANT: Thai Town\n" + "\n".join(f"- Dish {i}" for i in range(20))),
+            knowledge_doc('restaurant', 'r1', "\n".join(f"- Noodle {i}: ${i}.50 spicy" for i in range(20))),
+        ]
+        for position, chunk in enumerate(chunks):
+            chunk['meta_data'].update(chunk=position, chunks=len(chunks))
+
+        self.assertEqual(ContextAssembler(budget_tokens=300).dedupe(chunks), chunks)
+
+    def test_near_duplicate_chunks(self):
+        copy = {'content': self.curry['content'] + ' ', 'meta_data': {}}
+        self.assertEqual(len(ContextAssembler(budget_tokens=300).dedupe([self.curry, copy])), 1)
+
+
+class FakeChatAgent:
+    embedder = FakeEmbedder()
+
+    def __init__(self):
+        self.contexts = []
+
+    async def achat(self, message, rolling_summary=None):
+        self.contexts.append(rolling_summary)
+        return f"Answer to: {message}"
+
+    async def astream_chat(self, message, rolling_summary=None):
+        for chunk in ['Answer ', 'to: ', message]:
+            yield chunk
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ChatAPIViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user(
+            email='owner@example.com', password='password', role=UserRole.RESTAURANT_OWNER
+        )
+        self.restaurant = Restaurant.objects.create(owner=owner, name='Sushi Bar', description='Fresh fish')
+        self.url = reverse('chat:chat', kwargs={'restaurant_uid': self.restaurant.uid})
+        self.agent = FakeChatAgent()
+
+        patchers = {
+            'knowledge': patch('chat.views.aget_restaurant_knowledge'),
+            'agent': patch('chat.views.get_restaurant_agent', return_value=self.agent),
+            'summary_task': patch('chat.views.update_thread_summary'),
+        }
+        self.mocks = {}
+        for name, patcher in patchers.items():
+            self.mocks[name] = patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_new_thread_and_continuation(self):
+        """
+        The async endpoint answers without waiting for the summary, and the next turn
+        sees the turns the summary task has not processed yet.
+        """
+        response = self.client.post(self.url, {'message': 'Hi, I am Ana'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['ai_response'], 'Answer to: Hi, I am Ana')
+
+        thread = Thread.objects.get(uid=data['thread_uid'])
+        self.assertIsNone(thread.summary)
+        self.mocks['summary_task'].delay.assert_called_once_with(str(thread.uid))
+
+        response = self.client.post(
+            self.url, {'message': 'Any specials today?', 'thread_uid': data['thread_uid']}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Message.objects.filter(thread=thread).count(), 2)
+        self.assertIn('User: Hi, I am Ana', self.agent.contexts[-1])
+
+    def test_semantic_cache_hit_and_invalidation(self):
+        """
+        A repeated first-turn question is answered from the cache until the knowledge version changes.
+        """
+        for question in ['Do you have vegan options?', 'do you have vegan options']:
+            response = self.client.post(self.url, {'message': question}, content_type='application/json')
+            self.assertEqual(response.json()['ai_response'], 'Answer to: Do you have vegan options?')
+        self.assertEqual(len(self.agent.contexts), 1)
+        self.assertEqual(answer_cache.stats(str(self.restaurant.uid))['hits'], 1)
+
+        bump_knowledge_version(str(self.restaurant.uid))
+        self.client.post(self.url, {'message': 'Do you have vegan options?'}, content_type='application/json')
+        self.assertEqual(len(self.agent.contexts), 2)
+
+    def test_semantic_cache_skipped_with_context(self):
+        """
+        A near-duplicate question in an existing thread goes to the agent, not the cache.
+        """
+        self.client.post(self.url, {'message': 'Do you have vegan options?'}, content_type='application/json')
+        response = self.client.post(self.url, {'message': 'Hi, I am Ana'}, content_type='application/json')
+        thread_uid = response.json()['thread_uid']
+
+        response = self.client.post(
+            self.url, {'message': 'do you have vegan options', 'thread_uid': thread_uid}, content_type='application/json'
+        )
+        self.assertEqual(response.json()['ai_response'], 'Answer to: do you have vegan options')
+        self.assertEqual(len(self.agent.contexts), 3)
+        self.assertIn('User: Hi, I am Ana', self.agent.contexts[-1])
+        self.assertEqual(answer_cache.stats(str(self.restaurant.uid))['hits'], 0)
+
+    async def test_semantic_cache_stats_use_one_redis_round_trip(self):
+        client = Mock()
+        with patch('chat.metrics.redis_client', return_value=client):
+            await answer_cache._record('r1', 'hit')
+
+        pipeline = client.pipeline.return_value
+        self.assertEqual(
+            [c.args for c in pipeline.incrby.call_args_list],
+            [(cache.make_key('chat:answers:stats:r1:hit'), 1), (cache.make_key('chat:answers:stats:all:hit'), 1)],
+        )
+        pipeline.execute.assert_called_once_with()
+
+    def test_authentication(self):
+        """
+        Chats without a token are anonymous; an invalid token is rejected, not ignored.
+        """
+        response = self.client.post(self.url, {'message': 'Hi'}, content_type='application/json')
+        self.assertIsNone(Thread.objects.get(uid=response.json()['thread_uid']).user)
+
+        user = User.objects.create_user(email='guest@example.com', password='password')
+        token = str(RefreshToken.for_user(user).access_token)
+        response = self.client.post(
+            self.url, {'message': 'Hi'}, content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}'
+        )
+        self.assertEqual(Thread.objects.get(uid=response.json()['thread_uid']).user, user)
+
+        response = self.client.post(
+            self.url, {'message': 'Hi'}, content_type='application/json', HTTP_AUTHORIZATION='Bearer forged'
+        )
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['code'], 'token_not_valid')
+        self.assertEqual(Thread.objects.count(), 2)
+
+    def test_validation_and_not_found(self):
+        response = self.client.post(self.url, {'message': ''}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        missing_url = reverse('chat:chat', kwargs={'restaurant_uid': '00000000-0000-0000-0000-000000000000'})
+        response = self.client.post(missing_url, {'message': 'Hi'}, content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_schema_documents_endpoint(self):
+        response = self.client.get(reverse('schema-json'), {'format': 'openapi'})
+        schema = response.json()
+        base_path = schema.get('basePath', '').rstrip('/')
+        paths = {base_path + path: item for path, item in schema['paths'].items()}
+        operation = paths['/api/chat/{restaurant_uid}/']['post']
+        self.assertEqual(operation['tags'], ['Chat'])
+        self.assertEqual(operation['parameters'][1]['schema']['required'], ['message'])
+
+    def test_server_timing_and_metrics(self):
+        """
+        With timing enabled, responses carry per-stage Server-Timing and the stages
+        show up in the Prometheus histograms for a scraper holding the metrics token;
+        disabled, neither is exposed.
+        """
+        response = self.client.post(self.url, {'message': 'Hi'}, content_type='application/json')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get(reverse('chat:metrics')).status_code, 404)
+
+        with patch('chat.timing.CHAT_TIMING_ENABLED', True), patch('chat.views.CHAT_TIMING_ENABLED', True):
+            response = self.client.post(self.url, {'message': 'Hi'}, content_type='application/json')
+            stages = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+            self.assertEqual(stages, ['orm', 'router', 'answer_cache', 'persist', 'total'])
+
+            self.assertEqual(self.client.get(reverse('chat:metrics')).status_code, 403)
+            with patch('chat.views.CHAT_METRICS_TOKEN', 'scrape-secret'):
+                response = self.client.get(reverse('chat:metrics'), HTTP_AUTHORIZATION='Bearer wrong')
+                self.assertEqual(response.status_code, 403)
+                response = self.client.get(reverse('chat:metrics'), HTTP_AUTHORIZATION='Bearer scrape-secret')
+            metrics = response.content.decode()
+            self.assertIn(
+                f'chat_stage_duration_seconds_count{{restaurant="{self.restaurant.uid}",stage="orm"}}', metrics
+            )
+
+    async def test_stream_mode(self):
+        """
+        `?stream=1` streams tokens as SSE, sending the thread UID first and persisting the message at the end.
+        """
+        response = await AsyncClient().post(
+            f"{self.url}?stream=1", {'message': 'Vegan?'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        body = ''.join([chunk.decode() async for chunk in response.streaming_content])
+        frames = [frame for frame in body.split('\n\n') if frame]
+        self.assertTrue(frames[0].startswith('event: thread'))
+        self.assertEqual([f.split('\n')[0] for f in frames[1:]], ['event: token'] * 3 + ['event: done'])
+
+        message = await Message.objects.select_related('thread').aget(thread__restaurant=self.restaurant)
+        self.assertEqual(message.ai_response, 'Answer to: Vegan?')
+        self.assertIn(str(message.thread.uid), frames[0])
+
+    async def test_stream_mode_finishes_request_timer(self):
+        with patch('chat.timing.CHAT_TIMING_ENABLED', True), patch.object(StageTimer, 'finish') as finish:
+            response = await AsyncClient().post(
+                f"{self.url}?stream=1", {'message': 'Vegan?'}, content_type='application/json'
+            )
+            self.assertNotIn('Server-Timing', response)
+            finish.assert_not_called()
+            [chunk async for chunk in response.streaming_content]
+        finish.assert_called_once_with()
+
+
+class ThreadSummaryTaskTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user(
+            email='owner@example.com', password='password', role=UserRole.RESTAURANT_OWNER
+        )
+        restaurant = Restaurant.objects.create(owner=owner, name='Sushi Bar', description='Fresh fish')
+        self.thread = Thread.objects.create(restaurant=restaurant)
+
+    def add_turn(self, text):
+        return Message.objects.create(thread=self.thread, user_message=text, ai_response=f"re: {text}")
+
+    @patch('chat.agent.summarize_conversation')
+    def test_folds_all_pending_turns(self, summarize):
+        summarize.side_effect = lambda summary, turns: f"{summary or ''}+{len(turns)}"
+        self.add_turn('one')
+        last = self.add_turn('two')
+
+        update_thread_summary(str(self.thread.uid))
+
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.summary, '+2')
+        self.assertEqual(self.thread.summarized_message, last)
+
+        # Nothing pending: no LLM call
+        update_thread_summary(str(self.thread.uid))
+        self.assertEqual(summarize.call_count, 1)
+
+    @patch('chat.agent.summarize_conversation')
+    def test_older_task_never_overwrites_newer_summary(self, summarize):
+        """
+        If another task advances the summary while this one runs, this one recomputes from the new pointer.
+        """
+        self.add_turn('one')
+        second = self.add_turn('two')
+
+        def summarize_racing(summary, turns):
+            if summarize.call_count == 1:
+                # A concurrent task finishes first and covers both turns
+                Thread.objects.filter(pk=self.thread.pk).update(summary='newer', summarized_message=second)
+                return 'stale'
+            return f"{summary}+{len(turns)}"
+
+        summarize.side_effect = summarize_racing
+        update_thread_summary(str(self.thread.uid))
+
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.summary, 'newer')
+        self.assertEqual(self.thread.summarized_message, second)
+
+
+class IntentRouterTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user(
+            email='owner@example.com', password='password', role=UserRole.RESTAURANT_OWNER
+        )
+        self.restaurant = Restaurant.objects.create(owner=owner, name='Thai Town', description='Thai food')
+        self.pad_thai = Menu.objects.create(restaurant=self.restaurant, name='Pad Thai', price='12.50')
+        self.curry = Menu.objects.create(restaurant=self.restaurant, name='Green Curry', price='14.00')
+        basil = Ingredients.objects.create(restaurant=self.restaurant, name='Basil')
+        MenuIngredientsConnector.objects.create(restaurant=self.restaurant, menu=self.curry, ingredient=basil)
+        self.pad_thai.allergens.add(Allergen.objects.get(name='Peanut'))
+        self.router = IntentRouter(enabled=True, min_confidence=0.8, max_items=50)
+
+    def route(self, message):
+        return self.router.route(self.restaurant, message)
+
+    def test_price(self):
+        routed = self.route('How much is the pad thai?')
+        self.assertEqual(routed.intent, 'price')
+        self.assertEqual(routed.answer, 'Pad Thai costs $12.50.')
+
+        # Typo still resolves through the fuzzy match
+        self.assertEqual(self.route('how much is the green cury').answer, 'Green Curry costs $14.00.')
+
+        # Every separately named item is answered; a name inside a longer one is not
+        Menu.objects.create(restaurant=self.restaurant, name='Curry', price='9.00')
+        self.assertEqual(
+            self.route('How much are the Pad Thai and the Green Curry?').answer,
+            'Pad Thai costs $12.50. Green Curry costs $14.00.',
+        )
+
+    def test_menu_list(self):
+        routed = self.route("What's on the menu?")
+        self.assertEqual(routed.intent, 'menu_list')
+        self.assertIn('- Pad Thai: $12.50', routed.answer)
+        self.assertIn('- Green Curry: $14.00', routed.answer)
+
+    def test_contains(self):
+        routed = self.route('What contains peanuts?')
+        self.assertEqual(routed.intent, 'contains')
+        self.assertIn('These menu items contain Peanut: Pad Thai.', routed.answer)
+
+        self.assertIn('Green Curry', self.route('Which dishes are made with basil?').answer)
+        self.assertTrue(self.route('Does the green curry contain peanuts?').answer.startswith(
+            'Green Curry is not listed as containing Peanut'
+        ))
+
+        # A misspelled ingredient is answered only if it is close enough
+        self.assertIn('Green Curry', self.route('What contains basill?').answer)
+        self.assertIsNone(self.route('What contains bread?'))
+
+    def test_falls_back_to_agent(self):
+        """
+        Open questions, exclusion queries and ambiguous matches are left to the agent.
+        """
+        self.assertIsNone(self.route('Tell me about your restaurant'))
+        self.assertIsNone(self.route('Which items are without peanuts?'))
+        self.assertIsNone(self.route('How much is the soup?'))
+        self.assertIsNone(self.route('Anything with less salt?'))
+        self.assertIsNone(self.route('What goes well with rice?'))
+        self.assertIsNone(self.route(
+            'Can you look at the menu and tell me which dish would go well with a glass of white wine tonight?'
+        ))
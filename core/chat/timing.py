@@ -0,0 +1,159 @@
+"""
+Per-stage latency instrumentation for the chat pipeline.
+A request-scoped `StageTimer` (held in a context variable) collects the time
+spent in each stage: ORM lookups, retrieval, the LLM call, persistence, and the
+summarizer in the Celery worker. Timings are exposed as a `Server-Timing`
+header, structured log fields and Prometheus histograms.
+
+With CHAT_TIMING_ENABLED off no timer is created and `stage()` is a shared
+no-op context manager, so the only cost is one context variable lookup.
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from decouple import config
+
+logger = logging.getLogger(__name__)
+
+CHAT_TIMING_ENABLED = config("CHAT_TIMING_ENABLED", default=False, cast=bool)
+# Bearer token the Prometheus scraper sends to /api/chat/metrics/ (unset: the endpoint refuses every request)
+CHAT_METRICS_TOKEN = config("CHAT_METRICS_TOKEN", default="")
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_timer: ContextVar[Optional["StageTimer"]] = ContextVar("chat_stage_timer", default=None)
+_NOOP = nullcontext()
+_histogram = None
+
+
+def get_stage_histogram():
+    """
+    Prometheus histogram of stage durations, created on first use.
+    """
+    global _histogram
+    if _histogram is None:
+        from prometheus_client import Histogram
+        _histogram = Histogram(
+            "chat_stage_duration_seconds",
+            "Time spent in each stage of the chat pipeline.",
+            ["stage", "restaurant"],
+            buckets=STAGE_BUCKETS,
+        )
+    return _histogram
+
+
+class StageTimer:
+    """
+    Collects exclusive wall-clock time per stage for one request or task.
+    Nested stages are subtracted from their parent, so stages add up to the total.
+    """
+
+    def __init__(self, restaurant_uid: str = ''):
+        """
+        Args:
+            restaurant_uid: Restaurant UID used as the metrics label
+        """
+        self.restaurant_uid = restaurant_uid
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        # Time spent in child stages, one entry per open stage
+        self._children: List[float] = []
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Time a block of code as `name`.
+        """
+        started = time.perf_counter()
+        self._children.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            children = self._children.pop()
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed - children
+            if self._children:
+                self._children[-1] += elapsed
+
+    @property
+    def total(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """
+        Format the stages as a `Server-Timing` header value (milliseconds).
+        """
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        entries.append(f"total;dur={self.total * 1000:.1f}")
+        return ", ".join(entries)
+
+    def finish(self, event: str = "Chat timings"):
+        """
+        Log the stages as structured fields and observe them in Prometheus.
+        """
+        timings_ms = {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()}
+        timings_ms['total'] = round(self.total * 1000, 1)
+        logger.info(
+            f"{event} for {self.restaurant_uid}: " + " ".join(f"{name}_ms={ms}" for name, ms in timings_ms.items()),
+            extra={'restaurant_uid': self.restaurant_uid, 'stage_timings_ms': timings_ms},
+        )
+        try:
+            histogram = get_stage_histogram()
+            for name, seconds in self.stages.items():
+                histogram.labels(stage=name, restaurant=self.restaurant_uid).observe(seconds)
+        except Exception as e:
+            logger.error(f"Error observing stage timings: {str(e)}", exc_info=True)
+
+
+def start_timer(restaurant_uid: str = '') -> Optional[StageTimer]:
+    """
+    Start timing the current request or task, if instrumentation is enabled.
+
+    Returns:
+        The new StageTimer, or None when disabled
+    """
+    if not CHAT_TIMING_ENABLED:
+        return None
+    timer = StageTimer(restaurant_uid)
+    _current_timer.set(timer)
+    return timer
+
+
+def current_timer() -> Optional[StageTimer]:
+    return _current_timer.get()
+
+
+def use_timer(timer: Optional[StageTimer]):
+    """
+    Make `timer` current in this context, e.g. inside a streaming response
+    generator that outlives the view that started it.
+    """
+    _current_timer.set(timer)
+
+
+def stage(name: str):
+    """
+    Time a block as `name` on the current timer; a no-op when none is active.
+    """
+    timer = _current_timer.get()
+    if timer is None:
+        return _NOOP
+    return timer.stage(name)
+
+
+def render_metrics() -> bytes:
+    """
+    Render the Prometheus exposition, aggregating worker processes when
+    PROMETHEUS_MULTIPROC_DIR is set (gunicorn/uvicorn with several workers).
+    """
+    from prometheus_client import CollectorRegistry, REGISTRY, generate_latest, multiprocess
+
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
@@ -0,0 +1,67 @@
+"""
+Agent tools backed by the database rather than the vector store.
+"""
+import json
+import logging
+from typing import Callable
+
+from asgiref.sync import sync_to_async
+
+from restaurants.models import Restaurant
+from restaurants.exclusion_index import get_exclusion_index, resolve_terms
+
+logger = logging.getLogger(__name__)
+
+ALLERGY_NOTICE = "Please confirm with our staff if you have a severe allergy."
+
+
+def find_menu_items_without(restaurant_uid: str, excluded: str) -> dict:
+    """
+    List a restaurant's menu items that contain none of the given allergens or ingredients.
+
+    Args:
+        restaurant_uid: Restaurant UID
+        excluded: Comma-separated allergen or ingredient names
+
+    Returns:
+        Dict with safe_items, excluded and unrecognized terms
+    """
+    restaurant_id = Restaurant.objects.values_list('id', flat=True).get(uid=restaurant_uid)
+    index = get_exclusion_index(restaurant_id)
+    allergen_ids, ingredient_ids, unknown = resolve_terms(index, excluded.split(','))
+    return {
+        'safe_items': [
+            {'name': name, 'price': price}
+            for _, name, price in index.excluding(allergen_ids, ingredient_ids)
+        ],
+        'excluded': [term.strip() for term in excluded.split(',') if term.strip() and term.strip() not in unknown],
+        'unrecognized': unknown,
+        'notice': ALLERGY_NOTICE,
+    }
+
+
+def make_exclusion_tool(restaurant_uid: str) -> Callable:
+    """
+    Build the `menu_items_without` tool bound to one restaurant.
+    The tool is async so agno awaits it inside the async run instead of
+    touching the ORM from the event loop.
+    """
+    async def menu_items_without(excluded: str) -> str:
+        """
+        Find menu items that do NOT contain the given allergens or ingredients.
+        Use this for "without X", "X-free" or "safe for an X allergy" questions.
+
+        Args:
+            excluded: Comma-separated allergen or ingredient names, e.g. "peanut, milk"
+
+        Returns:
+            JSON with the safe menu items (name and price) and any unrecognized terms
+        """
+        try:
+            result = await sync_to_async(find_menu_items_without)(restaurant_uid, excluded)
+        except Exception as e:
+            logger.error(f"Error running exclusion tool for {restaurant_uid}: {str(e)}", exc_info=True)
+            return json.dumps({'error': 'Exclusion lookup failed, use the knowledge base instead.'})
+        return json.dumps(result)
+
+    return menu_items_without
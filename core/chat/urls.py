@@ -7,5 +7,8 @@ from chat import views
 app_name = 'chat'
 
 urlpatterns = [
+    path('metrics/', views.prometheus_metrics, name='metrics'),
+    path('retrieval-stats/', views.RetrievalStatsView.as_view(), name='retrieval-stats'),
     path('<uuid:restaurant_uid>/', views.ChatAPIView.as_view(), name='chat'),
+    path('<uuid:restaurant_uid>/cache-stats/', views.AnswerCacheStatsView.as_view(), name='answer-cache-stats'),
 ]
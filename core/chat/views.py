@@ -1,78 +1,167 @@
+import hmac
+import json
+import logging
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from decouple import config
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, Http404, JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.generics import GenericAPIView
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework import status
-from django.shortcuts import get_object_or_404
-import logging
+from rest_framework_simplejwt.authentication import JWTAuthentication
 
 from restaurants.models import Restaurant
 from chat.models import Thread, Message
 from chat.serializers import ChatRequestSerializer, ChatResponseSerializer
-from chat.knowledge import get_restaurant_knowledge
-from chat.agent import create_restaurant_agent
+from chat.knowledge import aget_restaurant_knowledge, knowledge_cache
+from chat.agent import get_restaurant_agent, build_conversation_context
+from chat.tasks import update_thread_summary
+from chat.answer_cache import answer_cache
+from chat.router import intent_router
+from chat.agent import RETRIEVAL_MODES, CHAT_RETRIEVAL_MODE
+from chat.metrics import retrieval_stats, context_stats
+from chat.timing import (
+    CHAT_METRICS_TOKEN, CHAT_TIMING_ENABLED, current_timer, render_metrics, stage, start_timer, use_timer,
+)
+from commons.permissions import IsSuperAdmin, IsPlatformAdmin
 
 logger = logging.getLogger(__name__)
 
+ERROR_MESSAGE = "An error occurred while processing your request. Please try again."
+
+# Un-summarized turns passed to the agent while the summary task is still pending
+CHAT_MAX_PENDING_TURNS = config("CHAT_MAX_PENDING_TURNS", default=5, cast=int)
+
+
+def sse_event(event: str, data: dict) -> str:
+    """
+    Format a single Server-Sent Events frame with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
 
-class ChatAPIView(GenericAPIView):
+@method_decorator(csrf_exempt, name='dispatch')
+class ChatAPIView(View):
     """
     Chat endpoint for restaurant queries using RAG.
+    Runs as a native async view so that, under an ASGI server, a worker is not
+    blocked while waiting on the LLM and vector store.
 
     POST /api/chat/<restaurant_uid>/
+
+    Send `Accept: text/event-stream` or `?stream=1` to receive the answer as
+    Server-Sent Events (`thread`, `token`..., then `done` or `error`).
+
+    With CHAT_TIMING_ENABLED, JSON responses carry a `Server-Timing` header with
+    the time spent per stage (orm, router, answer_cache, llm, retrieval, persist).
     """
-    permission_classes = [AllowAny]
-    serializer_class = ChatRequestSerializer
+    http_method_names = ['post', 'options']
+
+    @staticmethod
+    async def get_user(request):
+        """
+        Resolve the optional JWT user for the request.
+        Anonymous chats are allowed only without an `Authorization` header; a token
+        that fails validation raises `AuthenticationFailed`, as under DRF.
+        """
+        authentication = JWTAuthentication()
+        result = await sync_to_async(authentication.authenticate)(request)
+        return result[0] if result else None
+
+    @staticmethod
+    def authentication_failed(exc: AuthenticationFailed) -> JsonResponse:
+        """
+        401 response shaped like DRF's exception handler output.
+        """
+        data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+        response = JsonResponse(data, status=status.HTTP_401_UNAUTHORIZED, safe=False)
+        response['WWW-Authenticate'] = JWTAuthentication().authenticate_header(None)
+        return response
+
+    @staticmethod
+    def wants_stream(request) -> bool:
+        if request.GET.get('stream', '').lower() in ('1', 'true', 'yes'):
+            return True
+        return 'text/event-stream' in request.headers.get('Accept', '')
+
+    async def post(self, request, restaurant_uid):
+        timer = start_timer(str(restaurant_uid))
+        response = await self.handle(request, restaurant_uid)
+        # A streamed answer takes the timer over and finishes it when the stream ends
+        if timer is not None and not response.streaming:
+            response['Server-Timing'] = timer.server_timing()
+            timer.finish()
+        return response
+
+    async def handle(self, request, restaurant_uid):
+        try:
+            user = await self.get_user(request)
+        except AuthenticationFailed as e:
+            return self.authentication_failed(e)
 
-    def post(self, request, restaurant_uid):
         # Validate request data
-        serializer = self.get_serializer(data=request.data)
+        try:
+            payload = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({"error": "Invalid JSON body."}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = ChatRequestSerializer(data=payload)
         if not serializer.is_valid():
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
         validated_data = serializer.validated_data
         user_message = validated_data['message']
         thread_uid = validated_data.get('thread_uid')
 
-        # Get restaurant
-        restaurant = get_object_or_404(Restaurant, uid=restaurant_uid)
-
-        # Get or create thread
-        if thread_uid:
-            # Continue existing conversation
-            thread = get_object_or_404(Thread, uid=thread_uid, restaurant=restaurant)
-        else:
-            # Create new thread
-            thread = Thread.objects.create(
-                restaurant=restaurant,
-                user=request.user if request.user.is_authenticated else None,
-            )
+        with stage('orm'):
+            # Get restaurant
+            try:
+                restaurant = await Restaurant.objects.aget(uid=restaurant_uid)
+            except Restaurant.DoesNotExist:
+                return JsonResponse({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        try:
-            # Get knowledge base for this restaurant
-            knowledge = get_restaurant_knowledge(str(restaurant.uid))
+            # Get or create thread
+            if thread_uid:
+                # Continue existing conversation
+                try:
+                    thread = await Thread.objects.aget(uid=thread_uid, restaurant=restaurant)
+                except Thread.DoesNotExist:
+                    return JsonResponse({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+            else:
+                # Create new thread
+                thread = await Thread.objects.acreate(
+                    restaurant=restaurant,
+                    user=user,
+                )
 
-            # Create agent with name context
-            agent = create_restaurant_agent(str(restaurant.uid), restaurant.name, knowledge)
+        if self.wants_stream(request):
+            response = StreamingHttpResponse(
+                self.stream_events(restaurant, thread, user_message, current_timer()),
+                content_type='text/event-stream',
+            )
+            response['Cache-Control'] = 'no-cache'
+            # Disable proxy buffering (nginx) so tokens reach the client immediately
+            response['X-Accel-Buffering'] = 'no'
+            return response
 
-            # Get AI response using rolling summary as context
-            ai_response = agent.chat(user_message, rolling_summary=thread.summary)
+        try:
+            agent = await self.get_agent(restaurant)
+            rolling_context = await self.get_rolling_context(thread)
 
-            # Save message to database
-            message_obj = Message.objects.create(
-                thread=thread,
-                user_message=user_message,
-                ai_response=ai_response,
-            )
+            ai_response, lookup = await self.get_shortcut_answer(restaurant, agent, user_message, rolling_context)
+            if ai_response is None:
+                # Get AI response using rolling summary as context
+                ai_response = await agent.achat(user_message, rolling_summary=rolling_context)
+                await self.cache_answer(lookup, rolling_context, user_message, ai_response)
 
-            # Update rolling summary in the thread model
-            # This replaces the need for full history queries in future calls
-            updated_summary = agent.summarize(
-                current_summary=thread.summary,
-                user_message=user_message,
-                ai_response=ai_response
-            )
-            thread.summary = updated_summary
-            thread.save()
+            message_obj = await self.complete_turn(thread, user_message, ai_response)
 
             # Prepare response
             response_data = {
@@ -82,13 +171,180 @@ class ChatAPIView(GenericAPIView):
             }
 
             response_serializer = ChatResponseSerializer(response_data)
-            return Response(response_serializer.data, status=status.HTTP_200_OK)
+            return JsonResponse(response_serializer.data, status=status.HTTP_200_OK)
 
         except Exception as e:
             # Log the error and return a user-friendly message
             logger.error(f"Error in chat endpoint: {str(e)}", exc_info=True)
 
-            return Response(
-                {"error": "An error occurred while processing your request. Please try again."},
+            return JsonResponse(
+                {"error": ERROR_MESSAGE},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+    @staticmethod
+    async def get_agent(restaurant):
+        # Get knowledge base for this restaurant (through its active collection pointer)
+        knowledge = await aget_restaurant_knowledge(str(restaurant.uid))
+
+        # Reuse a warm agent for this restaurant (rebuilt if renamed)
+        return get_restaurant_agent(str(restaurant.uid), restaurant.name, knowledge)
+
+    @staticmethod
+    async def get_rolling_context(thread):
+        """
+        Latest completed summary plus the turns the summary task has not processed yet.
+        """
+        with stage('orm'):
+            recent = [
+                message async for message in thread.unsummarized_messages().reverse()[:CHAT_MAX_PENDING_TURNS]
+            ]
+        pending_turns = [(m.user_message, m.ai_response) for m in reversed(recent)]
+        return build_conversation_context(thread.summary, pending_turns)
+
+    @staticmethod
+    async def get_shortcut_answer(restaurant, agent, user_message: str, rolling_context: Optional[str]):
+        """
+        Answer without the LLM when possible: structured questions from the database,
+        then near-duplicate questions from the semantic cache.
+        The cache only holds context-free answers, so it is skipped for turns with
+        conversation context ("how much is it?" depends on what came before).
+
+        Returns:
+            (answer or None, answer cache lookup to store a fresh answer against)
+        """
+        with stage('router'):
+            routed = await sync_to_async(intent_router.route)(restaurant, user_message)
+        if routed is not None:
+            return routed.answer, None
+        if rolling_context:
+            return None, None
+
+        with stage('answer_cache'):
+            lookup = await answer_cache.alookup(str(restaurant.uid), user_message, agent.embedder)
+        if lookup and lookup.hit:
+            return lookup.answer, lookup
+        return None, lookup
+
+    @staticmethod
+    async def cache_answer(lookup, rolling_context, user_message: str, ai_response: str):
+        """
+        Store a freshly generated answer in the semantic cache.
+        Only answers produced without conversation context are shared, so a cached
+        answer never carries details (names, preferences) from another conversation.
+        """
+        if not rolling_context:
+            await answer_cache.astore(lookup, user_message, ai_response)
+
+    @staticmethod
+    async def complete_turn(thread, user_message: str, ai_response: str) -> Message:
+        """
+        Persist the finished turn and schedule the rolling summary update.
+        """
+        with stage('persist'):
+            # Save message to database
+            message_obj = await Message.objects.acreate(
+                thread=thread,
+                user_message=user_message,
+                ai_response=ai_response,
+            )
+
+            # The summary is updated by a background task so the user never waits on it
+            try:
+                await sync_to_async(update_thread_summary.delay)(str(thread.uid))
+            except Exception as e:
+                logger.error(f"Error queuing summary update: {str(e)}", exc_info=True)
+        return message_obj
+
+    async def stream_events(self, restaurant, thread, user_message: str, timer=None):
+        """
+        Yield SSE frames: the thread UID first, then tokens as they are generated.
+        The Message row is persisted once the stream completes.
+        The request's stage timer is logged and observed when the stream ends, even
+        if the client disconnects; headers are already sent by then, so streams
+        carry no `Server-Timing` header.
+        """
+        use_timer(timer)
+        try:
+            yield sse_event('thread', {'thread_uid': thread.uid})
+
+            agent = await self.get_agent(restaurant)
+            rolling_context = await self.get_rolling_context(thread)
+
+            shortcut, lookup = await self.get_shortcut_answer(restaurant, agent, user_message, rolling_context)
+            if shortcut is not None:
+                chunks = [shortcut]
+                yield sse_event('token', {'content': shortcut})
+            else:
+                chunks = []
+                async for chunk in agent.astream_chat(user_message, rolling_summary=rolling_context):
+                    chunks.append(chunk)
+                    yield sse_event('token', {'content': chunk})
+                await self.cache_answer(lookup, rolling_context, user_message, ''.join(chunks))
+
+            message_obj = await self.complete_turn(thread, user_message, ''.join(chunks))
+            yield sse_event('done', {'thread_uid': thread.uid, 'created_at': message_obj.created_at})
+
+        except Exception as e:
+            logger.error(f"Error in chat stream: {str(e)}", exc_info=True)
+            yield sse_event('error', {'error': ERROR_MESSAGE})
+
+        finally:
+            if timer is not None:
+                timer.finish()
+
+
+class AnswerCacheStatsView(GenericAPIView):
+    """
+    Semantic answer cache hit/miss counters for a restaurant (Admin only).
+
+    GET /api/chat/<restaurant_uid>/cache-stats/
+    """
+    permission_classes = [IsAuthenticated, IsSuperAdmin | IsPlatformAdmin]
+
+    def get(self, request, restaurant_uid):
+        return Response({
+            'restaurant': answer_cache.stats(str(restaurant_uid)),
+            'all': answer_cache.stats(),
+        }, status=status.HTTP_200_OK)
+
+
+class RetrievalStatsView(GenericAPIView):
+    """
+    Per-retrieval-mode agent latency, token and search-call averages,
+    knowledge tokens per context assembly stage, and the knowledge instance
+    cache of the serving process (Admin only).
+
+    GET /api/chat/retrieval-stats/
+    """
+    permission_classes = [IsAuthenticated, IsSuperAdmin | IsPlatformAdmin]
+
+    def get(self, request):
+        return Response({
+            'active_mode': CHAT_RETRIEVAL_MODE,
+            'modes': {mode: retrieval_stats(mode) for mode in RETRIEVAL_MODES},
+            'context': context_stats(),
+            'knowledge_cache': knowledge_cache.stats(),
+        }, status=status.HTTP_200_OK)
+
+
+def prometheus_metrics(request):
+    """
+    Chat stage latency histograms in Prometheus text format (404 when timing is disabled).
+    The histograms are labelled with restaurant UIDs, so the scraper must send
+    `Authorization: Bearer <CHAT_METRICS_TOKEN>`; with no token configured every request is refused.
+
+    GET /api/chat/metrics/
+    """
+    if not CHAT_TIMING_ENABLED:
+        raise Http404
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if not CHAT_METRICS_TOKEN or scheme.lower() != 'bearer' or not hmac.compare_digest(
+        token.strip().encode(), CHAT_METRICS_TOKEN.encode()
+    ):
+        return JsonResponse(
+            {"detail": "Authentication credentials were not provided."},
+            status=status.HTTP_403_FORBIDDEN,
+        )
+    from prometheus_client import CONTENT_TYPE_LATEST
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,80 @@
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Keyset pagination over (created_at, id), newest first.
+
+    Each page is read with `WHERE (created_at, id) < cursor ORDER BY created_at DESC, id DESC LIMIT n`
+    on the (created_at, id) indexes, so a deep page costs the same as the first one: no COUNT(*)
+    and no OFFSET scan. Unlike DRF's CursorPagination, ties on created_at are broken by id instead
+    of an offset. Clients pick the page size with `?page_size=`, up to max_page_size.
+    """
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        key = self.decode_position(self.cursor)
+
+        if key is None:
+            reverse = False
+            queryset = queryset.order_by('-created_at', '-id')
+        else:
+            created_at, pk = key
+            reverse = self.cursor.reverse
+            if reverse:
+                # Previous page: the rows just newer than the cursor, read oldest first
+                queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+                queryset = queryset.order_by('created_at', 'id')
+            else:
+                queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+                queryset = queryset.order_by('-created_at', '-id')
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, key is not None
+        return self.page
+
+    def decode_position(self, cursor):
+        """
+        (created_at, id) of a cursor, or None for the first page.
+        """
+        if cursor is None or cursor.position is None:
+            return None
+        try:
+            created_at, pk = cursor.position.rsplit('|', 1)
+            created_at = parse_datetime(created_at)
+            if created_at is None:
+                raise ValueError(cursor.position)
+            return created_at, int(pk)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_key(self, instance, reverse: bool) -> str:
+        position = f"{instance.created_at.isoformat()}|{instance.pk}"
+        return self.encode_cursor(Cursor(offset=0, reverse=reverse, position=position))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_key(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_key(self.page[0], reverse=True)
@@ -1,3 +1,36 @@
-from django.shortcuts import render
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 
-# Create your views here.
+
+class ConditionalGetMixin:
+    """
+    Answer GET with 304 Not Modified when the client's copy is current, before the view
+    loads or serializes anything, and send ETag / Last-Modified on full responses.
+
+    Views implement `get_conditional_state`. It runs after authentication and permission
+    checks, and returns None to skip conditional handling.
+    """
+
+    def get_conditional_state(self):
+        """
+        Returns:
+            (quoted strong ETag, Last-Modified as a Unix timestamp), or None
+        """
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        state = self.get_conditional_state()
+        if state is None:
+            return super().get(request, *args, **kwargs)
+
+        etag, last_modified = state
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        # Responses depend on the caller; let clients keep them, and revalidate every time
+        response['Cache-Control'] = 'private, no-cache'
+        return response
@@ -3,6 +3,7 @@ from celery import Celery
 from decouple import config
 
 TIME_ZONE = config("TIME_ZONE")
+KNOWLEDGE_OUTBOX_DRAIN_SECONDS = config("KNOWLEDGE_OUTBOX_DRAIN_SECONDS", default=5, cast=float)
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
@@ -25,6 +26,14 @@ app.conf.update(
     accept_content=["json"],  # Accept only JSON content for tasks
     result_serializer="json",  # Result serialization format
     timezone=TIME_ZONE,  # Set the timezone for Celery tasks
+    beat_schedule={
+        # Queue knowledge syncs recorded in the transactional outbox
+        'drain-knowledge-outbox': {
+            'task': 'restaurants.tasks.drain_knowledge_outbox',
+            'schedule': KNOWLEDGE_OUTBOX_DRAIN_SECONDS,
+            'options': {'expires': KNOWLEDGE_OUTBOX_DRAIN_SECONDS},
+        },
+    },
 )
 
 
@@ -160,7 +160,8 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    # Keyset pagination over (created_at, id): no COUNT(*) or OFFSET scans on large tables
+    'DEFAULT_PAGINATION_CLASS': 'commons.pagination.KeysetPagination',
     'PAGE_SIZE': int(os.environ.get('DRF_PAGE_SIZE', '20')),
     'DEFAULT_RENDERER_CLASSES': (
         'rest_framework.renderers.JSONRenderer',
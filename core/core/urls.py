@@ -9,6 +9,7 @@ from django.conf.urls.static import static
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework import permissions
+from chat.schema import SchemaGenerator
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -21,6 +22,7 @@ schema_view = get_schema_view(
     ),
     public=True,
     permission_classes=[permissions.AllowAny],
+    generator_class=SchemaGenerator,
 )
 
 urlpatterns = [
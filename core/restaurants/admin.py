@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Restaurant, Menu, Ingredients, MenuIngredientsConnector
+from .models import Restaurant, Menu, Ingredients, MenuIngredientsConnector, KnowledgeOutbox
 
 class MenuIngredientsConnectorInline(admin.TabularInline):
     model = MenuIngredientsConnector
@@ -34,3 +34,10 @@ class MenuIngredientsConnectorAdmin(admin.ModelAdmin):
     search_fields = ('menu__name', 'ingredient__name', 'restaurant__name')
     list_filter = ('restaurant', 'menu')
     ordering = ('restaurant', 'menu')
+
+@admin.register(KnowledgeOutbox)
+class KnowledgeOutboxAdmin(admin.ModelAdmin):
+    list_display = ('id', 'action', 'doc_type', 'doc_uid', 'attempts', 'created_at')
+    search_fields = ('doc_uid', 'restaurant_uid')
+    list_filter = ('doc_type', 'action')
+    ordering = ('id',)
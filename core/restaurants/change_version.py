@@ -0,0 +1,118 @@
+"""
+Per-restaurant change versions for conditional GET.
+Every committed change to a restaurant's data (the restaurant, its menus,
+ingredients, their links and menu allergens) replaces the restaurant's version
+in the cache with a new random token and timestamp; `restaurants.signals` and
+the bulk import do the bumping. Views derive strong ETags and Last-Modified
+from the versions of the restaurants a response covers, and answer
+If-None-Match / If-Modified-Since with 304 without loading or serializing
+anything.
+
+Besides one version per restaurant there are two shared scopes: `all`, bumped
+with every restaurant (for admin lists spanning all restaurants), and
+`allergens`, bumped when the allergen table changes. A version missing from
+the cache (never bumped, or evicted) is created on read: clients re-fetch once.
+"""
+import hashlib
+import logging
+import time
+import uuid
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CHANGE_VERSION_KEY = "restaurants:change_version:{scope}"
+
+ALL = 'all'
+ALLERGENS = 'allergens'
+
+
+def restaurant_scope(restaurant_id) -> str:
+    return f"restaurant:{restaurant_id}"
+
+
+def _new_version(previous: Optional[dict] = None) -> dict:
+    # A random token, not a counter: concurrent bumps never produce the same version.
+    # Last-Modified has a one-second resolution, so it moves forward on every bump
+    # to keep If-Modified-Since from matching a change made within the same second.
+    modified = int(time.time())
+    if previous:
+        modified = max(modified, previous['modified'] + 1)
+    return {'token': uuid.uuid4().hex, 'modified': modified}
+
+
+def _bump(scopes: Iterable[str]):
+    keys = [CHANGE_VERSION_KEY.format(scope=scope) for scope in scopes]
+    previous = cache.get_many(keys)
+    cache.set_many({key: _new_version(previous.get(key)) for key in keys}, timeout=None)
+
+
+def get_change_versions(scopes: Iterable[str]) -> Optional[Dict[str, dict]]:
+    """
+    Current versions of scopes, creating missing ones.
+
+    Returns:
+        Dict scope -> {'token', 'modified'}, or None if the cache backend is unavailable
+    """
+    keys = {CHANGE_VERSION_KEY.format(scope=scope): scope for scope in scopes}
+    try:
+        found = cache.get_many(keys)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            for key in missing:
+                cache.add(key, _new_version(), timeout=None)
+            # Another process may have won the add
+            found.update(cache.get_many(missing))
+    except Exception as e:
+        logger.error(f"Error reading change versions: {str(e)}", exc_info=True)
+        return None
+    if len(found) < len(keys):
+        return None
+    return {keys[key]: version for key, version in found.items()}
+
+
+def bump_change_version(restaurant_id):
+    """
+    Mark a restaurant's data changed (call once the change is committed).
+
+    Args:
+        restaurant_id: Restaurant primary key
+    """
+    try:
+        _bump([restaurant_scope(restaurant_id), ALL])
+    except Exception as e:
+        logger.error(f"Error bumping change version of restaurant {restaurant_id}: {str(e)}", exc_info=True)
+
+
+def bump_allergen_version():
+    """
+    Mark the allergen table changed; menus of every restaurant embed allergens.
+    """
+    try:
+        _bump([ALLERGENS])
+    except Exception as e:
+        logger.error(f"Error bumping allergen change version: {str(e)}", exc_info=True)
+
+
+def conditional_state(scopes: Iterable[str], variant: str = '') -> Optional[Tuple[str, int]]:
+    """
+    Strong ETag and Last-Modified timestamp of a response covering some scopes.
+
+    Args:
+        scopes: Scopes whose data the response contains
+        variant: Everything else the response depends on (resource, query parameters, ...)
+
+    Returns:
+        (quoted ETag, Last-Modified as a Unix timestamp), or None if versions are unavailable
+    """
+    scopes = sorted(set(scopes))
+    versions = get_change_versions(scopes)
+    if versions is None:
+        return None
+    digest = hashlib.sha256(variant.encode())
+    for scope in scopes:
+        digest.update(f"|{scope}={versions[scope]['token']}".encode())
+    last_modified = max((versions[scope]['modified'] for scope in scopes), default=0)
+    return f'"{digest.hexdigest()[:32]}"', last_modified
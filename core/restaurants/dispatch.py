@@ -0,0 +1,211 @@
+"""
+Transactional outbox for knowledge sync.
+Signals mark documents dirty instead of queuing Celery tasks directly:
+
+- Each change is written to the `KnowledgeOutbox` table as a (type, uid) row in
+  the same transaction as the data change. A rolled back change leaves no row,
+  a committed one is never lost, and the request never talks to the broker.
+- The `drain_knowledge_outbox` beat task claims rows in id order and in batches,
+  coalesces repeated entries of a document (the latest action wins) and queues
+  its sync or removal.
+  Rows whose dispatch fails stay in the outbox and are retried on the next run,
+  so a backlog built up during a broker outage drains once it is back.
+- Repeated syncs of the same document within KNOWLEDGE_SYNC_DEBOUNCE_SECONDS
+  are coalesced across drains through a cache key: the first request queues
+  the task with that countdown, later ones are absorbed, and the task reads the
+  latest committed state when it runs.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Tuple
+
+from decouple import config
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+KNOWLEDGE_SYNC_DEBOUNCE_SECONDS = config("KNOWLEDGE_SYNC_DEBOUNCE_SECONDS", default=2, cast=int)
+# Outbox rows claimed per drain batch
+KNOWLEDGE_OUTBOX_BATCH_SIZE = config("KNOWLEDGE_OUTBOX_BATCH_SIZE", default=500, cast=int)
+# Failed dispatches after which a row is left in the outbox for inspection
+KNOWLEDGE_OUTBOX_MAX_ATTEMPTS = config("KNOWLEDGE_OUTBOX_MAX_ATTEMPTS", default=10, cast=int)
+
+DEBOUNCE_KEY = "restaurants:sync_debounce:{doc_type}:{uid}"
+
+# Document type -> model holding the record
+DOC_MODELS = {
+    'restaurant': 'restaurants.Restaurant',
+    'menu': 'restaurants.Menu',
+    'ingredient': 'restaurants.Ingredients',
+}
+
+# Pseudo document type for all documents of a restaurant (uid: the restaurant UID),
+# recorded by bulk writes that send no signals; synced with one bulk sync
+KNOWLEDGE_BASE = 'knowledge_base'
+
+SYNC = 'sync'
+REMOVE = 'remove'
+
+
+def mark_dirty(doc_type: str, uid, action: str = SYNC, restaurant_uid: str = ''):
+    """
+    Record a knowledge sync (or removal) of a document in the outbox, as part of the current transaction.
+
+    Args:
+        doc_type: Document type (restaurant, menu, ingredient, or KNOWLEDGE_BASE for a whole restaurant)
+        uid: Record UID
+        action: SYNC or REMOVE
+        restaurant_uid: Owning restaurant UID (needed for removals)
+    """
+    from restaurants.models import KnowledgeOutbox
+
+    KnowledgeOutbox.objects.create(
+        doc_type=doc_type, doc_uid=str(uid), action=action, restaurant_uid=str(restaurant_uid)
+    )
+
+
+_local = threading.local()
+
+
+@contextmanager
+def menu_links_marked_once(menu):
+    """
+    Change a menu's ingredient links without an outbox entry per connector signal;
+    the menu is marked dirty once when the block completes.
+    """
+    linking = _local.__dict__.setdefault('menu_ids', set())
+    linking.add(menu.pk)
+    try:
+        yield
+    finally:
+        linking.discard(menu.pk)
+    mark_dirty('menu', menu.uid)
+
+
+def menu_links_marked(menu_id) -> bool:
+    """
+    Whether connector changes of a menu are marked by an enclosing `menu_links_marked_once`.
+    """
+    return menu_id in getattr(_local, 'menu_ids', ())
+
+
+def mark_dirty_many(doc_type: str, uids: Iterable, action: str = SYNC, restaurant_uid: str = ''):
+    """
+    Record knowledge syncs (or removals) of many documents with one outbox insert.
+    For records written with bulk_create/bulk_update, which send no signals.
+
+    Args:
+        doc_type: Document type (restaurant, menu, ingredient)
+        uids: Record UIDs
+        action: SYNC or REMOVE
+        restaurant_uid: Owning restaurant UID (needed for removals)
+    """
+    from restaurants.models import KnowledgeOutbox
+
+    uids = list(dict.fromkeys(str(uid) for uid in uids))
+    if not uids:
+        return
+    KnowledgeOutbox.objects.bulk_create([
+        KnowledgeOutbox(doc_type=doc_type, doc_uid=uid, action=action, restaurant_uid=str(restaurant_uid))
+        for uid in uids
+    ])
+
+
+def drain_outbox(batch_size: int = KNOWLEDGE_OUTBOX_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Dispatch pending outbox rows in id order, batch_size rows per transaction, until the outbox is empty.
+
+    Rows are claimed with SELECT ... FOR UPDATE SKIP LOCKED (where supported),
+    so concurrent drains never dispatch the same row. Within a batch, rows of
+    the same document collapse into one dispatch of the latest action.
+
+    Returns:
+        Dict with drained rows, dispatched documents and failed rows
+    """
+    from restaurants.models import KnowledgeOutbox
+
+    result = {'drained': 0, 'dispatched': 0, 'failed': 0}
+    while True:
+        with transaction.atomic():
+            rows = list(
+                KnowledgeOutbox.objects.select_for_update(skip_locked=True)
+                .filter(attempts__lt=KNOWLEDGE_OUTBOX_MAX_ATTEMPTS)
+                .order_by('id')[:batch_size]
+            )
+            if not rows:
+                break
+
+            by_key: Dict[Tuple[str, str], List] = {}
+            for row in rows:
+                by_key.setdefault((row.doc_type, row.doc_uid), []).append(row)
+
+            done, failed = [], []
+            # Documents in the order of their latest change
+            for key, entries in sorted(by_key.items(), key=lambda item: item[1][-1].id):
+                latest = entries[-1]
+                try:
+                    if latest.action == REMOVE:
+                        dispatch_removal(latest.doc_type, latest.doc_uid, latest.restaurant_uid)
+                    else:
+                        dispatch_sync(latest.doc_type, latest.doc_uid)
+                except Exception as e:
+                    logger.error(f"Error dispatching {latest} from outbox: {str(e)}", exc_info=True)
+                    for entry in entries:
+                        entry.attempts += 1
+                        entry.last_error = str(e)
+                    failed.extend(entries)
+                    continue
+                done.extend(entry.id for entry in entries)
+                result['dispatched'] += 1
+
+            KnowledgeOutbox.objects.filter(id__in=done).delete()
+            KnowledgeOutbox.objects.bulk_update(failed, ['attempts', 'last_error'])
+            result['drained'] += len(done)
+            result['failed'] += len(failed)
+
+        if len(rows) < batch_size or not done:
+            # Caught up, or the broker is failing: retry on the next run
+            break
+    return result
+
+
+def dispatch_sync(doc_type: str, uid: str):
+    """
+    Queue the sync task of a document unless one is already pending within the debounce window.
+    Raises if the task cannot be queued, leaving the document in the outbox.
+    """
+    from restaurants.tasks import SYNC_TASKS
+
+    task = SYNC_TASKS[doc_type]
+    try:
+        if not cache.add(DEBOUNCE_KEY.format(doc_type=doc_type, uid=uid), 1, timeout=KNOWLEDGE_SYNC_DEBOUNCE_SECONDS):
+            logger.info(f"Knowledge sync for {doc_type} {uid} already pending, coalesced")
+            return
+        countdown = KNOWLEDGE_SYNC_DEBOUNCE_SECONDS
+    except Exception as e:
+        logger.error(f"Error debouncing knowledge sync for {doc_type} {uid}: {str(e)}", exc_info=True)
+        countdown = 0
+
+    try:
+        task.apply_async(args=(uid,), countdown=countdown)
+    except Exception:
+        # Let the next drain retry instead of absorbing it as already pending
+        cache.delete(DEBOUNCE_KEY.format(doc_type=doc_type, uid=uid))
+        raise
+    logger.info(f"Queued knowledge sync for {doc_type} {uid}")
+
+
+def dispatch_removal(doc_type: str, uid: str, restaurant_uid: str):
+    """
+    Queue the removal of a document, unless the record exists again (recreated with the same UID).
+    Raises if the task cannot be queued, leaving the document in the outbox.
+    """
+    from restaurants.tasks import remove_from_knowledge
+
+    if apps.get_model(DOC_MODELS[doc_type]).objects.filter(uid=uid).exists():
+        return
+    remove_from_knowledge.delay(restaurant_uid, doc_type, uid)
+    logger.info(f"Queued knowledge removal for {doc_type} {uid}")
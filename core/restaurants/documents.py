@@ -0,0 +1,107 @@
+"""
+Knowledge base documents rendered from restaurant data.
+Rendering is kept free of queries: callers pass the related rows they already
+loaded, so a single sync or a bulk sync decide how the data is fetched.
+"""
+from typing import Iterable
+
+from chat.knowledge import KnowledgeDocument
+
+
+def render_restaurant_document(restaurant, menus: Iterable) -> KnowledgeDocument:
+    """
+    Render a restaurant with a high-level overview of its menu.
+
+    Args:
+        restaurant: Restaurant instance
+        menus: The restaurant's Menu rows
+    """
+    menu_items_list = [f"- {m.name}: ${m.price}" for m in menus]
+    menu_overview = "\n".join(menu_items_list) if menu_items_list else "No menu items currently available."
+
+    content = f"""
+RESTAURANT: {restaurant.name}
+DESCRIPTION: {restaurant.description}
+WEBSITE: {restaurant.website_url or 'N/A'}
+FACEBOOK: {restaurant.facebook_url or 'N/A'}
+TWITTER: {restaurant.twitter_url or 'N/A'}
+INSTAGRAM: {restaurant.instagram_url or 'N/A'}
+YOUTUBE: {restaurant.youtube_url or 'N/A'}
+
+FULL MENU OVERVIEW:
+{menu_overview}
+"""
+    return KnowledgeDocument(
+        doc_type="restaurant",
+        uid=str(restaurant.uid),
+        content=content,
+        metadata={
+            "restaurant_uid": str(restaurant.uid),
+            "restaurant_name": restaurant.name,
+        },
+    )
+
+
+def render_menu_document(menu, restaurant, ingredients: Iterable) -> KnowledgeDocument:
+    """
+    Render a menu item with its ingredients, with extra keywords for better search.
+
+    Args:
+        menu: Menu instance
+        restaurant: The menu's Restaurant
+        ingredients: Ingredients rows linked to the menu
+    """
+    ingredients = list(ingredients)
+    ingredient_names = [ingredient.name for ingredient in ingredients]
+    ingredient_details = [
+        f"{ingredient.name}: {ingredient.description or 'No description'}"
+        for ingredient in ingredients
+    ]
+
+    content = f"""
+MENU ITEM / FOOD: {menu.name}
+RESTAURANT: {restaurant.name}
+DESCRIPTION: {menu.description or 'No description provided'}
+PRICE: ${menu.price}
+INGREDIENTS: {', '.join(ingredient_names) if ingredient_names else 'No ingredients listed'}
+
+FOOD DETAILS:
+{chr(10).join(ingredient_details) if ingredient_details else 'No ingredient details available'}
+"""
+    return KnowledgeDocument(
+        doc_type="menu",
+        uid=str(menu.uid),
+        content=content,
+        metadata={
+            "restaurant_uid": str(restaurant.uid),
+            "restaurant_name": restaurant.name,
+            "menu_name": menu.name,
+            "price": str(menu.price),
+            "ingredients": ingredient_names,
+        },
+    )
+
+
+def render_ingredient_document(ingredient, restaurant) -> KnowledgeDocument:
+    """
+    Render an ingredient.
+
+    Args:
+        ingredient: Ingredients instance
+        restaurant: The ingredient's Restaurant
+    """
+    content = f"""
+Ingredient: {ingredient.name}
+Restaurant: {restaurant.name}
+Description: {ingredient.description or 'No description provided'}
+"""
+    return KnowledgeDocument(
+        doc_type="ingredient",
+        uid=str(ingredient.uid),
+        content=content,
+        metadata={
+            "restaurant_uid": str(restaurant.uid),
+            "restaurant_name": restaurant.name,
+            "ingredient_name": ingredient.name,
+        },
+    )
@@ -0,0 +1,181 @@
+"""
+Precomputed per-restaurant exclusion index.
+For every allergen and ingredient, keeps a bitset over the restaurant's menus
+(bit i set = menu i contains it), so "items without X" is answered with a few
+bitwise operations instead of joins or LLM reasoning.
+The index is stored in the Django cache and invalidated by `restaurants.signals`.
+"""
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+INDEX_KEY = "restaurants:exclusion_index:{restaurant_id}"
+INDEX_TIMEOUT = 60 * 60 * 24
+
+
+@dataclass
+class ExclusionIndex:
+    """
+    Bitsets over a restaurant's menus for each allergen and ingredient.
+    """
+    restaurant_id: int
+    # Bit position -> (menu id, name, price)
+    menus: List[Tuple[int, str, str]] = field(default_factory=list)
+    allergen_bits: Dict[int, int] = field(default_factory=dict)
+    ingredient_bits: Dict[int, int] = field(default_factory=dict)
+    ingredient_names: Dict[int, str] = field(default_factory=dict)
+
+    @property
+    def all_bits(self) -> int:
+        return (1 << len(self.menus)) - 1
+
+    def mask(self, allergen_ids: Iterable[int] = (), ingredient_ids: Iterable[int] = ()) -> int:
+        """
+        Bitset of menus containing any of the given allergens or ingredients.
+        """
+        bits = 0
+        for allergen_id in allergen_ids:
+            bits |= self.allergen_bits.get(allergen_id, 0)
+        for ingredient_id in ingredient_ids:
+            bits |= self.ingredient_bits.get(ingredient_id, 0)
+        return bits
+
+    def excluding(self, allergen_ids: Iterable[int] = (), ingredient_ids: Iterable[int] = ()) -> List[Tuple[int, str, str]]:
+        """
+        Menus that contain none of the given allergens or ingredients.
+
+        Args:
+            allergen_ids: Allergen IDs to exclude
+            ingredient_ids: Ingredient IDs to exclude
+
+        Returns:
+            (menu id, name, price) rows in menu order
+        """
+        safe = self.all_bits & ~self.mask(allergen_ids, ingredient_ids)
+        return [menu for position, menu in enumerate(self.menus) if safe >> position & 1]
+
+    def excluding_ids(self, allergen_ids: Iterable[int] = (), ingredient_ids: Iterable[int] = ()) -> List[int]:
+        return [menu[0] for menu in self.excluding(allergen_ids, ingredient_ids)]
+
+
+def build_exclusion_index(restaurant_id: int) -> ExclusionIndex:
+    """
+    Build the exclusion index of a restaurant in a constant number of queries.
+
+    Args:
+        restaurant_id: Restaurant primary key
+
+    Returns:
+        ExclusionIndex instance
+    """
+    from restaurants.models import Menu, MenuIngredientsConnector, Ingredients
+
+    index = ExclusionIndex(restaurant_id=restaurant_id)
+    positions = {}
+    for menu_id, name, price in Menu.objects.filter(restaurant_id=restaurant_id).order_by('id').values_list('id', 'name', 'price'):
+        positions[menu_id] = len(index.menus)
+        index.menus.append((menu_id, name, str(price)))
+
+    menu_allergens = Menu.allergens.through.objects.filter(menu__restaurant_id=restaurant_id)
+    for menu_id, allergen_id in menu_allergens.values_list('menu_id', 'allergen_id'):
+        index.allergen_bits[allergen_id] = index.allergen_bits.get(allergen_id, 0) | 1 << positions[menu_id]
+
+    connectors = MenuIngredientsConnector.objects.filter(menu__restaurant_id=restaurant_id)
+    for menu_id, ingredient_id in connectors.values_list('menu_id', 'ingredient_id'):
+        index.ingredient_bits[ingredient_id] = index.ingredient_bits.get(ingredient_id, 0) | 1 << positions[menu_id]
+
+    index.ingredient_names = dict(
+        Ingredients.objects.filter(restaurant_id=restaurant_id).values_list('id', 'name')
+    )
+    return index
+
+
+def get_exclusion_index(restaurant_id: int) -> ExclusionIndex:
+    """
+    Get the cached exclusion index of a restaurant, building it on a miss.
+
+    Args:
+        restaurant_id: Restaurant primary key
+
+    Returns:
+        ExclusionIndex instance
+    """
+    key = INDEX_KEY.format(restaurant_id=restaurant_id)
+    try:
+        index = cache.get(key)
+    except Exception as e:
+        logger.error(f"Error reading exclusion index for restaurant {restaurant_id}: {str(e)}", exc_info=True)
+        return build_exclusion_index(restaurant_id)
+
+    if index is None:
+        index = build_exclusion_index(restaurant_id)
+        try:
+            cache.set(key, index, timeout=INDEX_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Error caching exclusion index for restaurant {restaurant_id}: {str(e)}", exc_info=True)
+    return index
+
+
+def invalidate_exclusion_index(restaurant_id: int):
+    """
+    Drop the cached exclusion index of a restaurant; the next read rebuilds it.
+
+    Args:
+        restaurant_id: Restaurant primary key
+    """
+    try:
+        cache.delete(INDEX_KEY.format(restaurant_id=restaurant_id))
+    except Exception as e:
+        logger.error(f"Error invalidating exclusion index for restaurant {restaurant_id}: {str(e)}", exc_info=True)
+
+
+def _matches(term: str, name: str) -> bool:
+    term, name = term.strip().lower(), name.strip().lower()
+    return bool(term) and (term == name or re.fullmatch(rf"{re.escape(name)}(s|es)?", term) is not None)
+
+
+def resolve_terms(index: ExclusionIndex, terms: Iterable[str]) -> Tuple[List[int], List[int], List[str]]:
+    """
+    Resolve free-text allergen/ingredient names (or IDs) against the index.
+
+    Args:
+        index: Exclusion index of the restaurant
+        terms: Allergen or ingredient names, English or Japanese
+
+    Returns:
+        (allergen IDs, ingredient IDs, unrecognized terms)
+    """
+    from restaurants.models import Allergen
+
+    allergens = list(Allergen.objects.values_list('id', 'name', 'name_ja'))
+    allergen_ids, ingredient_ids, unknown = [], [], []
+    for term in terms:
+        term = term.strip()
+        if not term:
+            continue
+        matched_allergens = [a_id for a_id, name, name_ja in allergens if _matches(term, name) or term == name_ja]
+        matched_ingredients = [i_id for i_id, name in index.ingredient_names.items() if _matches(term, name)]
+        if not matched_allergens and not matched_ingredients:
+            unknown.append(term)
+        allergen_ids.extend(matched_allergens)
+        ingredient_ids.extend(matched_ingredients)
+    return allergen_ids, ingredient_ids, unknown
+
+
+def parse_id_list(raw: Optional[str]) -> Tuple[List[int], List[str]]:
+    """
+    Split a comma-separated query parameter into numeric IDs and names.
+    """
+    ids, names = [], []
+    for part in (raw or '').split(','):
+        part = part.strip()
+        if part.isdigit():
+            ids.append(int(part))
+        elif part:
+            names.append(part)
+    return ids, names
@@ -0,0 +1,308 @@
+"""
+Bulk menu import from CSV or JSON Lines files.
+Used by the `menus/import/` endpoint and the `import_menus` command.
+
+Rows are parsed as the file streams in and handled in chunks of
+MENU_IMPORT_CHUNK_SIZE: each chunk is validated, then its new ingredients,
+menus, ingredient links and allergen links are written with bulk_create in
+one transaction. Memory stays flat whatever the file size; only the
+restaurant's ingredient names and a bounded list of errors are kept.
+
+Bulk inserts send no signals, so nothing is queued per row: each chunk
+records a sync of the restaurant's whole knowledge base in the knowledge
+outbox, in its own transaction, which the outbox drain turns into one bulk
+knowledge sync. Once all chunks are written, the exclusion index and change
+version are reset. Invalid rows (and rows of a chunk whose write failed, or
+that could not be parsed) are reported with their line number and skipped
+without aborting the import.
+
+File format (one menu per row):
+- CSV with a header: name, price, description, ingredients, allergens, where
+  the two list columns are separated by `|` (e.g. `Basil|Chili`).
+- JSON Lines: one object per line with the same keys; lists as JSON arrays.
+"""
+import csv
+import json
+import logging
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from decouple import config
+from django.db import transaction
+
+from restaurants.dispatch import KNOWLEDGE_BASE, mark_dirty
+
+logger = logging.getLogger(__name__)
+
+# Rows validated and written per transaction
+MENU_IMPORT_CHUNK_SIZE = config("MENU_IMPORT_CHUNK_SIZE", default=500, cast=int)
+# Row errors kept in the report; further errors are only counted
+MENU_IMPORT_MAX_ERRORS = config("MENU_IMPORT_MAX_ERRORS", default=1000, cast=int)
+
+CSV = 'csv'
+JSONL = 'jsonl'
+FORMATS = {'.csv': CSV, '.jsonl': JSONL, '.ndjson': JSONL}
+LIST_SEPARATOR = '|'
+LIST_COLUMNS = ('ingredients', 'allergens')
+
+
+@dataclass
+class ImportResult:
+    """
+    Outcome of a bulk menu import.
+    """
+    created: int = 0
+    failed: int = 0
+    # {'line': line number, 'errors': field -> messages}, at most MENU_IMPORT_MAX_ERRORS
+    errors: List[dict] = field(default_factory=list)
+    # Whether a knowledge sync was recorded in the outbox
+    sync_queued: bool = False
+
+    def add_error(self, line: int, errors):
+        self.failed += 1
+        if len(self.errors) < MENU_IMPORT_MAX_ERRORS:
+            self.errors.append({'line': line, 'errors': errors})
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def detect_format(filename: str) -> str:
+    """
+    Import format of a file from its extension.
+
+    Raises:
+        ValueError: For an unsupported extension
+    """
+    for extension, file_format in FORMATS.items():
+        if filename.lower().endswith(extension):
+            return file_format
+    raise ValueError(f"Unsupported file type {filename!r}; expected one of {', '.join(FORMATS)}")
+
+
+def _split(value) -> List[str]:
+    if not value:
+        return []
+    return [item.strip() for item in value.split(LIST_SEPARATOR) if item.strip()]
+
+
+def _decode_error(e: UnicodeDecodeError) -> str:
+    return f"File is not valid UTF-8 text ({e.reason}); the rest of the file was not read"
+
+
+def iter_rows(stream: TextIO, file_format: str) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """
+    Parse a text stream lazily.
+    A malformed CSV row is reported and parsing goes on with the next line; text
+    that cannot be decoded is reported and ends parsing, as the stream cannot resume.
+
+    Yields:
+        (line number, row dict or None, parse error or None)
+    """
+    if file_format == CSV:
+        # Strict, so a broken quote is an error instead of swallowing the following lines
+        reader = csv.DictReader(stream, strict=True)
+        while True:
+            line_number = reader.line_num + 1
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                yield line_number, None, f"Invalid CSV: {str(e)}"
+                continue
+            except UnicodeDecodeError as e:
+                yield line_number, None, _decode_error(e)
+                return
+            row = {key.strip(): value for key, value in row.items() if key}
+            for column in LIST_COLUMNS:
+                row[column] = _split(row.get(column))
+            yield reader.line_num, row, None
+    elif file_format == JSONL:
+        lines = iter(stream)
+        line_number = 0
+        while True:
+            line_number += 1
+            try:
+                line = next(lines)
+            except StopIteration:
+                return
+            except UnicodeDecodeError as e:
+                yield line_number, None, _decode_error(e)
+                return
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, None, f"Invalid JSON: {str(e)}"
+                continue
+            if not isinstance(row, dict):
+                yield line_number, None, "Expected a JSON object"
+                continue
+            yield line_number, row, None
+    else:
+        raise ValueError(f"Unsupported format {file_format!r}")
+
+
+def _chunks(rows: Iterable, size: int) -> Iterator[list]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class MenuImporter:
+    """
+    Import menus into one restaurant, chunk by chunk.
+    """
+
+    def __init__(self, restaurant, chunk_size: int = MENU_IMPORT_CHUNK_SIZE):
+        from restaurants.models import Allergen
+
+        self.restaurant = restaurant
+        self.chunk_size = chunk_size
+        self.result = ImportResult()
+        # Ingredient name -> id, filled as names are met
+        self.ingredient_ids: Dict[str, int] = {}
+        # Allergen id / English name (lowercase) / Japanese name -> id; the table is small and fixed
+        self.allergen_ids: Dict[str, int] = {}
+        for allergen in Allergen.objects.only('id', 'name', 'name_ja'):
+            self.allergen_ids[str(allergen.id)] = allergen.id
+            self.allergen_ids[allergen.name.lower()] = allergen.id
+            self.allergen_ids[allergen.name_ja] = allergen.id
+
+    def run(self, rows: Iterable[Tuple[int, Optional[dict], Optional[str]]], sync: bool = True) -> ImportResult:
+        """
+        Import parsed rows (see `iter_rows`); with sync, every written chunk records a knowledge sync.
+        """
+        for chunk in _chunks(rows, self.chunk_size):
+            self.import_chunk(chunk, sync)
+
+        if self.result.created:
+            from restaurants.change_version import bump_change_version
+            from restaurants.exclusion_index import invalidate_exclusion_index
+
+            invalidate_exclusion_index(self.restaurant.id)
+            bump_change_version(self.restaurant.id)
+            self.result.sync_queued = sync
+        logger.info(
+            f"Imported menus into {self.restaurant.name}: created={self.result.created} failed={self.result.failed}"
+        )
+        return self.result
+
+    def validate(self, line: int, row: dict) -> Optional[dict]:
+        from restaurants.serializers import MenuImportRowSerializer
+
+        serializer = MenuImportRowSerializer(data=row)
+        if not serializer.is_valid():
+            self.result.add_error(line, dict(serializer.errors))
+            return None
+        data = serializer.validated_data
+
+        allergen_ids, unknown = [], []
+        for term in data.get('allergens', []):
+            allergen_id = self.allergen_ids.get(term.strip().lower()) or self.allergen_ids.get(term.strip())
+            if allergen_id is None:
+                unknown.append(term)
+            else:
+                allergen_ids.append(allergen_id)
+        if unknown:
+            self.result.add_error(line, {'allergens': [f"Unknown allergen: {term}" for term in unknown]})
+            return None
+        data['allergen_ids'] = list(dict.fromkeys(allergen_ids))
+        data['ingredients'] = list(dict.fromkeys(data.get('ingredients', [])))
+        return data
+
+    def import_chunk(self, chunk: List[Tuple[int, Optional[dict], Optional[str]]], sync: bool = True):
+        """
+        Validate a chunk and write its valid rows, and with sync its outbox entry, in one transaction.
+        """
+        valid = []
+        for line, row, error in chunk:
+            if error:
+                self.result.add_error(line, {'non_field_errors': [error]})
+                continue
+            data = self.validate(line, row)
+            if data is not None:
+                valid.append((line, data))
+        if not valid:
+            return
+
+        try:
+            with transaction.atomic():
+                new_ingredients = self.write(valid)
+                if sync:
+                    # Entries of all chunks collapse into one bulk sync when the outbox is drained
+                    mark_dirty(KNOWLEDGE_BASE, self.restaurant.uid)
+        except Exception as e:
+            logger.error(f"Error importing menus into {self.restaurant.name}: {str(e)}", exc_info=True)
+            for line, _ in valid:
+                self.result.add_error(line, {'non_field_errors': [f"Not saved: {str(e)}"]})
+            return
+
+        # Only committed ingredients may be linked by later chunks
+        self.ingredient_ids.update(new_ingredients)
+        self.result.created += len(valid)
+
+    def write(self, valid: List[Tuple[int, dict]]) -> Dict[str, int]:
+        """
+        Bulk insert a chunk's new ingredients, menus and links.
+
+        Returns:
+            Ingredient name -> id of the ingredients created
+        """
+        from restaurants.models import Ingredients, Menu, MenuIngredientsConnector
+
+        restaurant = self.restaurant
+        names = {name for _, data in valid for name in data['ingredients']}
+        unknown = names - self.ingredient_ids.keys()
+        if unknown:
+            # Already committed, so safe to remember even if this chunk rolls back
+            for ingredient_id, name in (
+                Ingredients.objects.filter(restaurant=restaurant, name__in=unknown)
+                .order_by('-id').values_list('id', 'name')
+            ):
+                # Oldest wins for duplicate names, as with get_or_create
+                self.ingredient_ids[name] = ingredient_id
+
+        missing = [Ingredients(restaurant=restaurant, name=name) for name in sorted(names - self.ingredient_ids.keys())]
+        Ingredients.objects.bulk_create(missing)
+        created = {ingredient.name: ingredient.id for ingredient in missing}
+        known = {**{name: self.ingredient_ids[name] for name in names if name in self.ingredient_ids}, **created}
+
+        menus = Menu.objects.bulk_create([
+            Menu(restaurant=restaurant, name=data['name'], price=data['price'], description=data.get('description'))
+            for _, data in valid
+        ])
+        MenuIngredientsConnector.objects.bulk_create([
+            MenuIngredientsConnector(restaurant=restaurant, menu=menu, ingredient_id=known[name])
+            for menu, (_, data) in zip(menus, valid) for name in data['ingredients']
+        ])
+        Menu.allergens.through.objects.bulk_create([
+            Menu.allergens.through(menu=menu, allergen_id=allergen_id)
+            for menu, (_, data) in zip(menus, valid) for allergen_id in data['allergen_ids']
+        ])
+        return created
+
+
+def import_menus(restaurant, stream: TextIO, file_format: str, chunk_size: int = MENU_IMPORT_CHUNK_SIZE,
+                 sync: bool = True) -> ImportResult:
+    """
+    Import menus from a CSV or JSON Lines text stream into a restaurant.
+
+    Args:
+        restaurant: Restaurant instance
+        stream: Text stream of the file
+        file_format: CSV or JSONL
+        chunk_size: Rows validated and written per transaction
+        sync: Record a bulk knowledge sync in the outbox with every chunk
+
+    Returns:
+        ImportResult with created and failed counts and per-row errors
+    """
+    return MenuImporter(restaurant, chunk_size).run(iter_rows(stream, file_format), sync=sync)
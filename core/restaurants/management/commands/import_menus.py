@@ -0,0 +1,62 @@
+"""
+Django management command to bulk import menus from a CSV or JSON Lines file.
+Usage:
+    python manage.py import_menus <restaurant_uid> menus.csv
+    python manage.py import_menus <restaurant_uid> menus.jsonl --chunk-size 1000
+    python manage.py import_menus <restaurant_uid> menus.txt --format jsonl --no-sync
+"""
+from django.core.management.base import BaseCommand, CommandError
+from restaurants.models import Restaurant
+from restaurants.importer import CSV, JSONL, MENU_IMPORT_CHUNK_SIZE, detect_format, import_menus
+
+
+class Command(BaseCommand):
+    help = 'Bulk import menus with ingredients and allergens from a CSV or JSON Lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('restaurant', type=str, help='Restaurant UID to import into')
+        parser.add_argument('path', type=str, help='Path of the .csv or .jsonl file')
+        parser.add_argument(
+            '--format',
+            choices=[CSV, JSONL],
+            help='File format (defaults to the file extension)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=MENU_IMPORT_CHUNK_SIZE,
+            help='Rows validated and written per transaction',
+        )
+        parser.add_argument(
+            '--no-sync',
+            action='store_true',
+            help='Do not record a knowledge sync of the restaurant for the import',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            restaurant = Restaurant.objects.get(uid=options['restaurant'])
+        except (Restaurant.DoesNotExist, ValueError):
+            raise CommandError(f"Restaurant with UID {options['restaurant']} not found")
+
+        try:
+            file_format = options.get('format') or detect_format(options['path'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f'Importing menus into {restaurant.name}...')
+        with open(options['path'], encoding='utf-8-sig', newline='') as stream:
+            result = import_menus(
+                restaurant, stream, file_format, chunk_size=options['chunk_size'], sync=not options['no_sync']
+            )
+
+        for error in result.errors:
+            self.stdout.write(self.style.WARNING(f"  line {error['line']}: {error['errors']}"))
+        if result.failed > len(result.errors):
+            self.stdout.write(self.style.WARNING(f'  ... and {result.failed - len(result.errors)} more'))
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Imported {result.created} menu(s), {result.failed} row(s) failed')
+        )
+        if result.sync_queued:
+            self.stdout.write('Note: Knowledge sync is queued via Celery by the next outbox drain')
@@ -3,10 +3,12 @@ Django management command to sync restaurant data to knowledge base.
 Usage:
     python manage.py sync_knowledge_base                    # Sync all restaurants
     python manage.py sync_knowledge_base --restaurant <uid>  # Sync specific restaurant
+    python manage.py sync_knowledge_base --batch-size 128    # Documents per embedding batch
+    python manage.py sync_knowledge_base --rebuild           # Blue/green rebuild into new collections
 """
 from django.core.management.base import BaseCommand
 from restaurants.models import Restaurant
-from restaurants.tasks import bulk_sync_restaurant_knowledge
+from restaurants.tasks import bulk_sync_restaurant_knowledge, rebuild_restaurant_knowledge
 
 
 class Command(BaseCommand):
@@ -18,16 +20,28 @@ class Command(BaseCommand):
             type=str,
             help='Restaurant UID to sync (if not provided, syncs all restaurants)',
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='Documents embedded and written per batch (defaults to KNOWLEDGE_EMBED_BATCH_SIZE)',
+        )
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Build a new versioned collection and switch to it once validated, instead of syncing in place',
+        )
 
     def handle(self, *args, **options):
         restaurant_uid = options.get('restaurant')
+        batch_size = options.get('batch_size')
+        task = rebuild_restaurant_knowledge if options.get('rebuild') else bulk_sync_restaurant_knowledge
 
         if restaurant_uid:
             # Sync specific restaurant
             try:
                 restaurant = Restaurant.objects.get(uid=restaurant_uid)
                 self.stdout.write(f'Syncing restaurant: {restaurant.name}...')
-                bulk_sync_restaurant_knowledge.delay(str(restaurant.uid))
+                task.delay(str(restaurant.uid), batch_size)
                 self.stdout.write(
                     self.style.SUCCESS(f'Successfully queued sync for {restaurant.name}')
                 )
@@ -47,7 +61,7 @@ class Command(BaseCommand):
             self.stdout.write(f'Syncing {count} restaurant(s)...')
 
             for restaurant in restaurants:
-                bulk_sync_restaurant_knowledge.delay(str(restaurant.uid))
+                task.delay(str(restaurant.uid), batch_size)
                 self.stdout.write(f'  - Queued: {restaurant.name}')
 
             self.stdout.write(
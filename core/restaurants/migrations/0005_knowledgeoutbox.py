@@ -0,0 +1,29 @@
+# Generated by Django 6.1.2 on 2026-10-16 20:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0004_remove_ingredients_allergens'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KnowledgeOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('doc_type', models.CharField(max_length=20)),
+                ('doc_uid', models.CharField(max_length=64)),
+                ('action', models.CharField(choices=[('sync', 'Sync'), ('remove', 'Remove')], default='sync', max_length=10)),
+                ('restaurant_uid', models.CharField(blank=True, default='', max_length=64)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 6.1.2 on 2026-10-16 21:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0005_knowledgeoutbox'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ingredients',
+            index=models.Index(fields=['created_at', 'id'], name='ingredient_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ingredients',
+            index=models.Index(fields=['restaurant', 'created_at', 'id'], name='ingredient_rest_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='menu',
+            index=models.Index(fields=['created_at', 'id'], name='menu_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='menu',
+            index=models.Index(fields=['restaurant', 'created_at', 'id'], name='menu_rest_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='restaurant',
+            index=models.Index(fields=['created_at', 'id'], name='restaurant_created_id_idx'),
+        ),
+    ]
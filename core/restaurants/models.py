@@ -13,6 +13,12 @@ class Restaurant(BaseModel):
     instagram_url = models.URLField(blank=True, null=True)
     youtube_url = models.URLField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination (commons.pagination.KeysetPagination)
+            models.Index(fields=['created_at', 'id'], name='restaurant_created_id_idx'),
+        ]
+
     def __str__(self):
         return f"{self.name} - {self.owner}"
 
@@ -38,6 +44,13 @@ class Menu(BaseModel):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     allergens = models.ManyToManyField(Allergen, blank=True, related_name='menus')
 
+    class Meta:
+        indexes = [
+            # Keyset pagination, over all menus and per restaurant
+            models.Index(fields=['created_at', 'id'], name='menu_created_id_idx'),
+            models.Index(fields=['restaurant', 'created_at', 'id'], name='menu_rest_created_id_idx'),
+        ]
+
     def __str__(self):
         return f"{self.name} - {self.restaurant}"
 
@@ -48,6 +61,13 @@ class Ingredients(BaseModel):
     description = models.TextField(blank=True, null=True)
     image = models.ImageField(upload_to='restaurant/ingredients/', blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination, over all ingredients and per restaurant
+            models.Index(fields=['created_at', 'id'], name='ingredient_created_id_idx'),
+            models.Index(fields=['restaurant', 'created_at', 'id'], name='ingredient_rest_created_id_idx'),
+        ]
+
     def __str__(self):
         return f"{self.name} - {self.restaurant}"
 
@@ -61,3 +81,27 @@ class MenuIngredientsConnector(BaseModel):
         return f"{self.menu} - {self.ingredient}"
 
 
+
+
+class KnowledgeOutbox(models.Model):
+    """
+    Pending knowledge base change, written in the same transaction as the data change.
+    Drained in id order by the `drain_knowledge_outbox` beat task.
+    """
+    ACTIONS = (
+        ('sync', 'Sync'),
+        ('remove', 'Remove'),
+    )
+    doc_type = models.CharField(max_length=20)
+    doc_uid = models.CharField(max_length=64)
+    action = models.CharField(max_length=10, choices=ACTIONS, default='sync')
+    restaurant_uid = models.CharField(max_length=64, blank=True, default='')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('id',)
+
+    def __str__(self):
+        return f"{self.action} {self.doc_type} {self.doc_uid}"
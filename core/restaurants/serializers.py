@@ -1,8 +1,11 @@
 from rest_framework import serializers
 from django.db import transaction
+from django.db.models import Prefetch, Q
+from drf_yasg.utils import swagger_serializer_method
 
 from accounts.models import User
 from accounts.choices import UserRole
+from restaurants.dispatch import mark_dirty_many, menu_links_marked_once
 from restaurants.models import Restaurant, Menu, Ingredients, MenuIngredientsConnector, Allergen
 
 
@@ -83,7 +86,7 @@ class MenuSerializer(serializers.ModelSerializer):
         child=serializers.IntegerField(), required=False, write_only=True
     )
 
-    ingredients = IngredientSerializer(many=True, read_only=True, source='menuingredientsconnector_set.ingredient')
+    ingredients = serializers.SerializerMethodField()
     allergens = AllergenSerializer(many=True, read_only=True)
 
     class Meta:
@@ -92,6 +95,83 @@ class MenuSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at', 'restaurant', 'ingredients', 'allergens']
         write_only_fields = ['ingredient_ids', 'ingredient_names', 'allergen_ids']
 
+    @staticmethod
+    def prefetch(queryset):
+        """
+        Load everything the serializer reads for a queryset of menus in a constant number of queries:
+        menus -> connectors -> ingredients (in connector order) and menus -> allergens.
+        """
+        return queryset.prefetch_related(
+            Prefetch(
+                'menuingredientsconnector_set',
+                queryset=MenuIngredientsConnector.objects.select_related('ingredient').order_by('id'),
+            ),
+            'allergens',
+        )
+
+    @swagger_serializer_method(serializer_or_field=IngredientSerializer(many=True))
+    def get_ingredients(self, menu):
+        connectors = menu.menuingredientsconnector_set.all()
+        if 'menuingredientsconnector_set' not in getattr(menu, '_prefetched_objects_cache', {}):
+            # Single menus (create/update responses) are not prefetched
+            connectors = connectors.select_related('ingredient').order_by('id')
+        ingredients = [connector.ingredient for connector in connectors]
+        return IngredientSerializer(ingredients, many=True, context=self.context).data
+
+    @staticmethod
+    def resolve_ingredients(restaurant, ingredient_ids, ingredient_names):
+        """
+        Ingredients of a restaurant for the given names and IDs, in that order and without duplicates.
+        Existing ones are read with one query; missing names are created with one bulk insert.
+        Unknown IDs are skipped.
+        """
+        ingredient_ids = list(dict.fromkeys(ingredient_ids))
+        ingredient_names = list(dict.fromkeys(ingredient_names))
+        if not ingredient_ids and not ingredient_names:
+            return []
+
+        by_id, by_name = {}, {}
+        for ingredient in Ingredients.objects.filter(
+            Q(id__in=ingredient_ids) | Q(name__in=ingredient_names), restaurant=restaurant
+        ).order_by('id'):
+            by_id[ingredient.id] = ingredient
+            by_name.setdefault(ingredient.name, ingredient)
+
+        missing = [Ingredients(name=name, restaurant=restaurant) for name in ingredient_names if name not in by_name]
+        if missing:
+            # bulk_create sends no post_save: queue their knowledge syncs explicitly
+            Ingredients.objects.bulk_create(missing)
+            by_name.update((ingredient.name, ingredient) for ingredient in missing)
+            mark_dirty_many('ingredient', [ingredient.uid for ingredient in missing])
+
+        ingredients = [by_name[name] for name in ingredient_names]
+        ingredients += [by_id[ingredient_id] for ingredient_id in ingredient_ids if ingredient_id in by_id]
+        return list({ingredient.id: ingredient for ingredient in ingredients}.values())
+
+    @staticmethod
+    def link_ingredients(menu, ingredients):
+        """
+        Make the menu's connectors match the ingredients: delete the extra ones, bulk insert the new ones.
+
+        Inserted connectors send no signals, and deleted ones add no outbox entry each: the
+        menu's knowledge re-sync is recorded once, so the cost does not grow with the number
+        of links. The caller saves the menu in the same transaction, which drops the
+        restaurant's exclusion index.
+        """
+        wanted = {ingredient.id: ingredient for ingredient in ingredients}
+        current = set(MenuIngredientsConnector.objects.filter(menu=menu).values_list('ingredient_id', flat=True))
+
+        with menu_links_marked_once(menu):
+            removed = current - wanted.keys()
+            if removed:
+                MenuIngredientsConnector.objects.filter(menu=menu, ingredient_id__in=removed).delete()
+            MenuIngredientsConnector.objects.bulk_create([
+                MenuIngredientsConnector(menu=menu, ingredient=ingredient, restaurant=menu.restaurant)
+                for ingredient_id, ingredient in wanted.items() if ingredient_id not in current
+            ])
+
+    # Atomic so the menu, its allergens and connectors commit together and trigger a single knowledge sync
+    @transaction.atomic
     def create(self, validated_data):
         ingredient_ids = validated_data.pop('ingredient_ids', [])
         ingredient_names = validated_data.pop('ingredient_names', [])
@@ -105,23 +185,13 @@ class MenuSerializer(serializers.ModelSerializer):
         if allergen_ids:
             menu.allergens.set(allergen_ids)
 
-        if ingredient_names:
-            for ingredient_name in ingredient_names:
-                ingredient, _ = Ingredients.objects.get_or_create(name=ingredient_name, restaurant=menu.restaurant)
-                MenuIngredientsConnector.objects.create(menu=menu, ingredient=ingredient, restaurant=menu.restaurant)
-
-        if ingredient_ids:
-            for ingredient_id in ingredient_ids:
-                try:
-                    ingredient = Ingredients.objects.get(id=ingredient_id, restaurant=menu.restaurant)
-                    MenuIngredientsConnector.objects.create(menu=menu, ingredient=ingredient,
-                                                            restaurant=menu.restaurant)
-                except Ingredients.DoesNotExist:
-                    pass
+        self.link_ingredients(menu, self.resolve_ingredients(menu.restaurant, ingredient_ids, ingredient_names))
         return menu
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredient_ids = validated_data.pop('ingredient_ids', None)
+        ingredient_names = validated_data.pop('ingredient_names', None)
         allergen_ids = validated_data.pop('allergen_ids', None)
 
         menu = super().update(instance, validated_data)
@@ -129,12 +199,22 @@ class MenuSerializer(serializers.ModelSerializer):
         if allergen_ids is not None:
             menu.allergens.set(allergen_ids)
 
-        if ingredient_ids is not None:
-            MenuIngredientsConnector.objects.filter(menu=menu).delete()
-            for ingredient_id in ingredient_ids:
-                try:
-                    ingredient = Ingredients.objects.get(id=ingredient_id, restaurant=menu.restaurant)
-                    MenuIngredientsConnector.objects.create(menu=menu, ingredient=ingredient, restaurant=menu.restaurant)
-                except Ingredients.DoesNotExist:
-                    pass
+        if ingredient_ids is not None or ingredient_names is not None:
+            ingredients = self.resolve_ingredients(menu.restaurant, ingredient_ids or [], ingredient_names or [])
+            self.link_ingredients(menu, ingredients)
         return menu
+
+
+class MenuImportRowSerializer(serializers.Serializer):
+    """
+    One row of a bulk menu import (see `restaurants.importer`).
+    """
+    name = serializers.CharField(max_length=255)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    description = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    ingredients = serializers.ListField(
+        child=serializers.CharField(max_length=255), required=False, help_text='Ingredient names.'
+    )
+    allergens = serializers.ListField(
+        child=serializers.CharField(), required=False, help_text='Allergen IDs or names (English or Japanese).'
+    )
@@ -1,19 +1,16 @@
 """
 Django signals for automatic knowledge base synchronization.
-Triggers Celery tasks when restaurant data is created, updated, or deleted.
+Marks changed restaurant data dirty; `restaurants.dispatch` records it in the
+knowledge outbox within the same transaction, and a beat job queues the syncs.
+Outbox errors are not caught: a change that cannot be recorded rolls back with it.
 """
-from django.db.models.signals import post_save, post_delete
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
-from restaurants.models import Restaurant, Menu, Ingredients, MenuIngredientsConnector
-from restaurants.tasks import (
-    sync_restaurant_to_knowledge,
-    sync_menu_to_knowledge,
-    sync_ingredient_to_knowledge,
-    remove_from_knowledge,
-)
-import logging
-
-logger = logging.getLogger(__name__)
+from restaurants.models import Restaurant, Allergen, Menu, Ingredients, MenuIngredientsConnector
+from restaurants.change_version import bump_allergen_version, bump_change_version
+from restaurants.dispatch import mark_dirty, menu_links_marked, REMOVE
+from restaurants.exclusion_index import invalidate_exclusion_index
 
 
 @receiver(post_save, sender=Restaurant)
@@ -21,11 +18,7 @@ def restaurant_saved(sender, instance, created, **kwargs):
     """
     Sync restaurant to knowledge base when created or updated.
     """
-    try:
-        sync_restaurant_to_knowledge.delay(str(instance.uid))
-        logger.info(f"Queued knowledge sync for restaurant: {instance.name}")
-    except Exception as e:
-        logger.error(f"Error queuing restaurant sync: {str(e)}", exc_info=True)
+    mark_dirty("restaurant", instance.uid)
 
 
 @receiver(post_delete, sender=Restaurant)
@@ -33,11 +26,7 @@ def restaurant_deleted(sender, instance, **kwargs):
     """
     Remove restaurant from knowledge base when deleted.
     """
-    try:
-        remove_from_knowledge.delay(str(instance.uid), "restaurant", str(instance.uid))
-        logger.info(f"Queued knowledge removal for restaurant: {instance.name}")
-    except Exception as e:
-        logger.error(f"Error queuing restaurant removal: {str(e)}", exc_info=True)
+    mark_dirty("restaurant", instance.uid, REMOVE, restaurant_uid=instance.uid)
 
 
 @receiver(post_save, sender=Menu)
@@ -45,11 +34,7 @@ def menu_saved(sender, instance, created, **kwargs):
     """
     Sync menu item to knowledge base when created or updated.
     """
-    try:
-        sync_menu_to_knowledge.delay(str(instance.uid))
-        logger.info(f"Queued knowledge sync for menu: {instance.name}")
-    except Exception as e:
-        logger.error(f"Error queuing menu sync: {str(e)}", exc_info=True)
+    mark_dirty("menu", instance.uid)
 
 
 @receiver(post_delete, sender=Menu)
@@ -57,15 +42,7 @@ def menu_deleted(sender, instance, **kwargs):
     """
     Remove menu item from knowledge base when deleted.
     """
-    try:
-        remove_from_knowledge.delay(
-            str(instance.restaurant.uid),
-            "menu",
-            str(instance.uid)
-        )
-        logger.info(f"Queued knowledge removal for menu: {instance.name}")
-    except Exception as e:
-        logger.error(f"Error queuing menu removal: {str(e)}", exc_info=True)
+    mark_dirty("menu", instance.uid, REMOVE, restaurant_uid=instance.restaurant.uid)
 
 
 @receiver(post_save, sender=Ingredients)
@@ -73,11 +50,7 @@ def ingredient_saved(sender, instance, created, **kwargs):
     """
     Sync ingredient to knowledge base when created or updated.
     """
-    try:
-        sync_ingredient_to_knowledge.delay(str(instance.uid))
-        logger.info(f"Queued knowledge sync for ingredient: {instance.name}")
-    except Exception as e:
-        logger.error(f"Error queuing ingredient sync: {str(e)}", exc_info=True)
+    mark_dirty("ingredient", instance.uid)
 
 
 @receiver(post_delete, sender=Ingredients)
@@ -85,36 +58,81 @@ def ingredient_deleted(sender, instance, **kwargs):
     """
     Remove ingredient from knowledge base when deleted.
     """
-    try:
-        remove_from_knowledge.delay(
-            str(instance.restaurant.uid),
-            "ingredient",
-            str(instance.uid)
-        )
-        logger.info(f"Queued knowledge removal for ingredient: {instance.name}")
-    except Exception as e:
-        logger.error(f"Error queuing ingredient removal: {str(e)}", exc_info=True)
+    mark_dirty("ingredient", instance.uid, REMOVE, restaurant_uid=instance.restaurant.uid)
 
 
 @receiver(post_save, sender=MenuIngredientsConnector)
-def menu_ingredient_connector_saved(sender, instance, created, **kwargs):
+@receiver(post_delete, sender=MenuIngredientsConnector)
+def menu_ingredient_connector_changed(sender, instance, **kwargs):
     """
-    Re-sync menu when menu-ingredient relationship changes.
+    Re-sync menu when a menu-ingredient relationship is added, changed or removed.
+    Connectors created in a loop for one menu coalesce into a single sync when the outbox is drained;
+    bulk link changes of the menu serializer mark the menu once instead.
     """
-    try:
-        sync_menu_to_knowledge.delay(str(instance.menu.uid))
-        logger.info(f"Queued menu re-sync due to ingredient change: {instance.menu.name}")
-    except Exception as e:
-        logger.error(f"Error queuing menu re-sync: {str(e)}", exc_info=True)
+    if menu_links_marked(instance.menu_id):
+        return
+    mark_dirty("menu", instance.menu.uid)
 
 
-@receiver(post_delete, sender=MenuIngredientsConnector)
-def menu_ingredient_connector_deleted(sender, instance, **kwargs):
+def invalidate_exclusion_index_on_commit(restaurant_id):
+    """
+    Drop the restaurant's exclusion index once the current transaction commits,
+    so a concurrent read never rebuilds it from uncommitted data.
+    """
+    transaction.on_commit(lambda: invalidate_exclusion_index(restaurant_id))
+
+
+@receiver([post_save, post_delete], sender=Menu)
+@receiver([post_save, post_delete], sender=Ingredients)
+@receiver([post_save, post_delete], sender=MenuIngredientsConnector)
+def exclusion_index_source_changed(sender, instance, **kwargs):
+    """
+    Keep the exclusion index in sync with menus, ingredients and their links.
+    """
+    invalidate_exclusion_index_on_commit(instance.restaurant_id)
+
+
+def bump_change_version_on_commit(restaurant_id):
+    """
+    Give the restaurant a new change version once the current transaction commits,
+    so conditional GETs never validate a response built from uncommitted data.
     """
-    Re-sync menu when menu-ingredient relationship is removed.
+    transaction.on_commit(lambda: bump_change_version(restaurant_id))
+
+
+@receiver([post_save, post_delete], sender=Restaurant)
+@receiver([post_save, post_delete], sender=Menu)
+@receiver([post_save, post_delete], sender=Ingredients)
+@receiver([post_save, post_delete], sender=MenuIngredientsConnector)
+def restaurant_data_changed(sender, instance, **kwargs):
+    """
+    Invalidate ETags of responses built from the restaurant's data.
+    """
+    bump_change_version_on_commit(instance.pk if sender is Restaurant else instance.restaurant_id)
+
+
+@receiver([post_save, post_delete], sender=Allergen)
+def allergen_changed(sender, instance, **kwargs):
     """
-    try:
-        sync_menu_to_knowledge.delay(str(instance.menu.uid))
-        logger.info(f"Queued menu re-sync due to ingredient removal: {instance.menu.name}")
-    except Exception as e:
-        logger.error(f"Error queuing menu re-sync: {str(e)}", exc_info=True)
+    Invalidate ETags of menu responses, which embed allergens.
+    """
+    transaction.on_commit(bump_allergen_version)
+
+
+@receiver(m2m_changed, sender=Menu.allergens.through)
+def menu_allergens_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keep the exclusion index and change versions in sync with menu allergens.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear', 'pre_clear'):
+        return
+    if not reverse:
+        invalidate_exclusion_index_on_commit(instance.restaurant_id)
+        bump_change_version_on_commit(instance.restaurant_id)
+        return
+
+    # Changed from the Allergen side: every restaurant of the affected menus
+    menus = Menu.objects.filter(pk__in=pk_set) if pk_set else instance.menus.all()
+    for restaurant_id in set(menus.values_list('restaurant_id', flat=True)):
+        invalidate_exclusion_index_on_commit(restaurant_id)
+        bump_change_version_on_commit(restaurant_id)
@@ -2,13 +2,63 @@
 Celery tasks for knowledge base synchronization.
 Handles async updates to ChromaDB when restaurant data changes.
 """
+import time
+from typing import Optional
+
 from celery import shared_task
 from django.apps import apps
+from django.db.models import Prefetch
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def _with_ingredients(menus):
+    """
+    Prefetch the ingredients of each menu, in connector order, with one extra query.
+    """
+    from restaurants.models import MenuIngredientsConnector
+
+    return menus.prefetch_related(
+        Prefetch(
+            'menuingredientsconnector_set',
+            queryset=MenuIngredientsConnector.objects.select_related('ingredient').order_by('id'),
+        )
+    )
+
+
+def _render_menus(menus, restaurant) -> list:
+    """
+    Render menus loaded with `_with_ingredients`.
+    """
+    from restaurants.documents import render_menu_document
+
+    return [
+        render_menu_document(menu, restaurant, [c.ingredient for c in menu.menuingredientsconnector_set.all()])
+        for menu in menus
+    ]
+
+
+def _render_restaurant(restaurant_uid: str):
+    """
+    Render every document of a restaurant in a constant number of queries.
+
+    Returns:
+        (restaurant, documents)
+    """
+    from restaurants.models import Restaurant, Menu, Ingredients
+    from restaurants.documents import render_restaurant_document, render_ingredient_document
+
+    restaurant = Restaurant.objects.get(uid=restaurant_uid)
+    menus = list(_with_ingredients(Menu.objects.filter(restaurant=restaurant).order_by('id')))
+    ingredients = Ingredients.objects.filter(restaurant=restaurant).order_by('id')
+
+    documents = [render_restaurant_document(restaurant, menus)]
+    documents.extend(_render_menus(menus, restaurant))
+    documents.extend(render_ingredient_document(ingredient, restaurant) for ingredient in ingredients)
+    return restaurant, documents
+
+
 @shared_task
 def sync_restaurant_to_knowledge(restaurant_uid: str):
     """
@@ -16,10 +66,14 @@ def sync_restaurant_to_knowledge(restaurant_uid: str):
 
     Args:
         restaurant_uid: Restaurant UID to sync
+
+    Returns:
+        Dict with embedded and skipped document counts
     """
     try:
-        from restaurants.models import Restaurant, Menu, MenuIngredientsConnector
-        from chat.knowledge import get_restaurant_knowledge
+        from restaurants.models import Restaurant, Menu
+        from restaurants.documents import render_restaurant_document
+        from chat.knowledge import get_restaurant_knowledge, bump_knowledge_version, upsert_documents
 
         # Get restaurant
         restaurant = Restaurant.objects.get(uid=restaurant_uid)
@@ -28,36 +82,21 @@ def sync_restaurant_to_knowledge(restaurant_uid: str):
         knowledge = get_restaurant_knowledge(str(restaurant.uid))
 
         # Get all menus for this restaurant to provide a high-level overview
-        menus = Menu.objects.filter(restaurant=restaurant)
-        menu_items_list = [f"- {m.name}: ${m.price}" for m in menus]
-        menu_overview = "\n".join(menu_items_list) if menu_items_list else "No menu items currently available."
-
-        # Prepare restaurant document
-        restaurant_doc = f"""
-RESTAURANT: {restaurant.name}
-DESCRIPTION: {restaurant.description}
-WEBSITE: {restaurant.website_url or 'N/A'}
-FACEBOOK: {restaurant.facebook_url or 'N/A'}
-TWITTER: {restaurant.twitter_url or 'N/A'}
-INSTAGRAM: {restaurant.instagram_url or 'N/A'}
-YOUTUBE: {restaurant.youtube_url or 'N/A'}
-
-FULL MENU OVERVIEW:
-{menu_overview}
-"""
-        logger.info(f"restaurant_doc:  {restaurant_doc}")
-
-        # Add restaurant info to knowledge base
-        knowledge.insert(
-            text_content=restaurant_doc,
-            metadata={
-                "type": "restaurant",
-                "restaurant_uid": str(restaurant.uid),
-                "restaurant_name": restaurant.name,
-            }
-        )
+        menus = Menu.objects.filter(restaurant=restaurant).only('name', 'price')
+        document = render_restaurant_document(restaurant, menus)
+
+        # Add restaurant info to knowledge base (skipped if unchanged)
+        stats = upsert_documents(knowledge, [document])
+
+        if stats.embedded:
+            # Invalidate answers cached against the previous knowledge
+            bump_knowledge_version(str(restaurant.uid))
 
-        logger.info(f"Synced restaurant {restaurant.name} to knowledge base")
+        logger.info(
+            f"Synced restaurant {restaurant.name} to knowledge base "
+            f"(embedded={stats.embedded} skipped={stats.skipped})"
+        )
+        return stats.as_dict()
 
     except Exception as e:
         logger.error(f"Error syncing restaurant {restaurant_uid}: {str(e)}", exc_info=True)
@@ -70,53 +109,40 @@ def sync_menu_to_knowledge(menu_uid: str):
 
     Args:
         menu_uid: Menu UID to sync
+
+    Returns:
+        Dict with embedded and skipped document counts
     """
     try:
-        from restaurants.models import Menu, MenuIngredientsConnector, Ingredients
-        from chat.knowledge import get_restaurant_knowledge
+        from restaurants.models import Menu, Ingredients
+        from restaurants.documents import render_menu_document
+        from chat.knowledge import get_restaurant_knowledge, bump_knowledge_version, upsert_documents
 
         # Get menu item
-        menu = Menu.objects.get(uid=menu_uid)
+        menu = Menu.objects.select_related('restaurant').get(uid=menu_uid)
         restaurant = menu.restaurant
 
         # Get knowledge base for this restaurant
         knowledge = get_restaurant_knowledge(str(restaurant.uid))
 
         # Get ingredients for this menu item
-        menu_ingredients = MenuIngredientsConnector.objects.filter(menu=menu).select_related('ingredient')
-        ingredient_names = [mi.ingredient.name for mi in menu_ingredients]
-        ingredient_details = [
-            f"{mi.ingredient.name}: {mi.ingredient.description or 'No description'}"
-            for mi in menu_ingredients
-        ]
-
-        # Prepare menu document with extra keywords for better search
-        menu_doc = f"""
-MENU ITEM / FOOD: {menu.name}
-RESTAURANT: {restaurant.name}
-DESCRIPTION: {menu.description or 'No description provided'}
-PRICE: ${menu.price}
-INGREDIENTS: {', '.join(ingredient_names) if ingredient_names else 'No ingredients listed'}
-
-FOOD DETAILS:
-{chr(10).join(ingredient_details) if ingredient_details else 'No ingredient details available'}
-"""
-
-        # Add menu to knowledge base
-        knowledge.insert(
-            text_content=menu_doc,
-            metadata={
-                "type": "menu",
-                "restaurant_uid": str(restaurant.uid),
-                "restaurant_name": restaurant.name,
-                "menu_uid": str(menu.uid),
-                "menu_name": menu.name,
-                "price": str(menu.price),
-                "ingredients": ingredient_names,
-            }
+        ingredients = Ingredients.objects.filter(menuingredientsconnector__menu=menu).order_by(
+            'menuingredientsconnector__id'
         )
+        document = render_menu_document(menu, restaurant, ingredients)
+
+        # Add menu to knowledge base (skipped if unchanged)
+        stats = upsert_documents(knowledge, [document])
 
-        logger.info(f"Synced menu item {menu.name} to knowledge base")
+        if stats.embedded:
+            # Invalidate answers cached against the previous knowledge
+            bump_knowledge_version(str(restaurant.uid))
+
+        logger.info(
+            f"Synced menu item {menu.name} to knowledge base "
+            f"(embedded={stats.embedded} skipped={stats.skipped})"
+        )
+        return stats.as_dict()
 
     except Exception as e:
         logger.error(f"Error syncing menu {menu_uid}: {str(e)}", exc_info=True)
@@ -126,47 +152,45 @@ FOOD DETAILS:
 def sync_ingredient_to_knowledge(ingredient_uid: str):
     """
     Sync an ingredient to knowledge base.
-    Also re-syncs all menu items using this ingredient.
+    Also re-syncs all menu items using this ingredient, loaded in a constant
+    number of queries and embedded together with the ingredient in batches.
 
     Args:
         ingredient_uid: Ingredient UID to sync
+
+    Returns:
+        Dict with embedded and skipped document counts
     """
     try:
-        from restaurants.models import Ingredients, MenuIngredientsConnector
-        from chat.knowledge import get_restaurant_knowledge
+        from restaurants.models import Ingredients, Menu
+        from restaurants.documents import render_ingredient_document
+        from chat.knowledge import get_restaurant_knowledge, bump_knowledge_version, upsert_in_batches
 
         # Get ingredient
-        ingredient = Ingredients.objects.get(uid=ingredient_uid)
+        ingredient = Ingredients.objects.select_related('restaurant').get(uid=ingredient_uid)
         restaurant = ingredient.restaurant
 
         # Get knowledge base
         knowledge = get_restaurant_knowledge(str(restaurant.uid))
 
-        # Prepare ingredient document
-        ingredient_doc = f"""
-Ingredient: {ingredient.name}
-Restaurant: {restaurant.name}
-Description: {ingredient.description or 'No description provided'}
-"""
-
-        # Add ingredient to knowledge base
-        knowledge.insert(
-            text_content=ingredient_doc,
-            metadata={
-                "type": "ingredient",
-                "restaurant_uid": str(restaurant.uid),
-                "restaurant_name": restaurant.name,
-                "ingredient_uid": str(ingredient.uid),
-                "ingredient_name": ingredient.name,
-            }
+        # All menu items using this ingredient, with their ingredients
+        menus = _with_ingredients(
+            Menu.objects.filter(menuingredientsconnector__ingredient=ingredient).distinct().order_by('id')
         )
+        documents = [render_ingredient_document(ingredient, restaurant)] + _render_menus(menus, restaurant)
 
-        # Re-sync all menu items using this ingredient
-        menu_connectors = MenuIngredientsConnector.objects.filter(ingredient=ingredient)
-        for connector in menu_connectors:
-            sync_menu_to_knowledge.delay(str(connector.menu.uid))
+        # Add the ingredient and re-sync its menus (unchanged documents are skipped)
+        stats = upsert_in_batches(knowledge, documents)
 
-        logger.info(f"Synced ingredient {ingredient.name} to knowledge base")
+        if stats.embedded:
+            # Invalidate answers cached against the previous knowledge
+            bump_knowledge_version(str(restaurant.uid))
+
+        logger.info(
+            f"Synced ingredient {ingredient.name} and {len(documents) - 1} menu item(s) to knowledge base "
+            f"(embedded={stats.embedded} skipped={stats.skipped})"
+        )
+        return stats.as_dict()
 
     except Exception as e:
         logger.error(f"Error syncing ingredient {ingredient_uid}: {str(e)}", exc_info=True)
@@ -183,7 +207,17 @@ def remove_from_knowledge(restaurant_uid: str, doc_type: str, doc_uid: str):
         doc_uid: Document UID to remove
     """
     try:
-        from chat.knowledge import get_restaurant_knowledge
+        from chat.invalidation import invalidate_restaurant
+        from chat.knowledge import get_restaurant_knowledge, bump_knowledge_version, drop_active_collection
+
+        if doc_type == 'restaurant':
+            # Deleted restaurant: drop its collection pointer, its knowledge, agents and
+            # answers in every process, then the collection itself
+            collection_name = drop_active_collection(restaurant_uid)
+            invalidate_restaurant(restaurant_uid)
+            delete_knowledge_collection(collection_name)
+            logger.info(f"Removed restaurant {doc_uid} and its collection {collection_name} from knowledge base")
+            return
 
         # Get knowledge base
         knowledge = get_restaurant_knowledge(restaurant_uid)
@@ -191,6 +225,7 @@ def remove_from_knowledge(restaurant_uid: str, doc_type: str, doc_uid: str):
         # Remove by metadata
         metadata_key = f"{doc_type}_uid"
         knowledge.remove_vectors_by_metadata({metadata_key: doc_uid})
+        bump_knowledge_version(restaurant_uid)
         logger.info(f"Removed {doc_type} {doc_uid} from knowledge base")
 
     except Exception as e:
@@ -198,29 +233,184 @@ def remove_from_knowledge(restaurant_uid: str, doc_type: str, doc_uid: str):
 
 
 @shared_task
-def bulk_sync_restaurant_knowledge(restaurant_uid: str):
+def bulk_sync_restaurant_knowledge(restaurant_uid: str, batch_size: Optional[int] = None):
     """
     Perform a complete sync of all restaurant data to knowledge base.
-    Useful for initial setup or rebuilding knowledge base.
+    Useful for initial setup; `rebuild_restaurant_knowledge` rebuilds without downtime.
+
+    All documents are rendered in one pass over prefetched data, then embedded
+    and written to Chroma in batches, instead of one task per menu.
 
     Args:
         restaurant_uid: Restaurant UID to sync
+        batch_size: Documents per batch (defaults to KNOWLEDGE_EMBED_BATCH_SIZE)
+
+    Returns:
+        Dict with embedded and skipped document counts, duration and docs/sec
     """
     try:
-        from restaurants.models import Restaurant, Menu
+        from chat.knowledge import get_restaurant_knowledge, bump_knowledge_version, upsert_in_batches
 
-        # Sync restaurant info
-        sync_restaurant_to_knowledge(restaurant_uid)
+        started = time.perf_counter()
+        restaurant, documents = _render_restaurant(restaurant_uid)
 
-        # Get all menus for this restaurant
-        restaurant = Restaurant.objects.get(uid=restaurant_uid)
-        menus = Menu.objects.filter(restaurant=restaurant)
+        # Embed and write in batches (unchanged documents are skipped)
+        knowledge = get_restaurant_knowledge(str(restaurant.uid))
+        stats = upsert_in_batches(knowledge, documents, batch_size)
 
-        # Sync each menu (which will also sync ingredients)
-        for menu in menus:
-            sync_menu_to_knowledge.delay(str(menu.uid))
+        if stats.embedded:
+            # Invalidate answers cached against the previous knowledge
+            bump_knowledge_version(str(restaurant.uid))
 
-        logger.info(f"Bulk sync initiated for restaurant {restaurant_uid}")
+        seconds = time.perf_counter() - started
+        docs_per_sec = len(documents) / seconds if seconds else 0.0
+        logger.info(
+            f"Bulk synced restaurant {restaurant.name} to knowledge base: {len(documents)} documents "
+            f"in {seconds:.2f}s ({docs_per_sec:.1f} docs/sec, embedded={stats.embedded} skipped={stats.skipped})"
+        )
+        return {
+            **stats.as_dict(),
+            'documents': len(documents),
+            'seconds': round(seconds, 3),
+            'docs_per_sec': round(docs_per_sec, 1),
+        }
 
     except Exception as e:
         logger.error(f"Error in bulk sync for restaurant {restaurant_uid}: {str(e)}", exc_info=True)
+
+
+@shared_task
+def drain_knowledge_outbox():
+    """
+    Queue the knowledge syncs recorded in the outbox (run by Celery beat).
+
+    Returns:
+        Dict with drained rows, dispatched documents, failed rows and rows/sec
+    """
+    try:
+        from restaurants.dispatch import drain_outbox
+
+        started = time.perf_counter()
+        result = drain_outbox()
+        seconds = time.perf_counter() - started
+        if result['drained'] or result['failed']:
+            logger.info(
+                f"Drained knowledge outbox: drained={result['drained']} dispatched={result['dispatched']} "
+                f"failed={result['failed']} in {seconds:.2f}s ({result['drained'] / seconds:.1f} rows/sec)"
+            )
+        return result
+
+    except Exception as e:
+        logger.error(f"Error draining knowledge outbox: {str(e)}", exc_info=True)
+
+
+@shared_task
+def rebuild_restaurant_knowledge(restaurant_uid: str, batch_size: Optional[int] = None):
+    """
+    Blue/green rebuild of a restaurant's knowledge base without downtime.
+
+    Builds a new versioned collection next to the live one, validates its
+    document counts against the database, then atomically switches the
+    restaurant's active collection pointer. Changes synced to the old
+    collection during the build are caught up, and the old collection is
+    deleted after KNOWLEDGE_COLLECTION_GC_SECONDS. On any failure the live
+    collection stays active and the new one is dropped.
+
+    Args:
+        restaurant_uid: Restaurant UID to rebuild
+        batch_size: Documents per batch (defaults to KNOWLEDGE_EMBED_BATCH_SIZE)
+
+    Returns:
+        Dict with the outcome, collection names and document counts
+    """
+    try:
+        from restaurants.models import Menu, Ingredients
+        from chat.knowledge import (
+            KNOWLEDGE_COLLECTION_GC_SECONDS, build_knowledge, bump_knowledge_version, count_documents,
+            delete_collection, get_active_collection, get_restaurant_knowledge, prune_documents,
+            swap_active_collection, upsert_in_batches, versioned_collection_name,
+        )
+
+        started = time.perf_counter()
+        old_name, old_version = get_active_collection(restaurant_uid)
+        version = old_version + 1
+        new_name = versioned_collection_name(restaurant_uid, version)
+
+        # Build the new collection (dropping leftovers of an aborted rebuild)
+        delete_collection(new_name)
+        knowledge = build_knowledge(restaurant_uid, new_name)
+        restaurant, documents = _render_restaurant(restaurant_uid)
+        stats = upsert_in_batches(knowledge, documents, batch_size)
+
+        # Validate against the database before exposing it
+        expected = {
+            'restaurant': 1,
+            'menu': Menu.objects.filter(restaurant=restaurant).count(),
+            'ingredient': Ingredients.objects.filter(restaurant=restaurant).count(),
+        }
+        actual = count_documents(knowledge)
+        actual = {doc_type: actual.get(doc_type, 0) for doc_type in expected}
+        result = {'collection': new_name, 'previous': old_name, 'expected': expected, 'actual': actual}
+        if actual != expected:
+            delete_collection(new_name)
+            logger.error(f"Knowledge rebuild of {restaurant_uid} aborted: expected {expected}, built {actual}")
+            return {**result, 'swapped': False}
+
+        if not swap_active_collection(restaurant_uid, new_name, version, old_version):
+            delete_collection(new_name)
+            logger.warning(f"Knowledge rebuild of {restaurant_uid} lost to a concurrent rebuild")
+            return {**result, 'swapped': False}
+
+        # Catch up with changes made while building (unchanged documents are skipped)
+        restaurant, documents = _render_restaurant(restaurant_uid)
+        live = get_restaurant_knowledge(restaurant_uid)
+        catch_up = upsert_in_batches(live, documents, batch_size)
+        pruned = prune_documents(live, {document.key for document in documents})
+        bump_knowledge_version(restaurant_uid)
+
+        try:
+            delete_knowledge_collection.apply_async(args=(old_name,), countdown=KNOWLEDGE_COLLECTION_GC_SECONDS)
+        except Exception as e:
+            logger.error(f"Error queuing deletion of collection {old_name}: {str(e)}", exc_info=True)
+
+        seconds = time.perf_counter() - started
+        logger.info(
+            f"Rebuilt knowledge of restaurant {restaurant.name} into {new_name} in {seconds:.2f}s "
+            f"(embedded={stats.embedded} caught_up={catch_up.embedded} pruned={pruned})"
+        )
+        return {**result, 'swapped': True, 'embedded': stats.embedded + catch_up.embedded, 'pruned': pruned}
+
+    except Exception as e:
+        logger.error(f"Error rebuilding knowledge for restaurant {restaurant_uid}: {str(e)}", exc_info=True)
+
+
+@shared_task
+def delete_knowledge_collection(collection_name: str):
+    """
+    Garbage-collect a knowledge collection replaced by a rebuild or left by a deleted restaurant.
+
+    Args:
+        collection_name: Chroma collection to delete
+    """
+    try:
+        from chat.knowledge import delete_collection
+        from chat.models import KnowledgeCollection
+
+        if KnowledgeCollection.objects.filter(collection_name=collection_name).exists():
+            logger.warning(f"Collection {collection_name} is active again, not deleted")
+            return
+        delete_collection(collection_name)
+        logger.info(f"Deleted knowledge collection {collection_name}")
+
+    except Exception as e:
+        logger.error(f"Error deleting collection {collection_name}: {str(e)}", exc_info=True)
+
+
+# Sync task per knowledge document type
+SYNC_TASKS = {
+    'restaurant': sync_restaurant_to_knowledge,
+    'menu': sync_menu_to_knowledge,
+    'ingredient': sync_ingredient_to_knowledge,
+    # `restaurants.dispatch.KNOWLEDGE_BASE`: every document of a restaurant
+    'knowledge_base': bulk_sync_restaurant_knowledge,
+}
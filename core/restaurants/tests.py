@@ -1,3 +1,823 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+import uuid
+from types import SimpleNamespace
+from unittest.mock import patch
 
-# Create your tests here.
+import chromadb
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from accounts.models import User
+from accounts.choices import UserRole
+from chat.knowledge import (
+    clear_knowledge_cache, count_documents, get_active_collection, get_collection, get_restaurant_knowledge,
+    swap_active_collection,
+)
+from chat.models import KnowledgeCollection
+from chat.tools import make_exclusion_tool
+from restaurants.models import (
+    Restaurant, Menu, Ingredients, MenuIngredientsConnector, Allergen, KnowledgeOutbox,
+)
+from restaurants.exclusion_index import get_exclusion_index, resolve_terms
+from restaurants.importer import import_menus
+from restaurants.serializers import MenuSerializer
+from restaurants.tasks import (
+    bulk_sync_restaurant_knowledge, rebuild_restaurant_knowledge, remove_from_knowledge,
+    sync_ingredient_to_knowledge, sync_menu_to_knowledge, sync_restaurant_to_knowledge,
+)
+from restaurants.dispatch import dispatch_sync, drain_outbox
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class KnowledgeSyncPatchMixin:
+    """
+    Keep committed changes from queuing knowledge sync tasks during tests.
+    """
+    def setUp(self):
+        super().setUp()
+        self.dispatched = {}
+        for name in ('dispatch_sync', 'dispatch_removal'):
+            patcher = patch(f'restaurants.dispatch.{name}')
+            self.dispatched[name] = patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ExclusionIndexTests(KnowledgeSyncPatchMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.owner = User.objects.create_user(
+            email='owner@example.com', password='password', role=UserRole.RESTAURANT_OWNER
+        )
+        self.restaurant = Restaurant.objects.create(owner=self.owner, name='Thai Town', description='Thai food')
+        self.pad_thai = Menu.objects.create(restaurant=self.restaurant, name='Pad Thai', price='12.50')
+        self.curry = Menu.objects.create(restaurant=self.restaurant, name='Green Curry', price='14.00')
+        self.rice = Menu.objects.create(restaurant=self.restaurant, name='Sticky Rice', price='4.00')
+        self.basil = Ingredients.objects.create(restaurant=self.restaurant, name='Basil')
+        MenuIngredientsConnector.objects.create(restaurant=self.restaurant, menu=self.curry, ingredient=self.basil)
+        self.peanut = Allergen.objects.get(name='Peanut')
+        self.pad_thai.allergens.add(self.peanut)
+
+    def safe_names(self, *terms):
+        index = get_exclusion_index(self.restaurant.id)
+        allergen_ids, ingredient_ids, _ = resolve_terms(index, terms)
+        return [name for _, name, _ in index.excluding(allergen_ids, ingredient_ids)]
+
+    def test_excludes_allergens_and_ingredients(self):
+        self.assertEqual(self.safe_names('peanuts'), ['Green Curry', 'Sticky Rice'])
+        self.assertEqual(self.safe_names('peanut', 'basil'), ['Sticky Rice'])
+        self.assertEqual(self.safe_names(self.peanut.name_ja), ['Green Curry', 'Sticky Rice'])
+
+    def test_cached_index_answers_without_queries(self):
+        get_exclusion_index(self.restaurant.id)
+        with self.assertNumQueries(0):
+            get_exclusion_index(self.restaurant.id)
+
+    def test_signals_invalidate_index(self):
+        self.assertEqual(self.safe_names('peanut'), ['Green Curry', 'Sticky Rice'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rice.allergens.add(self.peanut)
+        self.assertEqual(self.safe_names('peanut'), ['Green Curry'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.peanut.menus.clear()
+        self.assertEqual(self.safe_names('peanut'), ['Pad Thai', 'Green Curry', 'Sticky Rice'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            MenuIngredientsConnector.objects.filter(menu=self.curry).delete()
+            Menu.objects.create(restaurant=self.restaurant, name='Basil Chicken', price='13.00')
+        self.assertEqual(len(self.safe_names('basil')), 4)
+
+    def test_agent_tool(self):
+        tool = make_exclusion_tool(str(self.restaurant.uid))
+        result = json.loads(async_to_sync(tool)('peanut, durian'))
+        self.assertEqual([item['name'] for item in result['safe_items']], ['Green Curry', 'Sticky Rice'])
+        self.assertEqual(result['unrecognized'], ['durian'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MenuExclusionFilterTests(KnowledgeSyncPatchMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.owner = User.objects.create_user(
+            email='owner@example.com', password='password', role=UserRole.RESTAURANT_OWNER
+        )
+        restaurant = Restaurant.objects.create(owner=self.owner, name='Thai Town', description='Thai food')
+        pad_thai = Menu.objects.create(restaurant=restaurant, name='Pad Thai', price='12.50')
+        curry = Menu.objects.create(restaurant=restaurant, name='Green Curry', price='14.00')
+        basil = Ingredients.objects.create(restaurant=restaurant, name='Basil')
+        MenuIngredientsConnector.objects.create(restaurant=restaurant, menu=curry, ingredient=basil)
+        self.peanut = Allergen.objects.get(name='Peanut')
+        pad_thai.allergens.add(self.peanut)
+        self.url = reverse('restaurants:menu-list')
+        self.client.force_authenticate(user=self.owner)
+
+    def names(self, response):
+        data = response.data['results'] if isinstance(response.data, dict) else response.data
+        return [menu['name'] for menu in data]
+
+    def test_exclude_allergens_by_id_or_name(self):
+        response = self.client.get(self.url, {'exclude_allergens': str(self.peanut.id)})
+        self.assertEqual(self.names(response), ['Green Curry'])
+
+        response = self.client.get(self.url, {'exclude_allergens': 'peanut', 'exclude_ingredients': 'basil'})
+        self.assertEqual(self.names(response), [])
+
+    def test_sql_fallback_matches_index(self):
+        with patch('restaurants.views.MenuListCreateView.EXCLUSION_INDEX_MAX_RESTAURANTS', 0):
+            response = self.client.get(self.url, {'exclude_allergens': 'Peanut'})
+        self.assertEqual(self.names(response), ['Green Curry'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MenuQueryCountTests(KnowledgeSyncPatchMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user(
+            email='owner@example.com', password='password', role=UserRole.RESTAURANT_OWNER
+        )
+        restaurant = Restaurant.objects.create(owner=self.owner, name='Thai Town', description='Thai food')
+        basil, chili = Ingredients.objects.bulk_create([
+            Ingredients(restaurant=restaurant, name='Basil'),
+            Ingredients(restaurant=restaurant, name='Chili'),
+        ])
+        menus = Menu.objects.bulk_create([
+            Menu(restaurant=restaurant, name=f'Dish {i}', price='10.00') for i in range(1000)
+        ])
+        MenuIngredientsConnector.objects.bulk_create([
+            MenuIngredientsConnector(restaurant=restaurant, menu=menu, ingredient=ingredient)
+            for menu in menus for ingredient in (chili, basil)
+        ])
+        peanut = Allergen.objects.get(name='Peanut')
+        Menu.allergens.through.objects.bulk_create([
+            Menu.allergens.through(menu=menu, allergen=peanut) for menu in menus
+        ])
+        self.menu = menus[0]
+        self.client.force_authenticate(user=self.owner)
+
+    def test_list_queries_do_not_grow_with_page_size(self):
+        url = reverse('restaurants:menu-list')
+        for page_size in (20, 100, 1000):
+            with self.subTest(page_size=page_size):
+                # owned restaurants (ETag), menus, connectors with ingredients, allergens
+                with self.assertNumQueries(4):
+                    response = self.client.get(url, {'page_size': page_size})
+                self.assertEqual(len(response.data['results']), page_size)
+
+        first = response.data['results'][0]
+        self.assertEqual([ingredient['name'] for ingredient in first['ingredients']], ['Chili', 'Basil'])
+        self.assertEqual([allergen['name'] for allergen in first['allergens']], ['Peanut'])
+
+    def test_keyset_pages_cost_the_same_at_any_depth(self):
+        # Identical timestamps: ties are broken by id
+        Menu.objects.update(created_at=timezone.now())
+        url = reverse('restaurants:menu-list')
+
+        pages, next_url = [], url
+        while next_url:
+            with self.assertNumQueries(4):
+                response = self.client.get(next_url, {'page_size': 300} if next_url == url else None)
+            pages.append([menu['id'] for menu in response.data['results']])
+            next_url = response.data['next']
+
+        ids = [menu_id for page in pages for menu_id in page]
+        self.assertEqual([len(page) for page in pages], [300, 300, 300, 100])
+        self.assertEqual(ids, sorted(Menu.objects.values_list('id', flat=True), reverse=True))
+
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([menu['id'] for menu in response.data['results']], pages[2])
+        self.assertEqual(self.client.get(url, {'cursor': 'bogus'}).status_code, 404)
+
+    def test_detail_queries(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('restaurants:menu-detail', args=[self.menu.id]))
+        self.assertEqual([ingredient['name'] for ingredient in response.data['ingredients']], ['Chili', 'Basil'])
+
+
+class MenuSerializerBulkWriteTests(KnowledgeSyncPatchMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        owner = User.objects.create_user(
+            email='owner@example.com', password='password', role=UserRole.RESTAURANT_OWNER
+        )
+        self.restaurant = Restaurant.objects.create(owner=owner, name='Thai Town', description='Thai food')
+        self.existing = Ingredients.objects.bulk_create([
+            Ingredients(restaurant=self.restaurant, name=f'Ingredient {i}') for i in range(5)
+        ])
+
+    def outbox_since(self, last_id):
+        return list(KnowledgeOutbox.objects.filter(id__gt=last_id).values_list('doc_type', 'doc_uid'))
+
+    def last_outbox_id(self):
+        return KnowledgeOutbox.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+    def ingredient_names(self, menu):
+        return list(
+            MenuIngredientsConnector.objects.filter(menu=menu).order_by('id').values_list('ingredient__name', flat=True)
+        )
+
+    def test_create_with_many_ingredients_takes_a_handful_of_queries(self):
+        names = [f'Ingredient {i}' for i in range(30)]
+        serializer = MenuSerializer(data={'name': 'Everything Curry', 'price': '15.00', 'ingredient_names': names})
+        serializer.is_valid(raise_exception=True)
+        last_id = self.last_outbox_id()
+
+        with CaptureQueriesContext(connection) as queries:
+            menu = serializer.save(restaurant=self.restaurant)
+
+        self.assertLessEqual(len(queries), 10)
+        self.assertEqual(self.ingredient_names(menu), names)
+        self.assertEqual(Ingredients.objects.filter(restaurant=self.restaurant).count(), 30)
+        outbox = [doc_type for doc_type, _ in self.outbox_since(last_id)]
+        # One entry for the menu's save and one for its links, however many links there are
+        self.assertEqual(outbox.count('menu'), 2)
+        self.assertEqual(outbox.count('ingredient'), 25)
+
+    def test_update_diffs_connectors(self):
+        first, second, third, fourth = self.existing[:4]
+        menu = Menu.objects.create(restaurant=self.restaurant, name='Green Curry', price='14.00')
+        kept = MenuIngredientsConnector.objects.bulk_create([
+            MenuIngredientsConnector(restaurant=self.restaurant, menu=menu, ingredient=ingredient)
+            for ingredient in (first, second, third)
+        ])[1:]
+        last_id = self.last_outbox_id()
+
+        serializer = MenuSerializer(
+            menu, data={'ingredient_ids': [second.id, third.id, fourth.id, -1]}, partial=True
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        connectors = MenuIngredientsConnector.objects.filter(menu=menu).order_by('id')
+        self.assertEqual([c.ingredient_id for c in connectors], [second.id, third.id, fourth.id])
+        self.assertEqual([c.id for c in connectors[:2]], [c.id for c in kept])
+        # Only re-syncs of the menu; the drain collapses them into one dispatch
+        self.assertEqual(set(self.outbox_since(last_id)), {('menu', str(menu.uid))})
+
+    def test_removing_links_takes_constant_queries(self):
+        def menu_with_all_ingredients(name):
+            menu = Menu.objects.create(restaurant=self.restaurant, name=name, price='10.00')
+            MenuIngredientsConnector.objects.bulk_create([
+                MenuIngredientsConnector(restaurant=self.restaurant, menu=menu, ingredient=ingredient)
+                for ingredient in self.existing
+            ])
+            return menu
+
+        def update(menu, kept):
+            serializer = MenuSerializer(menu, data={'ingredient_ids': [i.id for i in kept]}, partial=True)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+        one_removed, four_removed = menu_with_all_ingredients('Green Curry'), menu_with_all_ingredients('Red Curry')
+        with CaptureQueriesContext(connection) as queries:
+            update(one_removed, self.existing[:4])
+
+        with self.assertNumQueries(len(queries)):
+            update(four_removed, self.existing[:1])
+        self.assertEqual(self.ingredient_names(four_removed), ['Ingredient 0'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MenuImportTests(KnowledgeSyncPatchMixin, APITestCase):
+    CSV_FILE = (
+        'name,price,description,ingredients,allergens\n'
+        'Pad Thai,12.50,Noodles,Basil|Chili,peanut\n'
+        'Green Curry,not-a-price,,Basil,\n'
+        'Durian Cake,6.00,,,durian\n'
+        'Chili Basil Rice,9.00,,Chili|Basil|Chili,\n'
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user(
+            email='owner@example.com', password='password', role=UserRole.RESTAURANT_OWNER
+        )
+        self.restaurant = Restaurant.objects.create(owner=self.owner, name='Thai Town', description='Thai food')
+        self.basil = Ingredients.objects.create(restaurant=self.restaurant, name='Basil')
+
+    def menu_ingredients(self, name):
+        return list(
+            MenuIngredientsConnector.objects.filter(menu__name=name).order_by('id')
+            .values_list('ingredient__name', flat=True)
+        )
+
+    def test_import_in_chunks_reports_row_errors(self):
+        last_id = KnowledgeOutbox.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+        result = import_menus(self.restaurant, io.StringIO(self.CSV_FILE), 'csv', chunk_size=2)
+
+        self.assertEqual((result.created, result.failed), (2, 2))
+        self.assertEqual([error['line'] for error in result.errors], [3, 4])
+        self.assertIn('price', result.errors[0]['errors'])
+        self.assertEqual(self.menu_ingredients('Pad Thai'), ['Basil', 'Chili'])
+        # Chili is created once, by the first chunk, and reused by the second
+        self.assertEqual(self.menu_ingredients('Chili Basil Rice'), ['Chili', 'Basil'])
+        self.assertEqual(list(Menu.objects.get(name='Pad Thai').allergens.values_list('name', flat=True)), ['Peanut'])
+
+        # Each written chunk records a sync of the whole knowledge base, drained into one bulk sync
+        outbox = KnowledgeOutbox.objects.filter(id__gt=last_id)
+        self.assertEqual(
+            list(outbox.values_list('doc_type', 'doc_uid')), [('knowledge_base', str(self.restaurant.uid))] * 2
+        )
+        drain_outbox()
+        self.dispatched['dispatch_sync'].assert_called_once_with('knowledge_base', str(self.restaurant.uid))
+
+    def test_upload_endpoint(self):
+        self.client.force_authenticate(user=self.owner)
+        upload = SimpleUploadedFile('menus.csv', self.CSV_FILE.encode(), content_type='text/csv')
+
+        response = self.client.post(reverse('restaurants:menu-import'), {'file': upload}, format='multipart')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['data']['created'], response.data['data']['failed']), (2, 2))
+        self.assertTrue(response.data['data']['sync_queued'])
+
+    def test_unparsable_rows_are_reported(self):
+        broken_quote = 'name,price\nPad Thai,12.50\n"Green Curry,14.00\n'
+        result = import_menus(self.restaurant, io.StringIO(broken_quote), 'csv')
+        self.assertEqual((result.created, result.failed), (1, 1))
+        self.assertEqual(result.errors[0]['line'], 3)
+        self.assertIn('Invalid CSV', result.errors[0]['errors']['non_field_errors'][0])
+
+        self.client.force_authenticate(user=self.owner)
+        upload = SimpleUploadedFile('menus.csv', 'name,price\nCafé Latte,4.00\n'.encode('latin-1'))
+        response = self.client.post(reverse('restaurants:menu-import'), {'file': upload}, format='multipart')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['data']['failed'], 1)
+        self.assertIn('UTF-8', response.data['data']['errors'][0]['errors']['non_field_errors'][0])
+
+    def test_upload_endpoint_rejects_invalid_restaurant(self):
+        admin = User.objects.create_user(email='admin@example.com', password='password', role=UserRole.SUPER_ADMIN)
+        self.client.force_authenticate(user=admin)
+        upload = SimpleUploadedFile('menus.csv', self.CSV_FILE.encode(), content_type='text/csv')
+
+        response = self.client.post(
+            reverse('restaurants:menu-import'), {'file': upload, 'restaurant': 'abc'}, format='multipart'
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('restaurant', response.data)
+
+    def test_command_imports_json_lines(self):
+        lines = [
+            json.dumps({'name': 'Mango Sticky Rice', 'price': '5.00', 'ingredients': ['Mango'], 'allergens': []}),
+            '{not json',
+            '',
+            json.dumps({'name': 'Tom Yum', 'price': '8.00', 'allergens': [Allergen.objects.get(name='Peanut').name_ja]}),
+        ]
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as handle:
+            handle.write('\n'.join(lines))
+        self.addCleanup(os.remove, handle.name)
+
+        out = io.StringIO()
+        call_command('import_menus', str(self.restaurant.uid), handle.name, '--no-sync', stdout=out)
+
+        self.assertIn('Imported 2 menu(s), 1 row(s) failed', out.getvalue())
+        self.assertIn('line 2', out.getvalue())
+        self.assertEqual(self.menu_ingredients('Mango Sticky Rice'), ['Mango'])
+        self.assertFalse(KnowledgeOutbox.objects.filter(doc_type='knowledge_base').exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ConditionalGetTests(KnowledgeSyncPatchMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.owner = User.objects.create_user(
+            email='owner@example.com', password='password', role=UserRole.RESTAURANT_OWNER
+        )
+        self.restaurant = Restaurant.objects.create(owner=self.owner, name='Thai Town', description='Thai food')
+        self.menu = Menu.objects.create(restaurant=self.restaurant, name='Pad Thai', price='12.50')
+        self.detail_url = reverse('restaurants:restaurant-detail', args=[self.restaurant.id])
+        self.menu_url = reverse('restaurants:menu-list')
+        self.client.force_authenticate(user=self.owner)
+
+    def test_restaurant_detail_not_modified(self):
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.status_code, 200)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        # Visibility check only; nothing is loaded or serialized
+        with self.assertNumQueries(1):
+            response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get(self.detail_url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.restaurant.description = 'Spicy'
+            self.restaurant.save()
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['description'], 'Spicy')
+        self.assertNotEqual(
+            self.client.get(self.detail_url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304
+        )
+
+    def test_other_owner_gets_not_found(self):
+        etag = self.client.get(self.detail_url)['ETag']
+        other = User.objects.create_user(email='other@example.com', password='password', role=UserRole.RESTAURANT_OWNER)
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag).status_code, 404)
+
+    def test_menu_list_etag_follows_menu_data_and_query(self):
+        etag = self.client.get(self.menu_url)['ETag']
+        self.assertEqual(self.client.get(self.menu_url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertNotEqual(self.client.get(self.menu_url, {'exclude_allergens': 'peanut'})['ETag'], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.menu.allergens.add(Allergen.objects.get(name='Peanut'))
+        response = self.client.get(self.menu_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredients.objects.create(restaurant=self.restaurant, name='Basil')
+        self.assertEqual(self.client.get(self.menu_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class CountingEmbedder:
+    """
+    Deterministic embedder that counts the texts it embeds.
+    """
+    def __init__(self):
+        self.calls = 0
+
+    def get_embedding(self, text):
+        self.calls += 1
+        return [float(len(text)), float(text.count('a')), 1.0]
+
+
+class BatchCountingEmbedder(CountingEmbedder):
+    """
+    CountingEmbedder with a batch API, recording the size of each batch.
+    """
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def get_embeddings_batch(self, texts):
+        self.batches.append(len(texts))
+        return [self.get_embedding(text) for text in texts]
+
+
+def ephemeral_knowledge(embedder=None):
+    return SimpleNamespace(vector_db=SimpleNamespace(
+        client=chromadb.EphemeralClient(),
+        collection_name=f"test_{uuid.uuid4().hex}",
+        distance=SimpleNamespace(value='cosine'),
+        embedder=embedder or CountingEmbedder(),
+    ))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class IdempotentKnowledgeSyncTests(KnowledgeSyncPatchMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        owner = User.objects.create_user(
+            email='owner@example.com', password='password', role=UserRole.RESTAURANT_OWNER
+        )
+        self.restaurant = Restaurant.objects.create(owner=owner, name='Thai Town', description='Thai food')
+        self.menu = Menu.objects.create(restaurant=self.restaurant, name='Pad Thai', price='12.50')
+        self.knowledge = ephemeral_knowledge()
+        patcher = patch('chat.knowledge.get_restaurant_knowledge', return_value=self.knowledge)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.collection = get_collection(self.knowledge)
+
+    def menu_vectors(self):
+        return self.collection.get(where={'menu_uid': str(self.menu.uid)})
+
+    def test_unchanged_documents_are_skipped(self):
+        self.assertEqual(sync_menu_to_knowledge(str(self.menu.uid)), {'embedded': 1, 'skipped': 0})
+        self.assertEqual(sync_menu_to_knowledge(str(self.menu.uid)), {'embedded': 0, 'skipped': 1})
+        self.assertEqual(self.knowledge.vector_db.embedder.calls, 1)
+        self.assertEqual(len(self.menu_vectors()['ids']), 1)
+
+    def test_changed_document_replaces_previous_vectors(self):
+        # A copy appended by the old insert-on-every-save sync
+        self.collection.add(
+            ids=['legacy'], embeddings=[[1.0, 0.0, 0.0]], documents=['MENU ITEM / FOOD: Pad Thai (old)'],
+            metadatas=[{'type': 'menu', 'menu_uid': str(self.menu.uid), 'content_hash': 'old'}],
+        )
+        sync_menu_to_knowledge(str(self.menu.uid))
+
+        Menu.objects.filter(pk=self.menu.pk).update(price='13.00')
+        self.assertEqual(sync_menu_to_knowledge(str(self.menu.uid)), {'embedded': 1, 'skipped': 0})
+
+        vectors = self.menu_vectors()
+        self.assertEqual(vectors['ids'], [f"menu:{self.menu.uid}#0"])
+        self.assertIn('PRICE: $13.00', vectors['documents'][0])
+
+    def test_large_documents_are_chunked(self):
+        Menu.objects.bulk_create([
+            Menu(restaurant=self.restaurant, name=f"Dish {i} " + 'x' * 40, price='1.00') for i in range(300)
+        ])
+        sync_restaurant_to_knowledge(str(self.restaurant.uid))
+        vectors = self.collection.get(where={'type': 'restaurant'})
+        self.assertGreater(len(vectors['ids']), 1)
+        self.assertEqual({m['chunks'] for m in vectors['metadatas']}, {len(vectors['ids'])})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BulkKnowledgeSyncTests(KnowledgeSyncPatchMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        owner = User.objects.create_user(
+            email='owner@example.com', password='password', role=UserRole.RESTAURANT_OWNER
+        )
+        self.restaurant = Restaurant.objects.create(owner=owner, name='Thai Town', description='Thai food')
+        self.ingredients = Ingredients.objects.bulk_create([
+            Ingredients(restaurant=self.restaurant, name=f"Ingredient {i}") for i in range(3)
+        ])
+        self.menus = Menu.objects.bulk_create([
+            Menu(restaurant=self.restaurant, name=f"Dish {i}", price='10.00') for i in range(6)
+        ])
+        MenuIngredientsConnector.objects.bulk_create([
+            MenuIngredientsConnector(restaurant=self.restaurant, menu=menu, ingredient=ingredient)
+            for menu in self.menus for ingredient in self.ingredients
+        ])
+        self.knowledge = ephemeral_knowledge(BatchCountingEmbedder())
+        patcher = patch('chat.knowledge.get_restaurant_knowledge', return_value=self.knowledge)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_renders_with_constant_queries_and_embeds_in_batches(self):
+        with self.assertNumQueries(4):
+            result = bulk_sync_restaurant_knowledge(str(self.restaurant.uid), batch_size=4)
+
+        # 1 restaurant + 6 menus + 3 ingredients
+        self.assertEqual(result['documents'], 10)
+        self.assertEqual((result['embedded'], result['skipped']), (10, 0))
+        self.assertIn('docs_per_sec', result)
+        self.assertEqual(self.knowledge.vector_db.embedder.batches, [4, 4, 2])
+
+        menu_vectors = get_collection(self.knowledge).get(where={'menu_uid': str(self.menus[0].uid)})
+        self.assertIn('INGREDIENTS: Ingredient 0, Ingredient 1, Ingredient 2', menu_vectors['documents'][0])
+
+    def test_resync_skips_unchanged_documents(self):
+        bulk_sync_restaurant_knowledge(str(self.restaurant.uid), batch_size=4)
+        Menu.objects.filter(pk=self.menus[0].pk).update(price='11.00')
+
+        result = bulk_sync_restaurant_knowledge(str(self.restaurant.uid), batch_size=4)
+
+        # The changed menu and the restaurant overview listing its price
+        self.assertEqual((result['embedded'], result['skipped']), (2, 8))
+        self.assertEqual(len(get_collection(self.knowledge).get()['ids']), 10)
+
+    @patch('restaurants.tasks.sync_menu_to_knowledge.delay')
+    def test_ingredient_resyncs_its_menus_in_one_batch(self, menu_delay):
+        ingredient = self.ingredients[0]
+        with self.assertNumQueries(3):
+            result = sync_ingredient_to_knowledge(str(ingredient.uid))
+
+        # The ingredient and the 6 menus using it, embedded together
+        self.assertEqual(result, {'embedded': 7, 'skipped': 0})
+        self.assertEqual(self.knowledge.vector_db.embedder.batches, [7])
+        menu_delay.assert_not_called()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class KnowledgeRebuildTests(KnowledgeSyncPatchMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        clear_knowledge_cache()
+        self.addCleanup(clear_knowledge_cache)
+        owner = User.objects.create_user(
+            email='owner@example.com', password='password', role=UserRole.RESTAURANT_OWNER
+        )
+        self.restaurant = Restaurant.objects.create(owner=owner, name='Thai Town', description='Thai food')
+        self.uid = str(self.restaurant.uid)
+        self.menu = Menu.objects.create(restaurant=self.restaurant, name='Pad Thai', price='12.50')
+        Ingredients.objects.create(restaurant=self.restaurant, name='Peanut')
+
+        # Every collection name maps to a collection of one shared in-memory client
+        # (names are unique per test through the restaurant UID)
+        self.chroma, embedder = chromadb.EphemeralClient(), CountingEmbedder()
+        patcher = patch('chat.knowledge.get_chroma_db', side_effect=lambda name: SimpleNamespace(
+            client=self.chroma, collection_name=name, distance=SimpleNamespace(value='cosine'),
+            embedder=embedder, exists=lambda: True,
+        ))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('restaurants.tasks.delete_knowledge_collection.apply_async')
+        self.gc = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def live_documents(self):
+        return count_documents(get_restaurant_knowledge(self.uid))
+
+    def test_rebuild_swaps_pointer_and_collects_old_collection(self):
+        bulk_sync_restaurant_knowledge(self.uid)
+        old = get_restaurant_knowledge(self.uid)
+
+        result = rebuild_restaurant_knowledge(self.uid)
+
+        self.assertTrue(result['swapped'])
+        self.assertEqual(result['actual'], {'restaurant': 1, 'menu': 1, 'ingredient': 1})
+        self.assertEqual(get_active_collection(self.uid), (f"restaurant_{self.uid}_v1", 1))
+        knowledge = get_restaurant_knowledge(self.uid)
+        self.assertIsNot(knowledge, old)
+        self.assertTrue(knowledge.vector_db.collection_name.endswith('_v1'))
+        self.assertEqual(self.live_documents(), {'restaurant': 1, 'menu': 1, 'ingredient': 1})
+        self.gc.assert_called_once()
+        self.assertEqual(self.gc.call_args.kwargs['args'], (f"restaurant_{self.uid}",))
+
+        # The next rebuild moves on to a new version
+        self.assertEqual(rebuild_restaurant_knowledge(self.uid)['collection'], f"restaurant_{self.uid}_v2")
+
+    def test_failed_validation_keeps_live_collection(self):
+        with patch('chat.knowledge.count_documents', return_value={'restaurant': 1}):
+            result = rebuild_restaurant_knowledge(self.uid)
+
+        self.assertFalse(result['swapped'])
+        self.assertEqual(get_active_collection(self.uid), (f"restaurant_{self.uid}", 0))
+        self.gc.assert_not_called()
+
+    def test_lost_race_keeps_winner(self):
+        swap_active_collection(self.uid, f"restaurant_{self.uid}_v1", 1, expected_version=0)
+        self.assertFalse(swap_active_collection(self.uid, f"restaurant_{self.uid}_v1b", 1, expected_version=0))
+        self.assertEqual(get_active_collection(self.uid), (f"restaurant_{self.uid}_v1", 1))
+
+    def test_reader_racing_a_swap_cannot_cache_the_old_pointer(self):
+        read_first, swapped = QuerySet.first, []
+
+        def first_then_swap(queryset):
+            row = read_first(queryset)
+            if not swapped:
+                # The swap commits between the reader's database read and its cache write
+                swapped.append(swap_active_collection(self.uid, f"restaurant_{self.uid}_v1", 1, expected_version=0))
+            return row
+
+        with patch.object(QuerySet, 'first', first_then_swap):
+            self.assertEqual(get_active_collection(self.uid), (f"restaurant_{self.uid}", 0))
+        self.assertEqual(swapped, [True])
+        self.assertEqual(get_active_collection(self.uid), (f"restaurant_{self.uid}_v1", 1))
+
+    def test_restaurant_removal_drops_collection_and_pointer(self):
+        rebuild_restaurant_knowledge(self.uid)
+        collection_name = f"restaurant_{self.uid}_v1"
+
+        remove_from_knowledge(self.uid, 'restaurant', self.uid)
+
+        self.assertFalse(KnowledgeCollection.objects.filter(restaurant_uid=self.uid).exists())
+        self.assertEqual(get_active_collection(self.uid), (f"restaurant_{self.uid}", 0))
+        names = [getattr(collection, 'name', collection) for collection in self.chroma.list_collections()]
+        self.assertNotIn(collection_name, names)
+
+    def test_catch_up_prunes_records_deleted_during_build(self):
+        rebuild_restaurant_knowledge(self.uid)
+        Menu.objects.filter(pk=self.menu.pk).delete()
+
+        rebuild_restaurant_knowledge(self.uid)
+        self.assertEqual(self.live_documents(), {'restaurant': 1, 'ingredient': 1})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class KnowledgeOutboxTests(KnowledgeSyncPatchMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.owner = User.objects.create_user(
+            email='owner@example.com', password='password', role=UserRole.RESTAURANT_OWNER
+        )
+        self.restaurant = Restaurant.objects.create(owner=self.owner, name='Thai Town', description='Thai food')
+        KnowledgeOutbox.objects.all().delete()
+
+    def outbox(self):
+        return list(KnowledgeOutbox.objects.values_list('action', 'doc_type', 'doc_uid'))
+
+    def dispatched_syncs(self):
+        return [c.args for c in self.dispatched['dispatch_sync'].call_args_list]
+
+    def test_changes_are_dispatched_once_per_document(self):
+        with transaction.atomic():
+            menu = Menu.objects.create(restaurant=self.restaurant, name='Green Curry', price='14.00')
+            for name in ('Basil', 'Coconut', 'Chili'):
+                ingredient = Ingredients.objects.create(restaurant=self.restaurant, name=name)
+                MenuIngredientsConnector.objects.create(restaurant=self.restaurant, menu=menu, ingredient=ingredient)
+
+        outbox = self.outbox()
+        self.assertEqual(outbox.count(('sync', 'menu', str(menu.uid))), 4)
+        # Nothing talks to the broker until the outbox is drained
+        self.assertEqual(self.dispatched_syncs(), [])
+
+        drain_outbox()
+        self.assertEqual([args[0] for args in self.dispatched_syncs()].count('menu'), 1)
+        self.assertEqual(len(self.dispatched_syncs()), 4)
+        self.assertEqual(self.outbox(), [])
+
+    def test_rolled_back_changes_leave_no_rows(self):
+        menu, = Menu.objects.bulk_create([Menu(restaurant=self.restaurant, name='Green Curry', price='14.00')])
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    Menu.objects.create(restaurant=self.restaurant, name='Pad Thai', price='12.50')
+                    menu.save()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            # The row written in the rolled back savepoint is gone; the change is recorded again
+            menu.save()
+        self.assertEqual(self.outbox(), [('sync', 'menu', str(menu.uid))])
+
+    def test_failed_outbox_write_rolls_back_the_change(self):
+        menu, = Menu.objects.bulk_create([Menu(restaurant=self.restaurant, name='Green Curry', price='14.00')])
+        menu.name = 'Red Curry'
+        with patch.object(KnowledgeOutbox.objects, 'create', side_effect=DatabaseError('outbox down')):
+            with self.assertRaises(DatabaseError):
+                with transaction.atomic():
+                    menu.save()
+
+        self.assertEqual(Menu.objects.get(pk=menu.pk).name, 'Green Curry')
+        self.assertEqual(self.outbox(), [])
+
+    def test_latest_action_wins(self):
+        with transaction.atomic():
+            menu = Menu.objects.create(restaurant=self.restaurant, name='Pad Thai', price='12.50')
+            uid = str(menu.uid)
+            menu.delete()
+        self.assertEqual(self.outbox(), [('sync', 'menu', uid), ('remove', 'menu', uid)])
+
+        drain_outbox()
+        self.assertEqual(self.dispatched_syncs(), [])
+        self.dispatched['dispatch_removal'].assert_called_once_with('menu', uid, str(self.restaurant.uid))
+
+    def test_drain_coalesces_in_order_and_empties_outbox(self):
+        KnowledgeOutbox.objects.bulk_create([
+            KnowledgeOutbox(doc_type='menu', doc_uid='m1'),
+            KnowledgeOutbox(doc_type='menu', doc_uid='m2'),
+            KnowledgeOutbox(doc_type='menu', doc_uid='m1'),
+            KnowledgeOutbox(doc_type='ingredient', doc_uid='i1'),
+            KnowledgeOutbox(doc_type='restaurant', doc_uid='r1'),
+        ])
+
+        result = drain_outbox(batch_size=3)
+
+        self.assertEqual(result, {'drained': 5, 'dispatched': 4, 'failed': 0})
+        self.assertEqual(
+            self.dispatched_syncs(),
+            [('menu', 'm2'), ('menu', 'm1'), ('ingredient', 'i1'), ('restaurant', 'r1')],
+        )
+        self.assertEqual(self.outbox(), [])
+
+    def test_failed_dispatch_stays_in_outbox(self):
+        KnowledgeOutbox.objects.bulk_create([
+            KnowledgeOutbox(doc_type='menu', doc_uid='m1'),
+            KnowledgeOutbox(doc_type='menu', doc_uid='m2'),
+        ])
+        self.dispatched['dispatch_sync'].side_effect = (
+            lambda doc_type, uid: (_ for _ in ()).throw(ConnectionError('broker down')) if uid == 'm1' else None
+        )
+
+        self.assertEqual(drain_outbox(), {'drained': 1, 'dispatched': 1, 'failed': 1})
+        entry = KnowledgeOutbox.objects.get()
+        self.assertEqual((entry.doc_uid, entry.attempts, entry.last_error), ('m1', 1, 'broker down'))
+
+        # Retried once the broker is back
+        self.dispatched['dispatch_sync'].side_effect = None
+        self.assertEqual(drain_outbox()['drained'], 1)
+        self.assertEqual(self.outbox(), [])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SyncDebounceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @patch('restaurants.tasks.sync_menu_to_knowledge.apply_async')
+    def test_repeated_syncs_are_coalesced_across_processes(self, apply_async):
+        dispatch_sync('menu', 'm1')
+        dispatch_sync('menu', 'm1')
+        dispatch_sync('menu', 'm2')
+        self.assertEqual(
+            [c.kwargs['args'] for c in apply_async.call_args_list], [('m1',), ('m2',)]
+        )
+        self.assertTrue(all(c.kwargs['countdown'] > 0 for c in apply_async.call_args_list))
+
+        # Once the window has passed, a new change queues a new sync
+        cache.clear()
+        dispatch_sync('menu', 'm1')
+        self.assertEqual(apply_async.call_count, 3)
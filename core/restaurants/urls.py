@@ -4,6 +4,7 @@ from .views import (
     RestaurantDetailView,
     MenuListCreateView,
     MenuDetailView,
+    MenuImportView,
     IngredientListCreateView,
     IngredientDetailView
 )
@@ -18,6 +19,7 @@ urlpatterns = [
     # Menus
     path('menus/', MenuListCreateView.as_view(), name='menu-list'),
     path('menus/<int:pk>/', MenuDetailView.as_view(), name='menu-detail'),
+    path('menus/import/', MenuImportView.as_view(), name='menu-import'),
 
     # Ingredients
     path('ingredients/', IngredientListCreateView.as_view(), name='ingredient-list'),
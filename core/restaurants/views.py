@@ -1,11 +1,22 @@
+import io
+
 from rest_framework import generics, status, filters, serializers
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
+from django.db.models import Q
+from django.utils.http import urlencode
+
 from commons.permissions import IsSuperAdmin, IsPlatformAdmin, IsRestaurantOwner
+from commons.views import ConditionalGetMixin
 from restaurants.models import Restaurant, Menu, Ingredients
+from restaurants.exclusion_index import get_exclusion_index, resolve_terms, parse_id_list
+from restaurants.change_version import ALL, ALLERGENS, conditional_state, restaurant_scope
+from restaurants.importer import detect_format, import_menus
 from restaurants.serializers import (
     RestaurantSerializer,
     RestaurantCreateWithOwnerSerializer,
@@ -57,7 +68,7 @@ class RestaurantListCreateView(generics.ListCreateAPIView):
         }, status=status.HTTP_400_BAD_REQUEST)
 
 
-class RestaurantDetailView(generics.RetrieveUpdateDestroyAPIView):
+class RestaurantDetailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Restaurant.objects.all()
 
     def get_serializer_class(self):
@@ -79,21 +90,87 @@ class RestaurantDetailView(generics.RetrieveUpdateDestroyAPIView):
             return Restaurant.objects.filter(owner=user)
         return Restaurant.objects.none()
 
+    def get_conditional_state(self):
+        pk = self.kwargs['pk']
+        if not self.get_queryset().filter(pk=pk).exists():
+            # Not visible to this user: let the regular path answer 404
+            return None
+        return conditional_state([restaurant_scope(pk)], variant=f"restaurant:{pk}")
 
 
-
-class MenuListCreateView(generics.ListCreateAPIView):
+class MenuListCreateView(ConditionalGetMixin, generics.ListCreateAPIView):
 
     def get_serializer_class(self):
         return MenuSerializer
 
     permission_classes = [IsAuthenticated, IsRestaurantOwner | IsSuperAdmin | IsPlatformAdmin]
 
+    # Above this many restaurants in the result, exclusions are applied in SQL instead of the index
+    EXCLUSION_INDEX_MAX_RESTAURANTS = 20
+
     def get_queryset(self):
         user = self.request.user
         if user.role in ['super_admin', 'platform_admin']:
-            return Menu.objects.all()
-        return Menu.objects.filter(restaurant__owner=user)
+            queryset = Menu.objects.all()
+        else:
+            queryset = Menu.objects.filter(restaurant__owner=user)
+        if self.request.method == 'GET':
+            queryset = self.filter_exclusions(queryset)
+        # A page costs the same few queries whatever its size
+        return MenuSerializer.prefetch(queryset)
+
+    def get_conditional_state(self):
+        user = self.request.user
+        if user.role in ['super_admin', 'platform_admin']:
+            scopes = [ALL]
+        else:
+            scopes = [restaurant_scope(pk) for pk in Restaurant.objects.filter(owner=user).values_list('id', flat=True)]
+        # Filters, cursor and page size select what the response contains
+        query = urlencode(sorted(self.request.query_params.lists()), doseq=True)
+        return conditional_state(scopes + [ALLERGENS], variant=f"menus:{user.pk}:{query}")
+
+    def filter_exclusions(self, queryset):
+        """
+        Apply `?exclude_allergens=` and `?exclude_ingredients=` (comma-separated IDs or names).
+        """
+        allergen_ids, allergen_names = parse_id_list(self.request.query_params.get('exclude_allergens'))
+        ingredient_ids, ingredient_names = parse_id_list(self.request.query_params.get('exclude_ingredients'))
+        if not (allergen_ids or allergen_names or ingredient_ids or ingredient_names):
+            return queryset
+
+        restaurant_ids = list(queryset.order_by().values_list('restaurant_id', flat=True).distinct())
+        if len(restaurant_ids) > self.EXCLUSION_INDEX_MAX_RESTAURANTS:
+            allergen_q = Q(allergens__id__in=allergen_ids)
+            for name in allergen_names:
+                allergen_q |= Q(allergens__name__iexact=name) | Q(allergens__name_ja=name)
+            ingredient_q = Q(menuingredientsconnector__ingredient_id__in=ingredient_ids)
+            for name in ingredient_names:
+                ingredient_q |= Q(menuingredientsconnector__ingredient__name__iexact=name)
+            excluded = Menu.objects.filter(allergen_q | ingredient_q).values('id')
+            return queryset.exclude(id__in=excluded)
+
+        safe_ids = []
+        for restaurant_id in restaurant_ids:
+            index = get_exclusion_index(restaurant_id)
+            named_allergens, _, _ = resolve_terms(index, allergen_names)
+            _, named_ingredients, _ = resolve_terms(index, ingredient_names)
+            safe_ids.extend(index.excluding_ids(allergen_ids + named_allergens, ingredient_ids + named_ingredients))
+        return queryset.filter(id__in=safe_ids)
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'exclude_allergens', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                description="Comma-separated allergen IDs or names; only menus without them are listed."
+            ),
+            openapi.Parameter(
+                'exclude_ingredients', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                description="Comma-separated ingredient IDs or names; only menus without them are listed."
+            ),
+        ]
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
 
     def perform_create(self, serializer):
         user = self.request.user
@@ -108,6 +185,60 @@ class MenuListCreateView(generics.ListCreateAPIView):
             serializer.save()
 
 
+class MenuImportView(APIView):
+    """
+    Bulk import menus from an uploaded CSV or JSON Lines file (see `restaurants.importer`).
+    """
+    permission_classes = [IsAuthenticated, IsRestaurantOwner | IsSuperAdmin | IsPlatformAdmin]
+    parser_classes = [MultiPartParser]
+
+    def get_restaurant(self):
+        user = self.request.user
+        if user.role == 'restaurant_owner':
+            return Restaurant.objects.filter(owner=user).first()
+        restaurant_id = self.request.data.get('restaurant')
+        if not restaurant_id:
+            raise serializers.ValidationError({'restaurant': 'This field is required.'})
+        try:
+            restaurant_id = serializers.IntegerField().run_validation(restaurant_id)
+        except serializers.ValidationError as e:
+            raise serializers.ValidationError({'restaurant': e.detail})
+        return Restaurant.objects.filter(id=restaurant_id).first()
+
+    @swagger_auto_schema(
+        operation_description="Import menus with ingredients and allergens from a CSV or JSON Lines file. "
+                              "Invalid rows are reported by line and skipped.",
+        manual_parameters=[
+            openapi.Parameter('file', openapi.IN_FORM, type=openapi.TYPE_FILE, required=True,
+                              description=".csv (list columns separated by |) or .jsonl file"),
+            openapi.Parameter('restaurant', openapi.IN_FORM, type=openapi.TYPE_INTEGER,
+                              description="Restaurant ID (admins only)"),
+        ]
+    )
+    def post(self, request, *args, **kwargs):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'errors': {'file': 'This field is required.'}}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            file_format = detect_format(upload.name)
+        except ValueError as e:
+            return Response({'errors': {'file': str(e)}}, status=status.HTTP_400_BAD_REQUEST)
+
+        restaurant = self.get_restaurant()
+        if restaurant is None:
+            return Response({'message': Message(resource="Restaurant").not_found()}, status=status.HTTP_404_NOT_FOUND)
+
+        # Large uploads are spooled to disk by Django; rows are read from it as they are imported
+        stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+        result = import_menus(restaurant, stream, file_format)
+
+        message = Message(resource="Menus")
+        return Response({
+            'message': message.created_success() if result.created else message.created_failed(),
+            'data': result.as_dict(),
+        }, status=status.HTTP_201_CREATED if result.created else status.HTTP_400_BAD_REQUEST)
+
+
 class MenuDetailView(generics.RetrieveUpdateDestroyAPIView):
 
     def get_serializer_class(self):
@@ -118,8 +249,10 @@ class MenuDetailView(generics.RetrieveUpdateDestroyAPIView):
     def get_queryset(self):
         user = self.request.user
         if user.role in ['super_admin', 'platform_admin']:
-            return Menu.objects.all()
-        return Menu.objects.filter(restaurant__owner=user)
+            queryset = Menu.objects.all()
+        else:
+            queryset = Menu.objects.filter(restaurant__owner=user)
+        return MenuSerializer.prefetch(queryset)
 
 
 class IngredientListCreateView(generics.ListCreateAPIView):